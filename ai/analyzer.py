@@ -1,10 +1,16 @@
 import os
 import json
+import asyncio
 import logging
 from decimal import Decimal
 from datetime import date, datetime
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion
 from dotenv import load_dotenv
+from ai.batch import DEFAULT_BATCH_DIR, BatchRunner
+from ai.cache import AnalysisCache
+from ai.prompt import PromptCompiler, completion_budget, estimate_message_tokens
+from ai.rate_limiter import RateLimiter, call_with_retries
 
 load_dotenv()
 
@@ -19,10 +25,22 @@ class CustomJSONEncoder(json.JSONEncoder):
 
 
 class CustomerAnalyzer:
-    def __init__(self, temperature=None):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    def __init__(self, temperature=None, base_url=None, concurrency=8, requests_per_minute=None,
+                 tokens_per_minute=None, max_retries=5, cache=None, prompt_format='compact', token_budget=None,
+                 max_completion_tokens=4000):
+        self.base_url = base_url or os.getenv('OPENAI_BASE_URL')
+        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=self.base_url)
+        self.async_client = None  # Created on first async call, bound to that event loop
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self._semaphore = None
+        self.cache = cache
         self.model = os.getenv('OPENAI_MODEL', 'gpt-4')
         self.temperature = temperature if temperature is not None else float(os.getenv('TEMPERATURE', 0.7))
+        # Per-request limit on estimated prompt plus completion tokens
+        self.token_budget = token_budget
+        self.max_completion_tokens = max_completion_tokens
         self.system_prompt = """You are a Gatekeeper contract management software expert. Analyze customer usage data with precise interpretation of key features:
         0. Overview
         - Focus on key metrics and risks and provide a short paragraphph summary of the analysis.
@@ -78,35 +96,192 @@ class CustomerAnalyzer:
 
         Focus on actual metrics and their business impact -*** YOU NEED TO BE CONSISTENT IN YOUR RESPONSES IF YOU ARE SENT THE SAME DATASET I EXPECT THE SAME RESPONSE.*** When analyzing e-signatures, remember that "DocuSign Disabled" is not a negative if the customer is actively using Gatekeeper's e-signature solution. Provide specific, data-driven insights. ****
         YOU MUST ALWAYS REPLY IN A FRIENDLY POSITIVE WAY ****"""
+        self.prompt = PromptCompiler(self.system_prompt, prompt_format, CustomJSONEncoder)
+
+    def _build_messages(self, customer_data):
+        """Return (messages, estimated prompt tokens, max_tokens within the token budget)."""
+        messages = self.prompt.build_messages(customer_data)
+        prompt_tokens = estimate_message_tokens(messages)
+        max_tokens = completion_budget(prompt_tokens, self.max_completion_tokens, self.token_budget)
+        return messages, prompt_tokens, max_tokens
+
+    def _build_result(self, customer_data, response, estimated_prompt_tokens=None):
+        usage = response.usage
+        logging.info(f"Analysis of {customer_data.get('customer')}: {usage.prompt_tokens} prompt token(s) "
+                     f"(estimated {estimated_prompt_tokens}), {usage.completion_tokens} completion token(s)")
+        return {
+            "customer_name": customer_data.get('customer'),
+            "analysis": response.choices[0].message.content,
+            "usage_tokens": usage.total_tokens,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "raw_data": customer_data
+        }
+
+    def _cache_key(self, customer_data):
+        return AnalysisCache.make_key({
+            'customer_data': customer_data,
+            'model': self.model,
+            'temperature': self.temperature,
+            'system_prompt': self.system_prompt,
+            'prompt_format': self.prompt.prompt_format
+        }, encoder=CustomJSONEncoder)
+
+    def _cached_result(self, customer_data):
+        """Return (cache key, cached analysis result or None)."""
+        if self.cache is None:
+            return None, None
+        key = self._cache_key(customer_data)
+        entry = self.cache.get(key)
+        if entry is None:
+            return key, None
+        logging.debug(f"Analysis cache hit for customer: {customer_data.get('customer')}")
+        return key, {
+            "customer_name": customer_data.get('customer'),
+            "analysis": entry['analysis'],
+            "usage_tokens": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cached": True,
+            "raw_data": customer_data
+        }
+
+    def _store_result(self, key, analysis_result):
+        if self.cache is not None:
+            self.cache.put(key, analysis_result['analysis'], analysis_result['usage_tokens'])
 
     def analyze_customer(self, customer_data):
         try:
-            data_str = json.dumps(customer_data, indent=2, cls=CustomJSONEncoder)
-            logging.debug(f"Preparing analysis for customer: {customer_data.get('customer')}")
+            key, cached = self._cached_result(customer_data)
+            if cached:
+                return cached
 
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user",
-                 "content": f"Analyze this customer's usage data focusing on key metrics and risks:\n{data_str}"}
-            ]
+            logging.debug(f"Preparing analysis for customer: {customer_data.get('customer')}")
+            messages, prompt_tokens, max_tokens = self._build_messages(customer_data)
 
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 temperature=self.temperature,
-                max_tokens=4000
+                max_tokens=max_tokens
             )
 
-            analysis_result = {
-                "customer_name": customer_data.get('customer'),
-                "analysis": response.choices[0].message.content,
-                "usage_tokens": response.usage.total_tokens,
-                "raw_data": customer_data
-            }
+            analysis_result = self._build_result(customer_data, response, prompt_tokens)
+            self._store_result(key, analysis_result)
 
             logging.debug(f"Analysis completed for customer: {customer_data.get('customer')}")
             return analysis_result
 
         except Exception as e:
             logging.error(f"OpenAI API error for customer {customer_data.get('customer')}: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    async def analyze_customer_async(self, customer_data):
+        """
+        Async variant of analyze_customer.
+
+        At most self.concurrency requests are in flight at once, requests share
+        the requests/min and tokens/min limiter, and rate-limit, timeout,
+        connection and 5xx errors are retried with jittered exponential backoff.
+        """
+        if self.async_client is None:
+            # Retries are handled by call_with_retries so they respect the limiter
+            self.async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), base_url=self.base_url,
+                                            max_retries=0)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        customer_name = customer_data.get('customer')
+        try:
+            key, cached = self._cached_result(customer_data)
+            if cached:
+                return cached
+
+            logging.debug(f"Preparing analysis for customer: {customer_name}")
+            messages, prompt_tokens, max_tokens = self._build_messages(customer_data)
+
+            async with self._semaphore:
+                response = await call_with_retries(
+                    lambda: self.async_client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        max_tokens=max_tokens
+                    ),
+                    limiter=self.limiter,
+                    max_retries=self.max_retries,
+                    label=customer_name
+                )
+
+            analysis_result = self._build_result(customer_data, response, prompt_tokens)
+            self._store_result(key, analysis_result)
+
+            logging.debug(f"Analysis completed for customer: {customer_name}")
+            return analysis_result
+
+        except Exception as e:
+            logging.error(f"OpenAI API error for customer {customer_name}: {e}")
+            raise
+
+    async def analyze_customers_async(self, customers_data):
+        """
+        Analyze many customers concurrently.
+
+        :param customers_data: List of customer data dicts
+        :return: List with the analysis result or the raised exception for each customer, in input order
+        """
+        return await asyncio.gather(
+            *(self.analyze_customer_async(customer_data) for customer_data in customers_data),
+            return_exceptions=True
+        )
+
+    def analyze_customers_batch(self, customers_data, batch_dir=DEFAULT_BATCH_DIR, poll_interval=30, timeout=None,
+                                label='batch'):
+        """
+        Analyze many customers with one submission to the OpenAI Batch API.
+
+        Cached analyses are served from the cache; the remaining customers'
+        requests are written to a JSONL batch file, submitted and polled
+        until the batch finishes (see ai/batch.py).
+
+        :param customers_data: List of customer data dicts
+        :param batch_dir: Directory the batch input and result files are kept in
+        :param poll_interval: Seconds between batch status checks
+        :param timeout: Seconds to wait for the batch before cancelling it (default: its completion window)
+        :param label: Prefix of the batch file names
+        :return: List with the analysis result or the exception for each customer, in input order
+        """
+        results = [None] * len(customers_data)
+        requests = {}
+        pending = {}
+        for index, customer_data in enumerate(customers_data):
+            try:
+                key, cached = self._cached_result(customer_data)
+                if cached:
+                    results[index] = cached
+                    continue
+                messages, prompt_tokens, max_tokens = self._build_messages(customer_data)
+            except Exception as e:
+                logging.error(f"Could not prepare analysis for customer {customer_data.get('customer')}: {e}")
+                results[index] = e
+                continue
+            custom_id = f"{index}-{customer_data.get('tenant_id')}"
+            requests[custom_id] = {
+                'model': self.model,
+                'messages': messages,
+                'temperature': self.temperature,
+                'max_tokens': max_tokens
+            }
+            pending[custom_id] = (index, key, prompt_tokens)
+
+        responses = BatchRunner(self.client, batch_dir, poll_interval, timeout).run(requests, label) if requests else {}
+        for custom_id, (index, key, prompt_tokens) in pending.items():
+            customer_data = customers_data[index]
+            response = responses[custom_id]
+            if isinstance(response, Exception):
+                logging.error(f"OpenAI batch error for customer {customer_data.get('customer')}: {response}")
+                results[index] = response
+                continue
+            analysis_result = self._build_result(customer_data, ChatCompletion.model_validate(response), prompt_tokens)
+            self._store_result(key, analysis_result)
+            results[index] = analysis_result
+        return results
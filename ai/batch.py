@@ -0,0 +1,177 @@
+# ai/batch.py
+"""
+Offline analysis through the OpenAI Batch API.
+
+Every request is written as one line of a JSONL file, the file is uploaded
+with purpose 'batch' and submitted to /v1/chat/completions. The batch is
+polled until it reaches a final status, then its output and error files are
+matched back to the requests by custom_id. Batches draw on a rate-limit pool
+separate from synchronous requests and finish within the 24h completion
+window, which suits nightly runs.
+
+Requests beyond the per-batch limits are split over several batches, which
+are all submitted before any of them is polled. Input and result files are
+kept in the batch directory for inspection.
+"""
+
+import json
+import logging
+import os
+import time
+
+BATCH_ENDPOINT = '/v1/chat/completions'
+COMPLETION_WINDOW = '24h'
+# Limits of one batch input file (the API allows 50,000 requests and 200 MB)
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+DEFAULT_BATCH_DIR = 'cache/batches'
+
+
+def batch_request_line(custom_id, body):
+    """One JSONL line of a batch input file."""
+    return json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': body})
+
+
+def split_batches(lines, max_requests=MAX_BATCH_REQUESTS, max_bytes=MAX_BATCH_BYTES):
+    """
+    Group request lines into batches within the request count and file size limits.
+
+    :param lines: List of (custom_id, JSONL line)
+    :return: List of batches, each a list of (custom_id, JSONL line)
+    """
+    batches = []
+    current, size = [], 0
+    for custom_id, line in lines:
+        line_bytes = len(line.encode('utf-8')) + 1
+        if current and (len(current) >= max_requests or size + line_bytes > max_bytes):
+            batches.append(current)
+            current, size = [], 0
+        current.append((custom_id, line))
+        size += line_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_result_lines(text):
+    """
+    Map the lines of a batch output or error file to custom_id.
+
+    :return: Dict of custom_id -> response body dict, or the RuntimeError the request failed with
+    """
+    results = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get('response') or {}
+        error = entry.get('error')
+        if error or response.get('status_code') != 200:
+            body_error = (response.get('body') or {}).get('error') or {}
+            message = (error or {}).get('message') or body_error.get('message') or 'unknown error'
+            results[entry['custom_id']] = RuntimeError(
+                f"Batch request failed with status {response.get('status_code')}: {message}")
+        else:
+            results[entry['custom_id']] = response['body']
+    return results
+
+
+class BatchRunner:
+    """Submits chat completion requests as batches and collects their responses."""
+
+    def __init__(self, client, batch_dir=DEFAULT_BATCH_DIR, poll_interval=30, timeout=None):
+        """
+        :param client: Synchronous OpenAI client
+        :param batch_dir: Directory the input and result files are written to
+        :param poll_interval: Seconds between batch status checks
+        :param timeout: Seconds to wait for the batches before cancelling them; None waits for the
+                        completion window to expire
+        """
+        self.client = client
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self, requests, label='batch'):
+        """
+        Run requests through the Batch API.
+
+        :param requests: Dict of custom_id -> chat completion request body
+        :param label: Prefix of the batch file names, e.g. the region
+        :return: Dict of custom_id -> response body dict or the exception the request failed with
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        lines = [(custom_id, batch_request_line(custom_id, body)) for custom_id, body in requests.items()]
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        submitted = []
+        results = {}
+        for number, batch in enumerate(split_batches(lines), 1):
+            path = os.path.join(self.batch_dir, f"{label}-{stamp}-{number}.jsonl")
+            try:
+                batch_id = self.submit(path, batch)
+            except Exception as e:
+                logging.error(f"Submitting batch file {path} failed: {e}")
+                results.update((custom_id, e) for custom_id, _ in batch)
+                continue
+            submitted.append((batch_id, path, [custom_id for custom_id, _ in batch]))
+
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        for batch_id, path, custom_ids in submitted:
+            try:
+                batch = self.wait(batch_id, deadline)
+                found = self.read_results(batch, path)
+            except Exception as e:
+                logging.error(f"Batch {batch_id} failed: {e}")
+                found = {}
+                missing = e
+            else:
+                missing = RuntimeError(f"No result for the request in batch {batch_id} ({batch.status})")
+            for custom_id in custom_ids:
+                results[custom_id] = found.get(custom_id, missing)
+        return results
+
+    def submit(self, path, batch):
+        """Write a batch input file, upload it and create the batch. Returns the batch id."""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{line}\n" for _, line in batch)
+        with open(path, 'rb') as f:
+            input_file = self.client.files.create(file=f, purpose='batch')
+        batch_job = self.client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                               completion_window=COMPLETION_WINDOW)
+        logging.info(f"Submitted batch {batch_job.id} with {len(batch)} request(s) from {path}")
+        return batch_job.id
+
+    def wait(self, batch_id, deadline=None):
+        """
+        Poll a batch until it reaches a final status.
+
+        :raises TimeoutError: When the deadline passes first; the batch is cancelled
+        """
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATUSES:
+                counts = batch.request_counts
+                logging.info(f"Batch {batch_id} {batch.status}"
+                             + (f": {counts.completed} of {counts.total} request(s) completed, {counts.failed} failed"
+                                if counts else ''))
+                return batch
+            if deadline and time.monotonic() >= deadline:
+                self.client.batches.cancel(batch_id)
+                raise TimeoutError(f"Batch {batch_id} still {batch.status} after {self.timeout}s; cancelled")
+            logging.debug(f"Batch {batch_id} is {batch.status}")
+            time.sleep(self.poll_interval)
+
+    def read_results(self, batch, path):
+        """Download a finished batch's output and error files next to its input file and parse them."""
+        if batch.status == 'failed' and batch.errors and batch.errors.data:
+            raise RuntimeError('; '.join(error.message or error.code for error in batch.errors.data))
+        results = {}
+        for kind, file_id in (('errors', batch.error_file_id), ('output', batch.output_file_id)):
+            if not file_id:
+                continue
+            text = self.client.files.content(file_id).text
+            with open(f"{os.path.splitext(path)[0]}.{kind}.jsonl", 'w', encoding='utf-8') as f:
+                f.write(text)
+            results.update(parse_result_lines(text))
+        return results
@@ -0,0 +1,119 @@
+# ai/cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = 'cache/analysis.sqlite'
+
+
+class AnalysisCache:
+    """
+    Persistent SQLite cache of LLM analyses.
+
+    Entries are content-addressed: the key is a hash of everything that decides
+    the completion (the customer data, model, temperature and system prompt).
+    Entries older than ttl_seconds are ignored and removed, and once the cache
+    holds more than max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600, max_entries=10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY,
+                analysis TEXT NOT NULL,
+                usage_tokens INTEGER,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS analyses_accessed_at ON analyses (accessed_at)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(payload, encoder=None):
+        """Hash a JSON-serializable payload into a cache key."""
+        serialized = json.dumps(payload, sort_keys=True, separators=(',', ':'), cls=encoder)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Return the cached entry dict for key, or None on a miss."""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT analysis, usage_tokens, created_at FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and self.ttl_seconds and now - row[2] > self.ttl_seconds:
+                self.conn.execute("DELETE FROM analyses WHERE key = ?", (key,))
+                self.conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE analyses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return {'analysis': row[0], 'usage_tokens': row[1], 'created_at': row[2]}
+
+    def put(self, key, analysis, usage_tokens=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, analysis, usage_tokens, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, analysis, usage_tokens, now, now)
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds:
+            self.evictions += self.conn.execute(
+                "DELETE FROM analyses WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+        if self.max_entries:
+            count = self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+            if count > self.max_entries:
+                self.evictions += self.conn.execute(
+                    "DELETE FROM analyses WHERE key IN "
+                    "(SELECT key FROM analyses ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': entries,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Analysis cache: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+                     f"hit rate {stats['hit_rate']:.0%}, {stats['evictions']} eviction(s), "
+                     f"{stats['entries']} entries")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
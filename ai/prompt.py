@@ -0,0 +1,129 @@
+# ai/prompt.py
+"""
+Compact prompt serialization for the customer analysis.
+
+The compact format writes one "Name: value" line per metric instead of
+indented JSON. Each lookback window of a windowed metric is written on the
+metric's line as "<N>m=value" ("New Events: 1m=62, 3m=186") instead of
+repeating the name per window, null metrics are left out, Decimals are written
+as plain numbers and the system prompt loses its source indentation. A
+legend explaining this notation is part of the user message.
+
+Metric names are kept in full: each appears once per request, so a short-key
+legend would cost as many tokens as it saves.
+
+Token counts are estimated locally with a tokenizer-like split (words, 1-3
+digit groups, punctuation and whitespace runs), close to the real count
+without a tokenizer dependency.
+"""
+
+import json
+import re
+import textwrap
+from datetime import date, datetime
+from decimal import Decimal
+
+WINDOW_COLUMN = re.compile(r'^(.*) \((\d+)m\)$')
+TOKEN_PIECES = re.compile(r" ?[A-Za-z]{1,8}| ?\d{1,3}|\s+|[^\sA-Za-z\d]")
+# Per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+USER_PREAMBLE = "Analyze this customer's usage data focusing on key metrics and risks:"
+COMPACT_LEGEND = ("One metric per line. \"<N>m=value\" is the value over the last N months. "
+                  "Metrics without data are omitted.")
+
+
+def estimate_tokens(text):
+    """Estimate the number of tokens of text without a tokenizer."""
+    return len(TOKEN_PIECES.findall(text))
+
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def compact_system_prompt(system_prompt):
+    """Strip the source indentation and trailing spaces from a prompt written as an indented literal."""
+    first, _, rest = system_prompt.partition('\n')
+    lines = [first.strip()] + textwrap.dedent(rest).splitlines()
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def normalize_value(value):
+    """Plain value: Decimals and whole floats as int or float, dates as ISO strings."""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str) and ('\n' in value or value != value.strip() or not value):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def compact_metrics(customer_data):
+    """
+    Encode a customer dict as "Name: value" lines, windowed metrics grouped on one line.
+
+    :return: Text without a trailing newline
+    """
+    lines = {}
+    for column, value in customer_data.items():
+        value = normalize_value(value)
+        if value is None:
+            continue
+        match = WINDOW_COLUMN.match(column)
+        if match:
+            lines.setdefault(match.group(1), []).append(f"{match.group(2)}m={format_value(value)}")
+        else:
+            lines[column] = format_value(value)
+    return '\n'.join(f"{name}: {', '.join(value) if isinstance(value, list) else value}"
+                     for name, value in lines.items())
+
+
+class PromptCompiler:
+    """
+    Builds the chat messages of a customer analysis.
+
+    prompt_format 'compact' sends the compact metric lines, 'json' the
+    indented JSON of earlier versions.
+    """
+
+    def __init__(self, system_prompt, prompt_format='compact', encoder=None):
+        if prompt_format not in ('compact', 'json'):
+            raise ValueError(f"Unknown prompt format: {prompt_format}")
+        self.prompt_format = prompt_format
+        self.system_prompt = compact_system_prompt(system_prompt) if prompt_format == 'compact' else system_prompt
+        self.encoder = encoder
+
+    def build_messages(self, customer_data):
+        """Chat messages (system and user) for one customer."""
+        if self.prompt_format == 'json':
+            data_str = json.dumps(customer_data, indent=2, cls=self.encoder)
+        else:
+            data_str = f"{COMPACT_LEGEND}\n{compact_metrics(customer_data)}"
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": f"{USER_PREAMBLE}\n{data_str}"},
+        ]
+
+
+def completion_budget(prompt_tokens, max_completion_tokens, token_budget=None, min_completion_tokens=500):
+    """
+    max_tokens for a request so prompt plus completion stay within token_budget.
+
+    :raises ValueError: When the prompt leaves fewer than min_completion_tokens
+    """
+    if not token_budget:
+        return max_completion_tokens
+    available = token_budget - prompt_tokens
+    if available < min_completion_tokens:
+        raise ValueError(f"Prompt of ~{prompt_tokens} token(s) leaves {available} of the {token_budget} token "
+                         f"budget for the completion (minimum {min_completion_tokens})")
+    return min(max_completion_tokens, available)
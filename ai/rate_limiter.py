@@ -0,0 +1,144 @@
+# ai/rate_limiter.py
+
+import asyncio
+import logging
+import random
+import time
+
+import openai
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    Async token bucket refilled continuously at capacity-per-minute.
+
+    The level may go negative when a caller reports that it used more than it
+    reserved; later acquisitions then wait for the debt to be refilled.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((amount - self.level) / self.rate)
+
+    def adjust(self, amount):
+        """Give back (positive) or take extra (negative) tokens after the fact."""
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limiter for the OpenAI API.
+
+    Each request reserves an estimated number of tokens. The estimate starts at
+    default_tokens and is replaced by the running average of the total_tokens
+    reported by completed requests; the difference between the reservation and
+    the real usage is settled on the token bucket.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, default_tokens=4000):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.default_tokens = default_tokens
+        self.observed_requests = 0
+        self.observed_tokens = 0
+
+    def estimate_tokens(self):
+        if self.observed_requests:
+            return self.observed_tokens / self.observed_requests
+        return self.default_tokens
+
+    async def acquire(self):
+        """Wait for capacity and return the number of tokens reserved."""
+        reserved = self.estimate_tokens()
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens:
+            await self.tokens.acquire(reserved)
+        return reserved
+
+    def release(self, reserved):
+        """Return a reservation for a request that did not complete."""
+        if self.tokens:
+            self.tokens.adjust(reserved)
+
+    def record(self, reserved, total_tokens):
+        """Settle a reservation against the usage reported by the API."""
+        self.observed_requests += 1
+        self.observed_tokens += total_tokens
+        if self.tokens:
+            self.tokens.adjust(reserved - total_tokens)
+
+
+def backoff_delay(attempt, error=None, base=1.0, cap=60.0):
+    """
+    Jittered exponential backoff for a retry attempt (0-based).
+
+    A Retry-After header on the error response takes precedence.
+    """
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(cap, float(retry_after)) + random.uniform(0, base)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call_with_retries(request, limiter=None, max_retries=5, label=None):
+    """
+    Awaits request() under the rate limiter, retrying retryable API errors.
+
+    :param request: Zero-argument coroutine function performing the API call
+    :param limiter: Optional RateLimiter shared by all concurrent calls
+    :param max_retries: Number of retries after the first attempt
+    :param label: Name used in log messages
+    :return: The API response
+    """
+    attempt = 0
+    while True:
+        reserved = await limiter.acquire() if limiter else 0
+        try:
+            response = await request()
+        except RETRYABLE_ERRORS as e:
+            if limiter:
+                limiter.release(reserved)
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, e)
+            logging.warning(f"Retryable OpenAI error for {label} (attempt {attempt + 1}/{max_retries}): "
+                            f"{e}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+
+        if limiter:
+            usage = getattr(response, 'usage', None)
+            limiter.record(reserved, usage.total_tokens if usage else reserved)
+        return response
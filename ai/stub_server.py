@@ -0,0 +1,281 @@
+# ai/stub_server.py
+"""
+Local stand-in for the OpenAI chat completions and batch APIs.
+
+Point CustomerAnalyzer at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+(any OPENAI_API_KEY value works). It can add latency and inject 429/500
+responses so the retry and rate-limit paths can be exercised without the real
+API.
+
+File uploads (/v1/files), their content and batches (/v1/batches) are kept in
+memory. A batch runs its requests through the same completion handler on a
+background thread; failed requests go to the batch's error file.
+
+    python -m ai.stub_server --port 8089 --latency 0.2 --rate-limit-every 5
+"""
+
+import argparse
+import email.parser
+import email.policy
+import json
+import logging
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency=0.0, rate_limit_every=0, error_every=0, completion_tokens=400):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.error_every = error_every
+        self.completion_tokens = completion_tokens
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def next_request(self):
+        with self.lock:
+            self.requests += 1
+            return self.requests
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = 'OpenAIStub/1.0'
+
+    def log_message(self, format, *args):
+        logging.debug(f"stub_server: {format % args}")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_not_found(self):
+        self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+    def _read_form(self):
+        """Fields of a multipart/form-data body as name -> (filename, bytes)."""
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('latin-1') + self.rfile.read(length)
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(raw)
+        return {part.get_param('name', header='content-disposition'): (part.get_filename(),
+                                                                        part.get_payload(decode=True))
+                for part in message.iter_parts()}
+
+    def do_POST(self):
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')
+        if path.endswith('/chat/completions'):
+            self._send_json(*self.server.handle_completion(self._read_json()))
+        elif path.endswith('/files'):
+            self._send_json(*self.server.create_file(self._read_form()))
+        elif path.endswith('/batches'):
+            self._send_json(*self.server.create_batch(self._read_json()))
+        elif len(parts) >= 3 and parts[-3] == 'batches' and parts[-1] == 'cancel':
+            self._send_json(*self.server.cancel_batch(parts[-2]))
+        else:
+            self._send_not_found()
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].rstrip('/').split('/')
+        if len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content':
+            content = self.server.files.get(parts[-2])
+            if content is None:
+                return self._send_not_found()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(content['data'])))
+            self.end_headers()
+            self.wfile.write(content['data'])
+        elif len(parts) >= 2 and parts[-2] == 'batches' and parts[-1] in self.server.batches:
+            self._send_json(200, self.server.batch_object(parts[-1]))
+        else:
+            self._send_not_found()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, state):
+        super().__init__(address, StubHandler)
+        self.state = state
+        self.files = {}  # file id -> {'object': file object dict, 'data': bytes}
+        self.batches = {}  # batch id -> batch object dict
+        self.batches_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def handle_completion(self, body):
+        """Return (status, payload[, headers]) for a chat completion request."""
+        state = self.state
+        n = state.next_request()
+        if state.latency:
+            time.sleep(state.latency)
+        if state.rate_limit_every and n % state.rate_limit_every == 0:
+            return 429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}}, {'retry-after': '0.1'}
+        if state.error_every and n % state.error_every == 0:
+            return 500, {'error': {'message': 'Internal error', 'type': 'server_error'}}
+        return 200, completion_payload(body, state.completion_tokens)
+
+    def add_file(self, filename, data, purpose):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self.files[file_id] = {
+            'object': {'id': file_id, 'object': 'file', 'bytes': len(data), 'created_at': int(time.time()),
+                       'filename': filename, 'purpose': purpose, 'status': 'processed'},
+            'data': data,
+        }
+        return file_id
+
+    def create_file(self, form):
+        """Store an uploaded file; returns (status, payload)."""
+        if 'file' not in form:
+            return 400, {'error': {'message': 'Missing file', 'type': 'invalid_request_error'}}
+        filename, data = form['file']
+        purpose = form.get('purpose', (None, b''))[1].decode('utf-8')
+        file_id = self.add_file(filename or 'upload.jsonl', data, purpose)
+        return 200, self.files[file_id]['object']
+
+    def create_batch(self, body):
+        """Create a batch of an uploaded JSONL file and start running it; returns (status, payload)."""
+        if body.get('input_file_id') not in self.files:
+            return 400, {'error': {'message': f"No such file: {body.get('input_file_id')}",
+                                   'type': 'invalid_request_error'}}
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        now = int(time.time())
+        with self.batches_lock:
+            self.batches[batch_id] = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body.get('endpoint'), 'errors': None,
+                'input_file_id': body['input_file_id'], 'completion_window': body.get('completion_window'),
+                'status': 'validating', 'output_file_id': None, 'error_file_id': None, 'created_at': now,
+                'expires_at': now + 24 * 3600, 'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+                'metadata': body.get('metadata'),
+            }
+        threading.Thread(target=self.run_batch, args=(batch_id,), name=f"stub-{batch_id}", daemon=True).start()
+        return 200, self.batch_object(batch_id)
+
+    def batch_object(self, batch_id):
+        with self.batches_lock:
+            return json.loads(json.dumps(self.batches[batch_id]))
+
+    def cancel_batch(self, batch_id):
+        with self.batches_lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return 404, {'error': {'message': f"No such batch: {batch_id}", 'type': 'invalid_request_error'}}
+            if batch['status'] not in ('completed', 'failed', 'expired', 'cancelled'):
+                batch['status'] = 'cancelling'
+                batch['cancelling_at'] = int(time.time())
+        return 200, self.batch_object(batch_id)
+
+    def run_batch(self, batch_id):
+        """Answer every request line of a batch, then write its output and error files."""
+        batch = self.batches[batch_id]
+        lines = self.files[batch['input_file_id']]['data'].decode('utf-8').splitlines()
+        try:
+            requests = [json.loads(line) for line in lines if line.strip()]
+        except ValueError as e:
+            with self.batches_lock:
+                batch.update(status='failed', failed_at=int(time.time()), errors={
+                    'object': 'list', 'data': [{'code': 'invalid_json_line', 'message': str(e)}]})
+            return
+        with self.batches_lock:
+            batch.update(status='in_progress', in_progress_at=int(time.time()))
+            batch['request_counts']['total'] = len(requests)
+
+        output, errors = [], []
+        for request in requests:
+            if batch['status'] == 'cancelling':
+                break
+            status, payload = self.handle_completion(request.get('body') or {})[:2]
+            entry = {'id': f"batch_req_{uuid.uuid4().hex}", 'custom_id': request.get('custom_id'),
+                     'response': {'status_code': status, 'request_id': uuid.uuid4().hex, 'body': payload},
+                     'error': None}
+            (output if status == 200 else errors).append(json.dumps(entry))
+            with self.batches_lock:
+                batch['request_counts']['completed' if status == 200 else 'failed'] += 1
+
+        with self.batches_lock:
+            cancelled = batch['status'] == 'cancelling'
+            batch['status'] = 'finalizing'
+        output_file_id = self.add_file(f"{batch_id}_output.jsonl", ''.join(f"{line}\n" for line in output).encode(),
+                                       'batch_output') if output else None
+        error_file_id = self.add_file(f"{batch_id}_error.jsonl", ''.join(f"{line}\n" for line in errors).encode(),
+                                      'batch_output') if errors else None
+        with self.batches_lock:
+            batch.update(output_file_id=output_file_id, error_file_id=error_file_id)
+            if cancelled:
+                batch.update(status='cancelled', cancelled_at=int(time.time()))
+            else:
+                batch.update(status='completed', finalizing_at=int(time.time()), completed_at=int(time.time()))
+
+
+def completion_payload(body, completion_tokens=400):
+    """Build a chat completion response for a request body."""
+    messages = body.get('messages', [])
+    prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+    content = ("0. Overview\nStub Customer shows steady usage.\n"
+               "1. Document Management & Compliance\n- Stub analysis generated locally.")
+    return {
+        'id': f"chatcmpl-{uuid.uuid4().hex}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'stub'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """
+    Start the stub server on a background thread.
+
+    :return: The running StubServer; call shutdown() to stop it
+    """
+    server = StubServer((host, port), StubState(**options))
+    threading.Thread(target=server.serve_forever, name='openai-stub', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the OpenAI API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds to wait before each response')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='Answer every Nth request with a 429')
+    parser.add_argument('--error-every', type=int, default=0, help='Answer every Nth request with a 500')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    server = StubServer((args.host, args.port), StubState(args.latency, args.rate_limit_every, args.error_every))
+    logging.info(f"OpenAI stub listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
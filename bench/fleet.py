@@ -0,0 +1,175 @@
+# bench/fleet.py
+"""
+Synthetic tenant fleet for benchmarks.
+
+Creates tenant schemas named <prefix>_<tenant_id> holding every table the
+metrics query reads, plus the shared public rows (tenants, profiles, users,
+employments, features) that point at them. Table sizes scale with rows, the
+number of contracts per tenant; the other tables are sized relative to it.
+Only use this against a disposable local database.
+"""
+
+import logging
+import time
+
+FIRST_TENANT_ID = 900000
+
+PUBLIC_TABLES = """
+CREATE TABLE IF NOT EXISTS public.tenants (id bigint PRIMARY KEY, company text);
+CREATE TABLE IF NOT EXISTS public.tenant_profiles (id bigint PRIMARY KEY, tenant_id bigint, plan int, status int,
+                                                   hubspot_id text);
+CREATE TABLE IF NOT EXISTS public.users (id bigint PRIMARY KEY, email text, current_sign_in_at timestamp);
+CREATE TABLE IF NOT EXISTS public.employments (id serial PRIMARY KEY, user_id bigint, tenant_id bigint);
+CREATE TABLE IF NOT EXISTS public.tenants_features (id serial PRIMARY KEY, tenant_profile_id bigint, kind varchar,
+                                                    meta_status int);
+"""
+
+TENANT_TABLES = """
+CREATE TABLE {schema}.settings (id serial PRIMARY KEY, esign bool, access_groups bool, reporting_currency text,
+                                open_ai_contract_summary bool, supplier_auto_build bool);
+CREATE TABLE {schema}.properties (id serial PRIMARY KEY, scope_name text, name text, jsonb_value jsonb);
+CREATE TABLE {schema}.versions (id serial PRIMARY KEY, whodunnit varchar, created_at timestamp);
+CREATE TABLE {schema}.access_groups (id serial PRIMARY KEY, kind int, predefined bool);
+CREATE TABLE {schema}.ui_tables_filters (id serial PRIMARY KEY, title text, meta_status int);
+CREATE TABLE {schema}.esign_sign_processes (id serial PRIMARY KEY, provider int, meta_status int, file_host_type text,
+                                            updated_at timestamp);
+CREATE TABLE {schema}.custom_tabs (id serial PRIMARY KEY, title text, scored bool);
+CREATE TABLE {schema}.custom_tab_scores (id serial PRIMARY KEY, custom_tab_id int, scorable_type text, scorable_id int,
+                                         meta_status int, value numeric, updated_at timestamp);
+CREATE TABLE {schema}.contracts (id serial PRIMARY KEY, title text, created_at timestamp, updated_at timestamp,
+                                 meta_status int);
+CREATE TABLE {schema}.suppliers (id serial PRIMARY KEY, name text, meta_status int, custom_fields_data jsonb);
+CREATE TABLE {schema}.projects (id serial PRIMARY KEY, title text);
+CREATE TABLE {schema}.custom_groups (id serial PRIMARY KEY, predefined_kind int);
+CREATE TABLE {schema}.custom_fields (id serial PRIMARY KEY, custom_group_id int);
+CREATE TABLE {schema}.contract_summaries (id serial PRIMARY KEY, contract_id int, annual_value_cents bigint);
+CREATE TABLE {schema}.owner_kinds (id serial PRIMARY KEY, predefined bool);
+CREATE TABLE {schema}.owners (id serial PRIMARY KEY, host_id int, host_type text, owner_kind_id int);
+CREATE TABLE {schema}.contract_reviews (id serial PRIMARY KEY, has_master_record bool);
+CREATE TABLE {schema}.attachments_file_analyses_summaries (id serial PRIMARY KEY, analyzed_at timestamp,
+                                                          analyzer_job_status int);
+CREATE TABLE {schema}.custom_options (id serial PRIMARY KEY, label text);
+CREATE TABLE {schema}.activities (id serial PRIMARY KEY, created_at timestamp, date_completed timestamp, due_date date,
+                                  activity_type int);
+CREATE TABLE {schema}.contract_links (id serial PRIMARY KEY, linked_contract_id int, related_contract_id int);
+CREATE TABLE {schema}.supplier_links (id serial PRIMARY KEY, linked_supplier_id int, related_supplier_id int);
+"""
+
+# {rows} is the number of contracts; users are tenant_id * 1000 + 0..users-1
+TENANT_DATA = """
+INSERT INTO {schema}.settings (esign, access_groups, reporting_currency, open_ai_contract_summary, supplier_auto_build)
+VALUES (true, {tenant_id} % 2 = 0, 'USD', true, {tenant_id} % 3 = 0);
+INSERT INTO {schema}.properties (scope_name, name, jsonb_value) VALUES ('docu_sign', 'user_info', '{{"account": 1}}');
+INSERT INTO {schema}.access_groups (kind, predefined)
+SELECT 10, g % 4 = 0 FROM generate_series(1, 8) g;
+INSERT INTO {schema}.ui_tables_filters (title, meta_status)
+SELECT CASE WHEN g = 1 THEN 'Default' ELSE 'View ' || g END, 20 FROM generate_series(1, 6) g;
+INSERT INTO {schema}.custom_tabs (title, scored) SELECT 'Form ' || g, g % 3 <> 0 FROM generate_series(1, 6) g;
+INSERT INTO {schema}.custom_options (label) SELECT 'Event type ' || g FROM generate_series(1, 5) g;
+INSERT INTO {schema}.custom_groups (predefined_kind) VALUES (100), (0);
+INSERT INTO {schema}.custom_fields (custom_group_id) SELECT 1 + g % 2 FROM generate_series(1, 6) g;
+INSERT INTO {schema}.owner_kinds (predefined) VALUES (true), (false);
+
+INSERT INTO {schema}.contracts (title, created_at, updated_at, meta_status)
+SELECT 'Contract ' || g, now() - (g % 720) * interval '1 day', now() - (g % 200) * interval '1 day',
+       CASE WHEN g % 5 = 0 THEN 10 ELSE 20 END
+FROM generate_series(1, {rows}) g;
+INSERT INTO {schema}.contract_summaries (contract_id, annual_value_cents)
+SELECT g, (g % 97) * 100000 FROM generate_series(1, {rows}) g;
+INSERT INTO {schema}.owners (host_id, host_type, owner_kind_id)
+SELECT g, 'Contract', 1 + g % 2 FROM generate_series(1, {rows}) g WHERE g % 3 <> 0;
+INSERT INTO {schema}.contract_reviews (has_master_record) SELECT g % 2 = 0 FROM generate_series(1, {rows} / 2) g;
+INSERT INTO {schema}.contract_links (linked_contract_id, related_contract_id)
+SELECT g, g + 1 FROM generate_series(1, {rows} / 10) g;
+INSERT INTO {schema}.attachments_file_analyses_summaries (analyzed_at, analyzer_job_status)
+SELECT now() - (g % 365) * interval '1 day', CASE WHEN g % 4 = 0 THEN 20 ELSE 30 END
+FROM generate_series(1, {rows} / 2) g;
+
+INSERT INTO {schema}.suppliers (name, meta_status, custom_fields_data)
+SELECT 'Supplier ' || g, 20, CASE WHEN g % 3 = 0 THEN '{{"1": "auto"}}'::jsonb ELSE '{{}}'::jsonb END
+FROM generate_series(1, GREATEST({rows} / 4, 1)) g;
+INSERT INTO {schema}.supplier_links (linked_supplier_id, related_supplier_id)
+SELECT g, g + 1 FROM generate_series(1, {rows} / 40) g;
+INSERT INTO {schema}.projects (title) SELECT 'Project ' || g FROM generate_series(1, GREATEST({rows} / 20, 1)) g;
+INSERT INTO {schema}.custom_tab_scores (custom_tab_id, scorable_type, scorable_id, meta_status, value, updated_at)
+SELECT 1 + g % 6, (ARRAY['Contract', 'Supplier', 'Project'])[1 + g % 3], 1 + g % GREATEST({rows} / 20, 1), 20,
+       g % 5, now() - (g % 90) * interval '1 day'
+FROM generate_series(1, {rows} / 2) g;
+
+INSERT INTO {schema}.versions (whodunnit, created_at)
+SELECT ({tenant_id} * 1000 + g % {users})::text, now() - (g % 365) * interval '1 day'
+FROM generate_series(1, {rows} * 4) g;
+INSERT INTO {schema}.activities (created_at, date_completed, due_date, activity_type)
+SELECT now() - (g % 365) * interval '1 day',
+       CASE WHEN g % 3 = 0 THEN now() - (g % 120) * interval '1 day' END,
+       current_date + (g % 60) - 30, 1 + g % 5
+FROM generate_series(1, {rows}) g;
+INSERT INTO {schema}.esign_sign_processes (provider, meta_status, file_host_type, updated_at)
+SELECT 10 + 10 * (g % 2), 100, 'Contract', now() - (g % 365) * interval '1 day'
+FROM generate_series(1, GREATEST({rows} / 5, 1)) g;
+
+INSERT INTO public.tenants (id, company) VALUES ({tenant_id}, 'Bench Tenant {tenant_id}');
+INSERT INTO public.tenant_profiles (id, tenant_id, plan, status, hubspot_id)
+VALUES ({tenant_id}, {tenant_id}, {tenant_id} % 4, 1, 'bench-{tenant_id}');
+INSERT INTO public.users (id, email, current_sign_in_at)
+SELECT {tenant_id} * 1000 + g, 'user' || g || '@bench.example', now() - (g % 200) * interval '1 day'
+FROM generate_series(0, {users} - 1) g;
+INSERT INTO public.employments (user_id, tenant_id)
+SELECT {tenant_id} * 1000 + g, {tenant_id} FROM generate_series(0, {users} - 1) g;
+INSERT INTO public.tenants_features (tenant_profile_id, kind, meta_status) VALUES ({tenant_id}, '280', 10);
+"""
+
+
+def tenant_schema(prefix, tenant_id):
+    return f"{prefix}_{tenant_id}"
+
+
+def drop_fleet(conn, prefix='bench'):
+    """Drops every <prefix>_<id> schema and the public rows of the synthetic tenants."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname ~ %s", (f"^{prefix}_[0-9]+$",))
+        schemas = [row[0] for row in cursor.fetchall()]
+        for schema in schemas:
+            cursor.execute(f'DROP SCHEMA "{schema}" CASCADE')
+        cursor.execute("SELECT to_regclass('public.tenants') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("DELETE FROM public.tenants_features WHERE tenant_profile_id >= %s", (FIRST_TENANT_ID,))
+            cursor.execute("DELETE FROM public.employments WHERE tenant_id >= %s", (FIRST_TENANT_ID,))
+            cursor.execute("DELETE FROM public.users WHERE id >= %s", (FIRST_TENANT_ID * 1000,))
+            cursor.execute("DELETE FROM public.tenant_profiles WHERE tenant_id >= %s", (FIRST_TENANT_ID,))
+            cursor.execute("DELETE FROM public.tenants WHERE id >= %s", (FIRST_TENANT_ID,))
+    conn.commit()
+    return len(schemas)
+
+
+def create_fleet(conn, tenants, rows, prefix='bench', users=50):
+    """
+    Replaces the synthetic fleet with tenants schemas of the given size.
+
+    :param conn: Connection to a disposable local database
+    :param tenants: Number of tenant schemas
+    :param rows: Contracts per tenant; versions are 4x, activities 1x, scores and reviews 0.5x
+    :param prefix: Schema name prefix
+    :param users: Users per tenant
+    :return: Dict of tenant_id -> [schema name], as db.catalog.fetch_tenant_schemas returns it
+    """
+    started = time.monotonic()
+    drop_fleet(conn, prefix)
+    with conn.cursor() as cursor:
+        cursor.execute(PUBLIC_TABLES)
+        for tenant_id in range(FIRST_TENANT_ID, FIRST_TENANT_ID + tenants):
+            schema = tenant_schema(prefix, tenant_id)
+            cursor.execute(f"CREATE SCHEMA {schema}")
+            cursor.execute(TENANT_TABLES.format(schema=schema))
+            cursor.execute(TENANT_DATA.format(schema=schema, tenant_id=tenant_id, rows=rows, users=users))
+        conn.commit()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE")
+    finally:
+        conn.autocommit = False
+    logging.info(f"Created {tenants} synthetic tenant(s) with {rows} contracts each "
+                 f"in {time.monotonic() - started:.1f}s")
+    return {tenant_id: [tenant_schema(prefix, tenant_id)]
+            for tenant_id in range(FIRST_TENANT_ID, FIRST_TENANT_ID + tenants)}
@@ -0,0 +1,230 @@
+# bench/run.py
+"""
+End-to-end throughput benchmark.
+
+For every combination of --tenants and --rows, a synthetic fleet is created
+(see bench/fleet.py) and every tenant runs through the real fetch, analyze
+and render stages: process_customer on the connection pool, CustomerAnalyzer
+against the local OpenAI stub, and ReportGenerator. Per-stage latency
+percentiles and tenants/sec are logged and written to JSON; --baseline
+compares against an earlier result file.
+
+    python -m bench.run --db-url postgresql://localhost/bench --tenants 10,50 --rows 1000,10000 \\
+        --output bench/results.json --baseline bench/previous.json
+
+The database must be a disposable local one: the fleet's schemas are
+dropped and recreated on every run.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from ai.analyzer import CustomerAnalyzer
+from ai.stub_server import start_stub_server
+from bench.fleet import create_fleet, drop_fleet
+from db.connection import DB_URLS, close_pools, get_pool
+from db.metrics import lookback_windows
+from db.queries import fetch_live_customers
+from main import process_customer
+from report.generator import ReportGenerator, warm_static_assets
+from utils.pipeline import Stage, run_pipeline
+
+BENCH_REGION = 'Bench'
+STAGES = ('fetch', 'analyze', 'render')
+PERCENTILES = (50, 95, 99)
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmark results are logged here; the pipeline's own per-customer logs follow --log-level
+logger = logging.getLogger('bench')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(seconds):
+    """Latency summary in milliseconds."""
+    values = sorted(seconds)
+    summary = {'count': len(values)}
+    if values:
+        for pct in PERCENTILES:
+            summary[f"p{pct}_ms"] = round(percentile(values, pct) * 1000, 2)
+        summary['mean_ms'] = round(sum(values) / len(values) * 1000, 2)
+        summary['max_ms'] = round(values[-1] * 1000, 2)
+    return summary
+
+
+def run_case(tenants, rows, months, fetch_workers, analyze_workers, render_workers, base_url):
+    """
+    Benchmarks one fleet size.
+
+    :return: Dict with the case parameters, per-stage latency summaries and throughput
+    """
+    pool = get_pool(BENCH_REGION, max_size=fetch_workers + 2)
+    with pool.connection() as conn:
+        started = time.monotonic()
+        schemas_by_tenant = create_fleet(conn, tenants, rows)
+        setup_seconds = time.monotonic() - started
+        customers = fetch_live_customers(conn, schemas_by_tenant)
+
+    timings = {stage: [] for stage in STAGES}
+    timings_lock = threading.Lock()
+    analyzer = CustomerAnalyzer(base_url=base_url)
+
+    def timed(stage, handler):
+        def run(payload):
+            started = time.perf_counter()
+            output = handler(payload)
+            with timings_lock:
+                timings[stage].append(time.perf_counter() - started)
+            return output
+        return run
+
+    def fetch(customer):
+        with pool.connection() as conn:
+            return process_customer(conn, customer, BENCH_REGION, months)
+
+    def render(report_gen):
+        return report_gen.generate_report
+
+    stages = [
+        Stage('fetch', [timed('fetch', fetch)] * fetch_workers),
+        Stage('analyze', [timed('analyze', analyzer.analyze_customer)] * analyze_workers),
+        Stage('render', [timed('render', render(ReportGenerator(months))) for _ in range(render_workers)]),
+    ]
+    started = time.monotonic()
+    results, errors = run_pipeline(customers, stages, describe=lambda customer: customer[0])
+    elapsed = time.monotonic() - started
+
+    return {
+        'tenants': tenants,
+        'rows': rows,
+        'setup_seconds': round(setup_seconds, 2),
+        'elapsed_seconds': round(elapsed, 3),
+        'completed': len(results),
+        'errors': len(errors),
+        'tenants_per_second': round(len(results) / elapsed, 3) if elapsed else None,
+        'stages': {stage: summarize(values) for stage, values in timings.items()},
+    }
+
+
+def compare(cases, baseline_path):
+    """Logs throughput and p95 changes against the matching cases of a previous result file."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(case['tenants'], case['rows']): case for case in json.load(f)['cases']}
+
+    for case in cases:
+        previous = baseline.get((case['tenants'], case['rows']))
+        if not previous:
+            logger.info(f"No baseline for {case['tenants']} tenant(s) x {case['rows']} rows")
+            continue
+        changes = []
+        if previous.get('tenants_per_second') and case['tenants_per_second']:
+            change = case['tenants_per_second'] / previous['tenants_per_second'] - 1
+            changes.append(f"throughput {change:+.1%}")
+        for stage in STAGES:
+            before = previous['stages'].get(stage, {}).get('p95_ms')
+            after = case['stages'][stage].get('p95_ms')
+            if before and after:
+                changes.append(f"{stage} p95 {after / before - 1:+.1%}")
+        logger.info(f"{case['tenants']} tenant(s) x {case['rows']} rows vs baseline: {', '.join(changes)}")
+
+
+def log_case(case):
+    stages = ', '.join(
+        f"{stage} p50/p95/p99 {summary.get('p50_ms')}/{summary.get('p95_ms')}/{summary.get('p99_ms')}ms"
+        for stage, summary in case['stages'].items()
+    )
+    logger.info(f"{case['tenants']} tenant(s) x {case['rows']} rows: {case['tenants_per_second']} tenants/s "
+                f"({case['completed']} done, {case['errors']} failed in {case['elapsed_seconds']}s); {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark on a synthetic tenant fleet')
+    parser.add_argument('--db-url', default=os.getenv('BENCH_DB_URL'),
+                        help='Disposable local Postgres URL (default: BENCH_DB_URL)')
+    parser.add_argument('--tenants', type=lambda value: [int(n) for n in value.split(',')], default=[10],
+                        help='Comma-separated tenant counts to sweep')
+    parser.add_argument('--rows', type=lambda value: [int(n) for n in value.split(',')], default=[1000],
+                        help='Comma-separated contracts per tenant to sweep; other tables scale with it')
+    parser.add_argument('--months', type=lambda value: list(lookback_windows(value.split(','))), default=1,
+                        help='Lookback window(s) in months, comma-separated')
+    parser.add_argument('--fetch-workers', type=int, default=4)
+    parser.add_argument('--analyze-workers', type=int, default=4)
+    parser.add_argument('--render-workers', type=int, default=2)
+    parser.add_argument('--llm-latency', type=float, default=0.5,
+                        help='Seconds the OpenAI stub waits before each response')
+    parser.add_argument('--work-dir', help='Directory reports are written to (default: a temporary directory)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON result file')
+    parser.add_argument('--baseline', help='Earlier JSON result file to compare against')
+    parser.add_argument('--keep', action='store_true', help='Keep the last synthetic fleet after the run')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='WARNING',
+                        help='Log level of the pipeline itself')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s [%(levelname)s] %(message)s')
+    logger.setLevel(logging.INFO)
+    if not args.db_url:
+        parser.error('--db-url or BENCH_DB_URL is required')
+
+    DB_URLS[BENCH_REGION] = args.db_url
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='tenant-health-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    if not os.path.exists(os.path.join(work_dir, 'assets')):
+        os.symlink(os.path.join(REPO_ROOT, 'assets'), os.path.join(work_dir, 'assets'))
+    os.chdir(work_dir)
+
+    started_at = datetime.now(timezone.utc)
+    warm_static_assets()  # One-time logo and font loading is not part of any tenant's render time
+    stub = start_stub_server(latency=args.llm_latency)
+    cases = []
+    try:
+        for rows in args.rows:
+            for tenants in args.tenants:
+                case = run_case(tenants, rows, args.months, args.fetch_workers, args.analyze_workers,
+                                args.render_workers, stub.base_url)
+                cases.append(case)
+                log_case(case)
+        if not args.keep:
+            with get_pool(BENCH_REGION).connection() as conn:
+                drop_fleet(conn)
+    finally:
+        stub.shutdown()
+        close_pools()
+
+    result = {
+        'started_at': started_at.isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'settings': {
+            'months': args.months,
+            'fetch_workers': args.fetch_workers,
+            'analyze_workers': args.analyze_workers,
+            'render_workers': args.render_workers,
+            'llm_latency': args.llm_latency,
+        },
+        'cases': cases,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Wrote {len(cases)} benchmark case(s) to {output}; reports are in {work_dir}")
+    if baseline:
+        compare(cases, baseline)
+
+
+if __name__ == "__main__":
+    main()
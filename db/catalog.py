@@ -0,0 +1,134 @@
+# db/catalog.py
+"""
+Tenant-to-schema catalog.
+
+Tenant schemas are named <anything>_<tenant_id>. Instead of joining tenants to
+information_schema.schemata on a parsed suffix on every run, the schema names
+are read once from pg_namespace and parsed into a tenant_id -> schemas map.
+The map is cached per region in SQLite and trusted for refresh_seconds; after
+that a cheap fingerprint (namespace count and tenant list) is compared and the
+map is only rebuilt when it changed.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CATALOG_PATH = 'cache/tenant_catalog.sqlite'
+
+
+def fetch_catalog_fingerprint(conn):
+    """
+    Fetches a fingerprint that changes when schemas or tenants are added or removed.
+
+    :param conn: Database connection object
+    :return: Fingerprint string
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM pg_catalog.pg_namespace),
+                   COUNT(*),
+                   md5(string_agg(id::text, ',' ORDER BY id))
+            FROM public.tenants
+        """)
+        namespaces, tenants, tenant_hash = cursor.fetchone()
+    return f"{namespaces}:{tenants}:{tenant_hash}"
+
+
+def fetch_tenant_schemas(conn):
+    """
+    Builds the tenant_id -> schema names map from pg_namespace.
+
+    Only schemas visible in information_schema.schemata (owned by, or usable
+    by, the current user) are included, and the suffix must be the tenant id
+    exactly as written, so the map matches the previous text join.
+
+    :param conn: Database connection object
+    :return: Dict of tenant_id -> sorted list of schema names
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT nspname
+            FROM pg_catalog.pg_namespace
+            WHERE nspname ~ '_[0-9]+$'
+              AND (pg_has_role(nspowner, 'USAGE') OR has_schema_privilege(oid, 'CREATE, USAGE'))
+        """)
+        names = [row[0] for row in cursor.fetchall()]
+
+    schemas = {}
+    for name in names:
+        suffix = name.rsplit('_', 1)[1]
+        if str(int(suffix)) != suffix:
+            continue  # Leading zeros never matched tenants.id::varchar
+        schemas.setdefault(int(suffix), []).append(name)
+    return {tenant_id: sorted(names) for tenant_id, names in schemas.items()}
+
+
+class TenantCatalog:
+    """SQLite cache of each region's tenant_id -> schema names map."""
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH, refresh_seconds=3600):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS catalogs (
+                region TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                checked_at REAL NOT NULL,
+                schemas TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def _load(self, region):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT fingerprint, checked_at, schemas FROM catalogs WHERE region = ?", (region,)
+            ).fetchone()
+
+    def _save(self, region, fingerprint, schemas):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalogs (region, fingerprint, checked_at, schemas) VALUES (?, ?, ?, ?)",
+                (region, fingerprint, time.time(), json.dumps(schemas))
+            )
+            self.conn.commit()
+
+    def schemas_by_tenant(self, conn, region):
+        """
+        Returns the region's tenant_id -> schema names map, rebuilding it only when stale.
+
+        :param conn: Database connection for the region
+        :param region: Region name the map is cached under
+        :return: Dict of tenant_id -> list of schema names
+        """
+        row = self._load(region)
+        if row and time.time() - row[1] < self.refresh_seconds:
+            logging.debug(f"Using cached tenant catalog for {region}")
+            return {int(tenant_id): names for tenant_id, names in json.loads(row[2]).items()}
+
+        fingerprint = fetch_catalog_fingerprint(conn)
+        if row and row[0] == fingerprint:
+            logging.info(f"Tenant catalog for {region} unchanged")
+            schemas = {int(tenant_id): names for tenant_id, names in json.loads(row[2]).items()}
+        else:
+            started = time.monotonic()
+            schemas = fetch_tenant_schemas(conn)
+            logging.info(f"Rebuilt tenant catalog for {region}: {sum(len(names) for names in schemas.values())} schema(s) "
+                         f"for {len(schemas)} tenant(s) "
+                         f"in {time.monotonic() - started:.2f}s")
+        self._save(region, fingerprint, schemas)
+        return schemas
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
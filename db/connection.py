@@ -1,6 +1,11 @@
 # db/connection.py
 
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 from dotenv import load_dotenv
 
@@ -14,12 +19,256 @@ DB_URLS = {
     'CA': os.getenv('CA_DB_URL'),
 }
 
+# TCP keepalives so idle pooled connections are not silently dropped by NAT/load balancers
+KEEPALIVE_OPTIONS = {
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5,
+}
+
+POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 0))
+POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300))
+POOL_CHECKOUT_TIMEOUT = float(os.getenv('DB_POOL_CHECKOUT_TIMEOUT', 60))
+# Connections idle for longer than this are pinged with SELECT 1 before being handed out
+POOL_HEALTH_CHECK_AFTER = float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', 5))
+
 def get_db_connection(region):
     db_url = DB_URLS.get(region)
     if not db_url:
         raise ValueError(f"No database URL found for region: {region}")
     try:
-        conn = psycopg2.connect(db_url)
+        conn = psycopg2.connect(db_url, **KEEPALIVE_OPTIONS)
         return conn
     except psycopg2.Error as e:
         raise Exception(f"Error connecting to {region} database: {e}")
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of connections to one region's database.
+
+    Connections are opened on demand up to max_size. A checkout waits for a
+    free connection when the pool is saturated, and connections that have been
+    idle for a while are checked with SELECT 1 before being handed out.
+    Connections idle for longer than idle_timeout are closed, keeping at least
+    min_size open. Returned connections are rolled back so every checkout starts
+    outside a transaction.
+    """
+
+    def __init__(self, region, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 checkout_timeout=POOL_CHECKOUT_TIMEOUT, health_check_after=POOL_HEALTH_CHECK_AFTER):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size for {region}: min={min_size}, max={max_size}")
+        self.region = region
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+
+        self.idle = []  # (connection, returned_at), most recently returned last
+        self.in_use = set()
+        self.opening = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.saturated_checkouts = 0
+        self.peak_in_use = 0
+        self.opened = 0
+        self.discarded = 0
+
+        for _ in range(min_size):
+            self.idle.append((self._open(), time.monotonic()))
+
+    def _open(self):
+        conn = get_db_connection(self.region)
+        self.opened += 1
+        return conn
+
+    def _is_alive(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self.discarded += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _reap_idle(self, now):
+        """Close connections idle past idle_timeout. Caller holds the condition."""
+        keep = []
+        for conn, returned_at in self.idle:
+            total = len(keep) + len(self.in_use) + self.opening
+            if self.idle_timeout and now - returned_at > self.idle_timeout and total >= self.min_size:
+                self._discard(conn)
+            else:
+                keep.append((conn, returned_at))
+        self.idle = keep
+
+    def getconn(self, timeout=None):
+        """Check out a live connection, waiting up to timeout seconds when the pool is saturated."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            with self.condition:
+                if self.closed:
+                    raise Exception(f"Connection pool for {self.region} is closed")
+                self._reap_idle(time.monotonic())
+                if self.idle:
+                    conn, returned_at = self.idle.pop()
+                    self.in_use.add(conn)
+                elif len(self.in_use) + self.opening < self.max_size:
+                    conn, returned_at = None, None
+                    self.opening += 1
+                else:
+                    waited = True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Exception(f"Timed out after {timeout}s waiting for a {self.region} database "
+                                        f"connection (pool size {self.max_size})")
+                    self.condition.wait(remaining)
+                    continue
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                finally:
+                    with self.condition:
+                        self.opening -= 1
+                        if conn is not None:
+                            self.in_use.add(conn)
+                        self.condition.notify()
+            elif not self._is_alive(conn, time.monotonic() - returned_at):
+                logging.warning(f"Discarding dead {self.region} database connection")
+                with self.condition:
+                    self.in_use.discard(conn)
+                    self._discard(conn)
+                    self.condition.notify()
+                continue
+
+            wait = time.monotonic() - started
+            with self.condition:
+                self.checkouts += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self.saturated_checkouts += 1 if waited else 0
+                self.peak_in_use = max(self.peak_in_use, len(self.in_use))
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if discard is set or it is broken."""
+        if not discard and not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        with self.condition:
+            self.in_use.discard(conn)
+            if discard or conn.closed or self.closed:
+                self._discard(conn)
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager checking a connection out for the duration of the block."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except psycopg2.errors.QueryCanceled:
+            # A statement timeout leaves the connection usable once rolled back
+            self.putconn(conn)
+            raise
+        except psycopg2.OperationalError:
+            self.putconn(conn, discard=True)
+            raise
+        except BaseException:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'region': self.region,
+                'max_size': self.max_size,
+                'in_use': len(self.in_use),
+                'idle': len(self.idle),
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'saturated_checkouts': self.saturated_checkouts,
+                'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'opened': self.opened,
+                'discarded': self.discarded,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(f"Connection pool {stats['region']}: {stats['checkouts']} checkout(s), "
+                     f"peak {stats['peak_in_use']}/{stats['max_size']} in use, "
+                     f"{stats['saturated_checkouts']} waited for a free connection, "
+                     f"avg wait {stats['avg_wait_ms']}ms, max wait {stats['max_wait_ms']}ms, "
+                     f"{stats['opened']} opened, {stats['discarded']} discarded")
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for conn, _ in self.idle:
+                self._discard(conn)
+            self.idle = []
+            self.condition.notify_all()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(region, max_size=None):
+    """
+    Return the connection pool for a region, creating it on first use.
+
+    :param region: Region name from DB_URLS
+    :param max_size: Grow the pool to at least this many connections
+    """
+    with _pools_lock:
+        pool = _pools.get(region)
+        if pool is None or pool.closed:
+            if not DB_URLS.get(region):
+                raise ValueError(f"No database URL found for region: {region}")
+            pool = ConnectionPool(region, max_size=max(max_size or 0, POOL_MAX_SIZE))
+            _pools[region] = pool
+        elif max_size and max_size > pool.max_size:
+            with pool.condition:
+                pool.max_size = max_size
+                pool.condition.notify_all()
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,709 @@
+# db/metrics.py
+"""
+Registry of the metric groups that make up the tenant metrics query.
+
+Each group is a set of CTEs ending in a single-row "<name>_metrics" CTE whose
+columns are the group's output columns. Groups can be combined into one
+statement (all groups reproduce the original fetch_customer_additional_data
+query) or run on their own, and build_metrics_query always emits columns in
+COLUMN_ORDER so the assembled row looks the same however it was computed.
+
+Several lookback windows (e.g. 1, 3 and 6 months) are computed in one scan:
+windowed expressions are wrapped in PerWindow and repeated for every window as
+conditional aggregates, while the rows are only filtered on the widest window.
+
+SQL templates are formatted with:
+  schema           prefix for tenant tables: '"schema_name".' or '' when the
+                   tenant schema is selected through search_path
+  tenant_id        tenant id literal or bind parameter
+  widest_interval  interval of the longest lookback window
+and PerWindow fragments (and windowed column names) additionally with:
+  months_interval  interval of the window
+  months_lookback  window in months, used in column and alias names
+
+Windowed columns that the daily rollup store can answer (see db.rollups) are
+listed in a group's rollup_columns. The parts of the group's SQL only needed
+for them are wrapped in RolledUp, or are whole CTEs named in rollup_ctes;
+without_rollup_columns leaves both out, so the statement no longer scans the
+raw history for those columns.
+"""
+
+METRIC_GROUPS = {}
+
+
+class PerWindow:
+    """A template fragment repeated for every lookback window, joined by separator."""
+
+    def __init__(self, template, separator=',\n'):
+        self.template = template
+        self.separator = separator
+
+
+class RolledUp:
+    """A template part only needed for a group's rollup_columns."""
+
+    def __init__(self, part):
+        self.part = part
+
+
+class MetricGroup:
+    def __init__(self, name, description, ctes, columns, tables=(), public_tables=(), rollup_columns=(),
+                 rollup_ctes=()):
+        """
+        :param name: Registry name, also used on the command line
+        :param description: One-line description of the group
+        :param ctes: List of (cte_name, sql_template) pairs, ending with "<name>_metrics". A
+                     template is a string or a list of strings and PerWindow fragments
+        :param columns: Output column name templates of the final CTE
+        :param tables: Tenant schema tables the group reads
+        :param public_tables: Shared public tables the group reads
+        :param rollup_columns: Windowed column templates the daily rollup store can answer
+        :param rollup_ctes: CTEs only needed for the rollup_columns
+        """
+        self.name = name
+        self.description = description
+        self.ctes = ctes
+        self.columns = columns
+        self.tables = tables
+        self.public_tables = public_tables
+        self.rollup_columns = rollup_columns
+        self.rollup_ctes = rollup_ctes
+
+    @property
+    def final_cte(self):
+        return f"{self.name}_metrics"
+
+
+def register_metric_group(group):
+    if group.name in METRIC_GROUPS:
+        raise ValueError(f"Metric group already registered: {group.name}")
+    if group.ctes[-1][0] != group.final_cte:
+        raise ValueError(f"Metric group {group.name} must end with a {group.final_cte} CTE")
+    METRIC_GROUPS[group.name] = group
+    return group
+
+
+register_metric_group(MetricGroup(
+    'user_activity',
+    'Logged in, active and login-only users',
+    [
+        ('logged_in_users', ["""
+        SELECT
+""", PerWindow("""            COUNT(DISTINCT u.id) FILTER (WHERE u.current_sign_in_at >= CURRENT_DATE - {months_interval})
+                as logged_in_count_{months_lookback}"""), """
+        FROM public.users u
+        LEFT JOIN public.employments e ON e.user_id = u.id
+        WHERE e.tenant_id = {tenant_id}
+        AND u.current_sign_in_at >= CURRENT_DATE - {widest_interval}
+        AND u.email NOT LIKE '%%@gatekeeperhq.com'
+        """]),
+        ('active_users', ["""
+        SELECT
+""", PerWindow("""            COUNT(DISTINCT v.whodunnit::integer) FILTER (WHERE v.created_at >= CURRENT_DATE - {months_interval})
+                as active_count_{months_lookback}"""), """
+        FROM {schema}versions v
+        JOIN public.users u ON u.id = v.whodunnit::integer
+        WHERE v.created_at >= CURRENT_DATE - {widest_interval}
+        AND u.email NOT LIKE '%%@gatekeeperhq.com'
+        """]),
+        ('inactive_users', ["""
+        SELECT
+""", PerWindow("""            (logged_in_count_{months_lookback} - active_count_{months_lookback})
+                as inactive_count_{months_lookback}"""), """
+        FROM logged_in_users, active_users
+        """]),
+        ('user_activity_metrics', ["""
+        SELECT
+""", PerWindow("""            logged_in_users.logged_in_count_{months_lookback} as "Total Logged In Users ({months_lookback}m)\""""),
+            RolledUp(PerWindow(""",
+            active_users.active_count_{months_lookback} as "Users Who Performed Actions ({months_lookback}m)",
+            inactive_users.inactive_count_{months_lookback} as "Users Who Only Logged In ({months_lookback}m)\"""",
+                               separator='')), """
+        FROM logged_in_users""", RolledUp("""
+        CROSS JOIN active_users
+        CROSS JOIN inactive_users"""), """
+        """]),
+    ],
+    [
+        'Total Logged In Users ({months_lookback}m)',
+        'Users Who Performed Actions ({months_lookback}m)',
+        'Users Who Only Logged In ({months_lookback}m)',
+    ],
+    tables=('versions',),
+    public_tables=('users', 'employments'),
+    rollup_columns=(
+        'Users Who Performed Actions ({months_lookback}m)',
+        'Users Who Only Logged In ({months_lookback}m)',
+    ),
+    rollup_ctes=('active_users', 'inactive_users')
+))
+
+register_metric_group(MetricGroup(
+    'rbac',
+    'Role based access control status and custom groups',
+    [
+        ('settings_rbac_check', """
+        SELECT CASE WHEN access_groups = true THEN 'Enabled' ELSE 'Disabled' END as "RBAC Status"
+        FROM {schema}settings
+        """),
+        ('group_counts', """
+        SELECT COUNT(CASE WHEN kind = 10 THEN 1 END) as "RBAC Groups"
+        FROM {schema}access_groups
+        WHERE predefined = false
+        """),
+        ('rbac_metrics', """
+        SELECT settings_rbac_check."RBAC Status", group_counts."RBAC Groups"
+        FROM settings_rbac_check
+        CROSS JOIN group_counts
+        """),
+    ],
+    [
+        'RBAC Status',
+        'RBAC Groups',
+    ],
+    tables=('settings', 'access_groups')
+))
+
+register_metric_group(MetricGroup(
+    'contracts',
+    'Contract volumes, value, ownership, master records and AI extracts',
+    [
+        ('contracts_metrics', ["""
+        SELECT *
+        FROM
+            (SELECT
+                COUNT(DISTINCT c.id) AS "Total Contracts (inc Archived)",
+""", RolledUp(PerWindow("""                COUNT(DISTINCT CASE WHEN c.created_at >= CURRENT_DATE - {months_interval} THEN c.id END)
+                    AS "NEW Live Contracts ({months_lookback}m)",
+                COUNT(DISTINCT CASE WHEN c.updated_at >= CURRENT_DATE - {months_interval} THEN c.id END)
+                    AS "Updated Live Contracts ({months_lookback}m)",
+""", separator='')), """                COUNT(DISTINCT CASE WHEN c.meta_status = 20 THEN c.id END) AS "Total Live Contracts",
+                (SELECT reporting_currency FROM {schema}settings LIMIT 1) AS "Main Currency",
+                (SELECT CASE WHEN open_ai_contract_summary = True THEN 'ON' ELSE 'OFF' END FROM {schema}settings LIMIT 1) AS "OpenAI Contract Summary",
+                COALESCE(ROUND(AVG(cs.annual_value_cents) FILTER (WHERE c.meta_status = 20) / 100), 0) AS "Average Contract Value (Live)",
+                COUNT(DISTINCT CASE WHEN o.id IS NOT NULL AND c.meta_status = 20 THEN c.id END) as "Live Contracts with Internal Owners",
+                COUNT(DISTINCT CASE WHEN o.id IS NULL AND c.meta_status = 20 THEN c.id END) as "Live Contracts with NO Internal Owners",
+                ROUND(
+                    (COUNT(DISTINCT CASE WHEN o.id IS NOT NULL AND c.meta_status = 20 THEN c.id END)::decimal /
+                    NULLIF(COUNT(DISTINCT CASE WHEN c.meta_status = 20 THEN c.id END), 0) * 100)
+                , 2) as "Percent Contracts with Internal Owners"
+            FROM {schema}contracts c
+            LEFT JOIN {schema}contract_summaries cs ON c.id = cs.contract_id
+            LEFT JOIN {schema}owners o ON c.id = o.host_id
+                AND o.host_type = 'Contract'
+                AND EXISTS (
+                    SELECT 1
+                    FROM {schema}owner_kinds ok
+                    WHERE ok.id = o.owner_kind_id
+                    AND ok.predefined = true
+                )
+            ) AS total_contracts_data
+
+        CROSS JOIN LATERAL
+            (SELECT
+                COUNT(CASE WHEN has_master_record THEN 1 END) AS "Contracts with Master Record",
+                ROUND(
+                    (COUNT(CASE WHEN has_master_record THEN 1 END)::decimal /
+                    NULLIF(COUNT(*), 0) * 100), 2) AS "Percent with Master Record"
+            FROM {schema}contract_reviews
+            ) AS master_record_data
+
+        CROSS JOIN LATERAL
+            (SELECT
+""", PerWindow("""                COUNT(DISTINCT id) FILTER (WHERE analyzed_at::Date < CURRENT_DATE - {months_interval})
+                    AS "AI Extract - Ready for Review ({months_lookback}m)\""""), """
+            FROM {schema}attachments_file_analyses_summaries
+            WHERE analyzer_job_status = 30
+            ) AS ai_extract_data
+        """]),
+    ],
+    [
+        'Total Contracts (inc Archived)',
+        'Total Live Contracts',
+        'NEW Live Contracts ({months_lookback}m)',
+        'Updated Live Contracts ({months_lookback}m)',
+        'Main Currency',
+        'Average Contract Value (Live)',
+        'Live Contracts with Internal Owners',
+        'Live Contracts with NO Internal Owners',
+        'Percent Contracts with Internal Owners',
+        'Contracts with Master Record',
+        'Percent with Master Record',
+        'AI Extract - Ready for Review ({months_lookback}m)',
+        'OpenAI Contract Summary',
+    ],
+    tables=('contracts', 'contract_summaries', 'owners', 'owner_kinds', 'settings', 'contract_reviews',
+            'attachments_file_analyses_summaries'),
+    rollup_columns=(
+        'NEW Live Contracts ({months_lookback}m)',
+        'Updated Live Contracts ({months_lookback}m)',
+    )
+))
+
+register_metric_group(MetricGroup(
+    'links',
+    'Contracts and suppliers linked to one another',
+    [
+        ('links_metrics', """
+        SELECT *
+        FROM
+            (SELECT
+                COUNT(DISTINCT c.id) as "Live Contracts Linked to another Contract"
+            FROM {schema}contracts c
+            INNER JOIN {schema}contract_links cl
+                ON c.id = cl.linked_contract_id OR c.id = cl.related_contract_id
+            WHERE c.meta_status = 20
+            ) AS contract_links_data
+
+        CROSS JOIN LATERAL
+            (SELECT
+                COUNT(DISTINCT s.id) as "Live Suppliers Linked to another Supplier"
+            FROM {schema}suppliers s
+            INNER JOIN {schema}supplier_links sl
+                ON s.id = sl.linked_supplier_id OR s.id = sl.related_supplier_id
+            WHERE s.meta_status = 20
+            ) AS supplier_links_data
+        """),
+    ],
+    [
+        'Live Contracts Linked to another Contract',
+        'Live Suppliers Linked to another Supplier',
+    ],
+    tables=('contracts', 'contract_links', 'suppliers', 'supplier_links')
+))
+
+register_metric_group(MetricGroup(
+    'activities',
+    'Event volumes, completion and overdue events',
+    [
+        ('activities_metrics', ["""
+        SELECT
+            COUNT(DISTINCT a.id) as "Total Events (All Time)",
+""", RolledUp(PerWindow("""            COUNT(DISTINCT CASE
+                WHEN a.created_at >= CURRENT_DATE - {months_interval}
+                THEN a.id END) as "New Events ({months_lookback}m)",
+            COUNT(DISTINCT CASE
+                WHEN a.date_completed >= CURRENT_DATE - {months_interval}
+                THEN a.id END) as "Completed Events ({months_lookback}m)",
+            COALESCE(
+                ROUND(AVG(CASE
+                    WHEN a.date_completed >= CURRENT_DATE - {months_interval}
+                    THEN EXTRACT(EPOCH FROM (a.date_completed - a.created_at))/86400.0
+                    END))::integer, 0) as "Events Avg Completion Time ({months_lookback}m)",
+""", separator='')), """            COUNT(DISTINCT CASE
+                WHEN a.due_date < CURRENT_DATE
+                AND a.date_completed IS NULL
+                THEN a.id END) as "Overdue Events",
+            string_agg(DISTINCT co.label, ' | ' ORDER BY co.label) as "Event Types"
+        FROM {schema}activities a
+        LEFT JOIN {schema}custom_options co ON a.activity_type = co.id
+        """]),
+    ],
+    [
+        'Total Events (All Time)',
+        'New Events ({months_lookback}m)',
+        'Completed Events ({months_lookback}m)',
+        'Overdue Events',
+        'Events Avg Completion Time ({months_lookback}m)',
+        'Event Types',
+    ],
+    tables=('activities', 'custom_options'),
+    rollup_columns=(
+        'New Events ({months_lookback}m)',
+        'Completed Events ({months_lookback}m)',
+        'Events Avg Completion Time ({months_lookback}m)',
+    )
+))
+
+register_metric_group(MetricGroup(
+    'smart_forms',
+    'Smart Forms adoption and saved custom views',
+    [
+        ('smart_forms_enabled', """
+        SELECT COALESCE(
+            (SELECT CASE WHEN tf.meta_status = 10 THEN 'ON' ELSE 'OFF' END
+             FROM public.tenants_features tf
+             JOIN public.tenant_profiles tp ON tf.tenant_profile_id = {tenant_id}
+             WHERE tf.kind = '280' AND tp.tenant_id = {tenant_id}),
+            'OFF'
+        ) AS "Smart Forms Enabled"
+        """),
+        ('scored_entities', """
+        SELECT
+            ct.id AS tab_id,
+            ct.title AS tab_name,
+            cts.scorable_type,
+            cts.scorable_id,
+            COALESCE(
+                c.title,
+                s.name,
+                p.title,
+                'Unknown'
+            ) AS entity_name,
+            MAX(cts.updated_at::Date) AS latest_update
+        FROM {schema}custom_tabs ct
+        LEFT JOIN {schema}custom_tab_scores cts ON ct.id = cts.custom_tab_id
+            AND cts.meta_status = 20
+            AND (cts.value != 0 OR cts.value IS NULL)
+        LEFT JOIN {schema}contracts c ON cts.scorable_type = 'Contract' AND cts.scorable_id = c.id
+        LEFT JOIN {schema}suppliers s ON cts.scorable_type = 'Supplier' AND cts.scorable_id = s.id
+        LEFT JOIN {schema}projects p ON cts.scorable_type = 'Project' AND cts.scorable_id = p.id
+        WHERE ct.scored = true
+        GROUP BY
+            ct.id,
+            ct.title,
+            cts.scorable_type,
+            cts.scorable_id,
+            COALESCE(c.title, s.name, p.title, 'Unknown')
+        """),
+        ('null_scores', """
+        SELECT COUNT(*) as tabs_with_null_scores
+        FROM {schema}custom_tabs ct
+        WHERE ct.scored = true
+        AND NOT EXISTS (
+            SELECT 1
+            FROM {schema}custom_tab_scores cts
+            WHERE cts.custom_tab_id = ct.id
+            AND cts.value != 0
+            AND cts.meta_status = 20
+        )
+        """),
+        ('smart_forms_summary', """
+        SELECT
+            sfe."Smart Forms Enabled" AS "Smart Forms Enabled",
+            COUNT(DISTINCT se.tab_id) AS "Smart Forms Count",
+            STRING_AGG(DISTINCT se.scorable_type, ' | ' ORDER BY se.scorable_type) AS "Smart Form Types",
+            MAX(se.latest_update) AS "Latest Updated Score",
+            COALESCE(ns.tabs_with_null_scores, 0) AS "Smart Forms with No Scores"
+        FROM smart_forms_enabled sfe
+        LEFT JOIN scored_entities se ON true
+        CROSS JOIN null_scores ns
+        GROUP BY sfe."Smart Forms Enabled", ns.tabs_with_null_scores
+        """),
+        ('saved_custom_views', """
+        SELECT COUNT(DISTINCT id) AS "Saved Custom Views"
+        FROM {schema}ui_tables_filters ui
+        WHERE ui.title <> 'Default' AND ui.meta_status = '20'
+        """),
+        ('smart_forms_metrics', """
+        SELECT smart_forms_summary.*, saved_custom_views."Saved Custom Views"
+        FROM smart_forms_summary
+        CROSS JOIN saved_custom_views
+        """),
+    ],
+    [
+        'Smart Forms Enabled',
+        'Smart Forms Count',
+        'Smart Form Types',
+        'Latest Updated Score',
+        'Smart Forms with No Scores',
+        'Saved Custom Views',
+    ],
+    tables=('custom_tabs', 'custom_tab_scores', 'contracts', 'suppliers', 'projects', 'ui_tables_filters'),
+    public_tables=('tenants_features', 'tenant_profiles')
+))
+
+register_metric_group(MetricGroup(
+    'autobuild',
+    'Supplier auto-build setting and suppliers with auto-built fields',
+    [
+        ('autobuild_status', """
+        SELECT CASE WHEN s.supplier_auto_build = True
+                    THEN 'ON'
+                    ELSE 'OFF'
+               END AS "Auto Build Enabled"
+        FROM {schema}settings s
+        """),
+        ('autobuild_count', """
+        WITH autobuild_fields AS (
+            SELECT cf.id::text as field_id
+            FROM {schema}custom_fields cf
+            JOIN {schema}custom_groups cg ON cf.custom_group_id = cg.id
+            WHERE cg.predefined_kind = 100
+        )
+        SELECT COUNT(DISTINCT s.id) AS "Autobuild Supplier Count"
+        FROM {schema}suppliers s
+        WHERE EXISTS (
+            SELECT 1
+            FROM autobuild_fields af
+            WHERE s.custom_fields_data ? af.field_id
+            AND s.custom_fields_data->>af.field_id IS NOT NULL
+            AND s.custom_fields_data->>af.field_id != ''
+        )
+        """),
+        ('autobuild_metrics', """
+        SELECT autobuild_status."Auto Build Enabled", autobuild_count."Autobuild Supplier Count"
+        FROM autobuild_status
+        CROSS JOIN autobuild_count
+        """),
+    ],
+    [
+        'Auto Build Enabled',
+        'Autobuild Supplier Count',
+    ],
+    tables=('settings', 'custom_fields', 'custom_groups', 'suppliers')
+))
+
+register_metric_group(MetricGroup(
+    'esign',
+    'GK E-Sign and DocuSign enablement and signed documents',
+    [
+        ('settings_check', """
+        SELECT
+            (SELECT CASE WHEN COALESCE(esign, false) THEN 'Enabled' ELSE 'Disabled' END
+             FROM {schema}settings LIMIT 1) as gk_esign_enabled,
+            COALESCE(
+                (SELECT CASE
+                    WHEN p.jsonb_value <> '{{}}'::jsonb THEN 'Enabled'
+                    ELSE 'Disabled'
+                END
+                FROM {schema}properties p
+                WHERE p.scope_name = 'docu_sign' AND p.name = 'user_info'),
+                'Disabled'
+            ) as docusign_enabled
+        """),
+        ('signing_stats', ["""
+        SELECT
+            CASE
+                WHEN provider = 10 THEN 'GK E-Sign'
+                WHEN provider = 20 THEN 'DocuSign'
+            END as signing_provider,
+""", PerWindow("""            COUNT(DISTINCT esp.id) FILTER (WHERE esp.updated_at >= CURRENT_DATE - {months_interval})
+                as signed_count_{months_lookback}"""), """
+        FROM {schema}esign_sign_processes esp
+        WHERE esp.meta_status = 100
+            AND esp.file_host_type = 'Contract'
+            AND esp.updated_at >= CURRENT_DATE - {widest_interval}
+        GROUP BY provider
+        """]),
+        ('esign_metrics', ["""
+        SELECT
+            settings_check.gk_esign_enabled as "eSign Enabled",
+            settings_check.docusign_enabled as "DocuSign Enabled\"""", RolledUp(PerWindow(""",
+            COALESCE(gk_esign.signed_count_{months_lookback}, 0) as "eSigns ({months_lookback}m)",
+            COALESCE(docusign.signed_count_{months_lookback}, 0) as "DocuSigns ({months_lookback}m)\"""",
+                                                                                     separator='')), """
+        FROM settings_check""", RolledUp("""
+        LEFT JOIN signing_stats gk_esign
+            ON gk_esign.signing_provider = 'GK E-Sign'
+        LEFT JOIN signing_stats docusign
+            ON docusign.signing_provider = 'DocuSign'"""), """
+        """]),
+    ],
+    [
+        'eSign Enabled',
+        'DocuSign Enabled',
+        'eSigns ({months_lookback}m)',
+        'DocuSigns ({months_lookback}m)',
+    ],
+    tables=('settings', 'properties', 'esign_sign_processes'),
+    rollup_columns=(
+        'eSigns ({months_lookback}m)',
+        'DocuSigns ({months_lookback}m)',
+    ),
+    rollup_ctes=('signing_stats',)
+))
+
+# Output column order of fetch_customer_additional_data, as (group, column template)
+COLUMN_ORDER = [
+    ('user_activity', 'Total Logged In Users ({months_lookback}m)'),
+    ('user_activity', 'Users Who Performed Actions ({months_lookback}m)'),
+    ('user_activity', 'Users Who Only Logged In ({months_lookback}m)'),
+    ('rbac', 'RBAC Status'),
+    ('rbac', 'RBAC Groups'),
+    ('contracts', 'Total Contracts (inc Archived)'),
+    ('contracts', 'Total Live Contracts'),
+    ('contracts', 'NEW Live Contracts ({months_lookback}m)'),
+    ('contracts', 'Updated Live Contracts ({months_lookback}m)'),
+    ('contracts', 'Main Currency'),
+    ('contracts', 'Average Contract Value (Live)'),
+    ('contracts', 'Live Contracts with Internal Owners'),
+    ('contracts', 'Live Contracts with NO Internal Owners'),
+    ('contracts', 'Percent Contracts with Internal Owners'),
+    ('links', 'Live Contracts Linked to another Contract'),
+    ('links', 'Live Suppliers Linked to another Supplier'),
+    ('contracts', 'Contracts with Master Record'),
+    ('contracts', 'Percent with Master Record'),
+    ('contracts', 'AI Extract - Ready for Review ({months_lookback}m)'),
+    ('contracts', 'OpenAI Contract Summary'),
+    ('activities', 'Total Events (All Time)'),
+    ('activities', 'New Events ({months_lookback}m)'),
+    ('activities', 'Completed Events ({months_lookback}m)'),
+    ('activities', 'Overdue Events'),
+    ('activities', 'Events Avg Completion Time ({months_lookback}m)'),
+    ('activities', 'Event Types'),
+    ('smart_forms', 'Smart Forms Enabled'),
+    ('smart_forms', 'Smart Forms Count'),
+    ('smart_forms', 'Smart Form Types'),
+    ('smart_forms', 'Latest Updated Score'),
+    ('smart_forms', 'Smart Forms with No Scores'),
+    ('smart_forms', 'Saved Custom Views'),
+    ('autobuild', 'Auto Build Enabled'),
+    ('autobuild', 'Autobuild Supplier Count'),
+    ('esign', 'eSign Enabled'),
+    ('esign', 'DocuSign Enabled'),
+    ('esign', 'eSigns ({months_lookback}m)'),
+    ('esign', 'DocuSigns ({months_lookback}m)'),
+]
+
+
+def resolve_metric_groups(names=None):
+    """
+    Returns the registered groups for the given names in registry order.
+
+    :param names: Iterable of group names, or None for all groups
+    :return: List of MetricGroup objects
+    """
+    if not names:
+        return list(METRIC_GROUPS.values())
+    unknown = [name for name in names if name not in METRIC_GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown metric group(s): {', '.join(unknown)}. "
+                         f"Available: {', '.join(METRIC_GROUPS)}")
+    return [group for name, group in METRIC_GROUPS.items() if name in names]
+
+
+def lookback_windows(months_lookback):
+    """
+    Normalizes a lookback (months as an int, or an iterable of ints) into sorted unique windows.
+
+    :return: Tuple of window lengths in months, shortest first
+    """
+    windows = (months_lookback,) if isinstance(months_lookback, int) else months_lookback
+    windows = tuple(sorted({int(months) for months in windows}))
+    if not windows or windows[0] < 1:
+        raise ValueError(f"Invalid lookback window(s): {months_lookback}")
+    return windows
+
+
+def _window_params(months):
+    return {'months_interval': f"INTERVAL '{months} months'", 'months_lookback': months}
+
+
+def metric_columns(groups, months_lookback=1):
+    """
+    Output column names for the given groups, in COLUMN_ORDER.
+
+    Windowed columns are repeated for each lookback window, shortest first.
+    """
+    group_columns = {group.name: group.columns for group in groups}
+    windows = lookback_windows(months_lookback)
+    columns = []
+    for group_name, column in COLUMN_ORDER:
+        if column not in group_columns.get(group_name, ()):
+            continue
+        if '{months_lookback}' in column:
+            columns.extend(column.format(months_lookback=months) for months in windows)
+        else:
+            columns.append(column)
+    return columns
+
+
+def quote_schema(schema_name):
+    """Quote a schema name as an SQL identifier."""
+    return '"' + schema_name.replace('"', '""') + '"'
+
+
+def without_rollup_columns(group):
+    """
+    The group without its rollup_columns, the RolledUp template parts and the rollup_ctes.
+
+    The result has the same name and final CTE, so it can be computed and
+    combined like the registered group; the left-out columns are filled in
+    from the rollup store.
+    """
+    if not group.rollup_columns:
+        return group
+    ctes = [(name, [part for part in ([template] if isinstance(template, str) else template)
+                    if not isinstance(part, RolledUp)])
+            for name, template in group.ctes if name not in group.rollup_ctes]
+    return MetricGroup(group.name, group.description, ctes,
+                       [column for column in group.columns if column not in group.rollup_columns],
+                       group.tables, group.public_tables)
+
+
+def _render_template(template, params, windows):
+    parts = [template] if isinstance(template, str) else template
+    rendered = []
+    for part in parts:
+        if isinstance(part, RolledUp):
+            part = part.part
+        if isinstance(part, PerWindow):
+            rendered.append(part.separator.join(
+                part.template.format(**params, **_window_params(months)) for months in windows))
+        else:
+            rendered.append(part.format(**params))
+    return ''.join(rendered)
+
+
+def _render_metrics_query(groups, months_lookback, params):
+    windows = lookback_windows(months_lookback)
+    params = dict(params, widest_interval=_window_params(windows[-1])['months_interval'])
+    column_group = {column: group.final_cte
+                    for group in groups for column in metric_columns([group], windows)}
+
+    ctes = ",\n".join(
+        f"    {name} AS ({_render_template(template, params, windows).rstrip()}\n    )"
+        for group in groups for name, template in group.ctes
+    )
+    select_list = ",\n".join(
+        f'        {column_group[column]}."{column}"'
+        for column in metric_columns(groups, windows)
+    )
+    from_list = "\n    CROSS JOIN ".join(group.final_cte for group in groups)
+
+    return f"""
+    WITH
+{ctes}
+
+    SELECT
+{select_list}
+    FROM {from_list}
+    """
+
+
+def render_ctes(groups, months_lookback=1):
+    """
+    Renders each CTE of the given groups in its prepared (search_path) form.
+
+    :return: List of (cte_name, SQL text) pairs in statement order
+    """
+    windows = lookback_windows(months_lookback)
+    params = {'schema': '', 'tenant_id': '$1', 'widest_interval': _window_params(windows[-1])['months_interval']}
+    return [(name, _render_template(template, params, windows)) for group in groups for name, template in group.ctes]
+
+
+def build_metrics_query(tenant_id, schema_name, months_lookback=1, groups=None):
+    """
+    Builds one self-contained statement computing the given metric groups for a tenant.
+
+    Tables are schema-qualified and the tenant id is inlined, so the statement
+    can be combined with other tenants' (see the batched fetch).
+
+    :param months_lookback: Lookback window in months, or a list of windows
+    :param groups: List of MetricGroup objects, or None for all groups
+    :return: SQL text without a trailing semicolon
+    """
+    return _render_metrics_query(groups or resolve_metric_groups(), months_lookback, {
+        'schema': quote_schema(schema_name) + '.',
+        'tenant_id': int(tenant_id),
+    })
+
+
+def build_prepared_metrics_query(months_lookback=1, groups=None):
+    """
+    Builds the tenant-independent form of the metrics statement.
+
+    Tenant tables are unqualified and resolved through search_path and the
+    tenant id is $1, so the text is identical for every tenant in a run and can
+    be prepared once per connection. The lookback windows are part of the
+    column names, so they are inlined.
+
+    :param months_lookback: Lookback window in months, or a list of windows
+    :param groups: List of MetricGroup objects, or None for all groups
+    :return: SQL text without a trailing semicolon
+    """
+    return _render_metrics_query(groups or resolve_metric_groups(), months_lookback, {
+        'schema': '',
+        'tenant_id': '$1',
+    })
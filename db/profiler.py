@@ -0,0 +1,282 @@
+# db/profiler.py
+"""
+Plan profiler for the tenant metrics statement.
+
+Runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on the prepared metrics statement
+for a sample of tenants and attributes the exclusive time and buffer counts of
+every plan node to the CTE it came from.
+
+PostgreSQL inlines most CTEs, so their names rarely survive in the plan. A
+node is attributed by the tables it scans: every table scan is matched, by
+relation and alias, to the CTEs whose SQL reads that table, and a subtree
+belongs to the one CTE all of its scans agree on. Materialized CTEs
+("CTE <name>" sub-plans) and subquery scans named after a CTE are attributed
+directly. Nodes joining several CTEs are reported as "(main query)".
+
+The fleet-wide report ranks CTEs by total time, the slowest individual plan
+nodes, and the sequential scans seen in the most tenants.
+"""
+
+import json
+import logging
+import re
+import time
+
+from psycopg2 import sql
+
+from db.metrics import render_ctes, resolve_metric_groups
+from db.queries import prepare_metrics_statement
+
+MAIN_QUERY = '(main query)'
+BUFFER_KEYS = ('Shared Hit Blocks', 'Shared Read Blocks', 'Temp Read Blocks', 'Temp Written Blocks')
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(?:public\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+SQL_KEYWORDS = {'where', 'on', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'full', 'group', 'order', 'limit',
+                'union', 'having', 'using', 'and', 'or', 'window', 'lateral'}
+
+
+def cte_table_references(groups, months_lookback=1):
+    """
+    Maps the tables read by the metrics statement to the CTEs that read them.
+
+    :return: Dict of (relation, alias) -> set of CTE names; the alias is the
+             relation name when the SQL gives none
+    """
+    ctes = render_ctes(groups, months_lookback)
+    cte_names = {name for name, _ in ctes}
+    references = {}
+    for name, text in ctes:
+        for relation, alias in TABLE_REFERENCE.findall(text):
+            if relation in cte_names or relation.lower() in SQL_KEYWORDS:
+                continue
+            if not alias or alias.lower() in SQL_KEYWORDS:
+                alias = relation
+            references.setdefault((relation, alias), set()).add(name)
+    return references
+
+
+class PlanAttribution:
+    """Attributes the nodes of one EXPLAIN ANALYZE plan to CTEs."""
+
+    def __init__(self, references, cte_names):
+        self.references = references
+        self.cte_names = cte_names
+        self.relation_ctes = {}
+        for (relation, _), names in references.items():
+            self.relation_ctes.setdefault(relation, set()).update(names)
+        self.cte_times = {}
+
+    def scan_candidates(self, node):
+        relation = node['Relation Name']
+        alias = node.get('Alias') or relation
+        names = self.references.get((relation, alias))
+        if names is None:
+            # The planner suffixes repeated aliases with _1, _2, ...
+            names = self.references.get((relation, re.sub(r'_\d+$', '', alias)))
+        return names or self.relation_ctes.get(relation, set())
+
+    def candidates(self, node):
+        """CTEs the node may belong to: those every scan under it agrees on (empty for a cross-CTE join)."""
+        if node.get('Relation Name'):
+            found = set(self.scan_candidates(node))
+        else:
+            found = None
+        for child in node.get('Plans', []):
+            child_candidates = self.candidates(child)
+            if child_candidates is None or (child.get('Subplan Name') or '').startswith('CTE '):
+                continue
+            found = set(child_candidates) if found is None else found & child_candidates
+        node['_candidates'] = found
+        return found
+
+    def exclusive(self, node):
+        """Exclusive time (ms) and buffers of a node: its totals minus its children's."""
+        loops = node.get('Actual Loops', 1) or 1
+        total = node.get('Actual Total Time', 0.0) * loops
+        buffers = {key: node.get(key, 0) for key in BUFFER_KEYS}
+        for child in node.get('Plans', []):
+            if (child.get('Subplan Name') or '').startswith('CTE '):
+                continue  # A materialized CTE's time is inside the CTE Scans reading it
+            total -= child.get('Actual Total Time', 0.0) * (child.get('Actual Loops', 1) or 1)
+            for key in BUFFER_KEYS:
+                buffers[key] -= child.get(key, 0)
+        if node['Node Type'] == 'CTE Scan':
+            total -= self.cte_times.get(node.get('CTE Name'), 0.0)
+        return max(total, 0.0), {key: max(value, 0) for key, value in buffers.items()}
+
+    def walk(self, node, owner=None):
+        """Yields (owner, node, exclusive ms, exclusive buffers) for every node of the tree."""
+        subplan = node.get('Subplan Name') or ''
+        candidates = node.get('_candidates')
+        if subplan.startswith('CTE '):
+            owner = subplan[4:]
+        elif node['Node Type'] == 'Subquery Scan' and node.get('Alias') in self.cte_names:
+            owner = node['Alias']
+        elif node['Node Type'] == 'CTE Scan':
+            owner = node.get('CTE Name')
+        elif candidates and len(candidates) == 1:
+            owner = next(iter(candidates))
+        elif candidates is None and owner:
+            pass  # No scans below (e.g. Result): part of the enclosing node
+        elif not (owner and candidates and owner in candidates):
+            owner = '|'.join(sorted(candidates)) if candidates else MAIN_QUERY
+
+        # Materialized CTEs run before the nodes scanning them
+        for child in node.get('Plans', []):
+            if (child.get('Subplan Name') or '').startswith('CTE '):
+                self.cte_times[child['Subplan Name'][4:]] = \
+                    child.get('Actual Total Time', 0.0) * (child.get('Actual Loops', 1) or 1)
+        elapsed, buffers = self.exclusive(node)
+        yield owner, node, elapsed, buffers
+        for child in node.get('Plans', []):
+            yield from self.walk(child, owner)
+
+    def attribute(self, plan):
+        """
+        :param plan: The top-level EXPLAIN (FORMAT JSON) object
+        :return: List of (owner, node, exclusive ms, exclusive buffers)
+        """
+        self.cte_times = {}
+        self.candidates(plan['Plan'])
+        return list(self.walk(plan['Plan']))
+
+
+def explain_tenant(conn, tenant_id, schema_name, months_lookback=1, groups=None):
+    """
+    Runs the prepared metrics statement for a tenant under EXPLAIN (ANALYZE, BUFFERS).
+
+    :return: The top-level plan object (with 'Plan', 'Planning Time', 'Execution Time')
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SET LOCAL search_path TO {}").format(sql.Identifier(schema_name)))
+    name = prepare_metrics_statement(conn, months_lookback, groups)
+    with conn.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) EXECUTE {name} (%s)", (tenant_id,))
+        plan = cursor.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]
+
+
+class QueryProfile:
+    """Fleet-wide aggregation of profiled tenant plans."""
+
+    def __init__(self, months_lookback=1, groups=None):
+        self.months_lookback = months_lookback
+        self.groups = groups or resolve_metric_groups()
+        cte_names = {name for group in self.groups for name, _ in group.ctes}
+        self.attribution = PlanAttribution(cte_table_references(self.groups, months_lookback), cte_names)
+        self.tenants = []
+        self.ctes = {}
+        self.nodes = {}
+        self.seq_scans = {}
+
+    def add(self, tenant, plan):
+        """
+        Adds one tenant's plan.
+
+        :param tenant: Label of the tenant, e.g. "<region>/<schema> (<customer>)"
+        :param plan: Top-level EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) object
+        """
+        self.tenants.append({'tenant': tenant, 'planning_ms': round(plan.get('Planning Time', 0.0), 3),
+                             'execution_ms': round(plan.get('Execution Time', 0.0), 3)})
+        for owner, node, elapsed, buffers in self.attribution.attribute(plan):
+            cte = self.ctes.setdefault(owner, {'cte': owner, 'total_ms': 0.0, 'tenants': set(),
+                                               **{key: 0 for key in BUFFER_KEYS}})
+            cte['total_ms'] += elapsed
+            cte['tenants'].add(tenant)
+            for key in BUFFER_KEYS:
+                cte[key] += buffers[key]
+
+            relation = node.get('Relation Name')
+            key = (owner, node['Node Type'], relation)
+            entry = self.nodes.setdefault(key, {'cte': owner, 'node': node['Node Type'], 'relation': relation,
+                                                'total_ms': 0.0, 'max_ms': 0.0, 'slowest_tenant': None,
+                                                'occurrences': 0})
+            entry['total_ms'] += elapsed
+            entry['occurrences'] += 1
+            if elapsed >= entry['max_ms']:
+                entry['max_ms'] = elapsed
+                entry['slowest_tenant'] = tenant
+
+            if node['Node Type'] == 'Seq Scan':
+                loops = node.get('Actual Loops', 1) or 1
+                scan = self.seq_scans.setdefault((relation, owner), {
+                    'relation': relation, 'cte': owner, 'tenants': set(), 'total_ms': 0.0,
+                    'rows_returned': 0, 'rows_removed_by_filter': 0, 'shared_read_blocks': 0,
+                })
+                scan['tenants'].add(tenant)
+                scan['total_ms'] += elapsed
+                scan['rows_returned'] += node.get('Actual Rows', 0) * loops
+                scan['rows_removed_by_filter'] += node.get('Rows Removed by Filter', 0) * loops
+                scan['shared_read_blocks'] += buffers['Shared Read Blocks']
+
+    def report(self, top=15):
+        """
+        Ranked fleet-wide report.
+
+        :param top: Number of slowest nodes and sequential scans to keep
+        :return: JSON-serializable dict with tenants, ctes, slowest_nodes and seq_scans
+        """
+        execution_ms = sum(tenant['execution_ms'] for tenant in self.tenants) or 1.0
+        ctes = sorted(self.ctes.values(), key=lambda cte: -cte['total_ms'])
+        return {
+            'tenants': sorted(self.tenants, key=lambda tenant: -tenant['execution_ms']),
+            'ctes': [{
+                'cte': cte['cte'],
+                'total_ms': round(cte['total_ms'], 3),
+                'share': round(cte['total_ms'] / execution_ms, 4),
+                'avg_ms_per_tenant': round(cte['total_ms'] / len(cte['tenants']), 3),
+                'shared_hit_blocks': cte['Shared Hit Blocks'],
+                'shared_read_blocks': cte['Shared Read Blocks'],
+                'temp_blocks': cte['Temp Read Blocks'] + cte['Temp Written Blocks'],
+            } for cte in ctes],
+            'slowest_nodes': [dict(node, total_ms=round(node['total_ms'], 3), max_ms=round(node['max_ms'], 3))
+                              for node in sorted(self.nodes.values(), key=lambda node: -node['total_ms'])[:top]],
+            'seq_scans': [dict(scan, tenants=len(scan['tenants']), total_ms=round(scan['total_ms'], 3))
+                          for scan in sorted(self.seq_scans.values(),
+                                             key=lambda scan: (-len(scan['tenants']), -scan['total_ms']))[:top]],
+        }
+
+    def log_report(self, top=15):
+        report = self.report(top)
+        if not report['tenants']:
+            logging.info("No tenant plans profiled")
+            return report
+        executions = [tenant['execution_ms'] for tenant in report['tenants']]
+        logging.info(f"Profiled {len(executions)} tenant(s): execution avg {sum(executions) / len(executions):.1f}ms, "
+                     f"max {executions[0]:.1f}ms ({report['tenants'][0]['tenant']})")
+        logging.info("Time by CTE:")
+        for cte in report['ctes'][:top]:
+            logging.info(f"  {cte['cte']}: {cte['total_ms']:.1f}ms ({cte['share']:.0%}), "
+                         f"{cte['avg_ms_per_tenant']:.2f}ms/tenant, {cte['shared_read_blocks']} block(s) read, "
+                         f"{cte['shared_hit_blocks']} hit")
+        logging.info("Slowest plan nodes:")
+        for node in report['slowest_nodes']:
+            target = f" on {node['relation']}" if node['relation'] else ''
+            logging.info(f"  {node['node']}{target} in {node['cte']}: {node['total_ms']:.1f}ms total, "
+                         f"max {node['max_ms']:.1f}ms ({node['slowest_tenant']})")
+        logging.info("Most frequent sequential scans:")
+        for scan in report['seq_scans']:
+            logging.info(f"  {scan['relation']} in {scan['cte']}: {scan['tenants']} tenant(s), "
+                         f"{scan['total_ms']:.1f}ms, {scan['rows_removed_by_filter']} row(s) removed by filter")
+        return report
+
+
+def profile_tenants(pool, customers, region, profile):
+    """
+    Profiles the metrics statement for each customer and adds the plans to profile.
+
+    :param pool: ConnectionPool of the region
+    :param customers: Customer rows as returned by fetch_live_customers
+    :param region: Region name, part of the tenant labels
+    :param profile: QueryProfile collecting the plans
+    """
+    for customer in customers:
+        started = time.monotonic()
+        try:
+            with pool.connection() as conn:
+                plan = explain_tenant(conn, customer[1], customer[3], profile.months_lookback, profile.groups)
+        except Exception as e:
+            logging.error(f"Error profiling customer {customer[0]}: {e}")
+            continue
+        profile.add(f"{region}/{customer[3]} ({customer[0]})", plan)
+        logging.debug(f"Profiled {customer[0]} in {time.monotonic() - started:.2f}s")
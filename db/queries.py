@@ -1,11 +1,18 @@
-def fetch_live_customers(conn):
-    """
-    Fetches the list of live customers with their details.
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 
-    :param conn: Database connection object
-    :return: List of tuples containing customer details
-    """
-    query = """
+from psycopg2 import sql
+
+from db.catalog import fetch_tenant_schemas
+from db.metrics import build_metrics_query, build_prepared_metrics_query, metric_columns, resolve_metric_groups
+
+
+LIVE_CUSTOMERS_QUERY = """
     SELECT t.company AS customer, t.id AS tenant_id, 
         CASE WHEN tp.plan = 0 THEN 'Starter' 
             WHEN tp.plan = 1 THEN 'Pro' 
@@ -13,327 +20,305 @@ def fetch_live_customers(conn):
             WHEN tp.plan = 3 THEN 'Custom' 
             ELSE 'Contract Now' 
         END AS plan, 
-        iss.schema_name,
         tp.hubspot_id 
     FROM public.tenants t 
     LEFT JOIN public.tenant_profiles tp ON t.id = tp.tenant_id 
-    LEFT JOIN information_schema.schemata iss ON t.id::varchar(255) = reverse(split_part(reverse(iss.schema_name), '_', 1)) 
     WHERE tp.status = 1 
-      AND iss.schema_name IS NOT NULL
+      AND t.id = ANY(%s)
+    """
+
+
+def _customer_rows(rows, schemas_by_tenant):
+    """Expands tenant rows into one customer tuple per tenant schema."""
+    for customer, tenant_id, plan, hubspot_id in rows:
+        for schema_name in schemas_by_tenant[tenant_id]:
+            yield customer, tenant_id, plan, schema_name, hubspot_id
+
+
+def fetch_live_customers(conn, schemas_by_tenant=None):
+    """
+    Fetches the list of live customers with their details.
+
+    :param conn: Database connection object
+    :param schemas_by_tenant: Dict of tenant_id -> schema names (see db.catalog), or None
+                              to read it from pg_namespace
+    :return: List of tuples containing customer details, one per tenant schema
     """
+    if schemas_by_tenant is None:
+        schemas_by_tenant = fetch_tenant_schemas(conn)
+    if not schemas_by_tenant:
+        return []
+
     with conn.cursor() as cursor:
-        cursor.execute(query)
-        results = cursor.fetchall()
-    return results
-
-def fetch_customer_additional_data(conn, tenant_id, schema_name, months_lookback=1):
-    query = f"""
-    WITH settings_check AS (
-        SELECT
-            (SELECT CASE WHEN COALESCE(esign, false) THEN 'Enabled' ELSE 'Disabled' END
-             FROM {schema_name}.settings LIMIT 1) as gk_esign_enabled,
-            COALESCE(
-                (SELECT CASE
-                    WHEN p.jsonb_value <> '{{}}'::jsonb THEN 'Enabled'
-                    ELSE 'Disabled'
-                END
-                FROM {schema_name}.properties p
-                WHERE p.scope_name = 'docu_sign' AND p.name = 'user_info'),
-                'Disabled'
-            ) as docusign_enabled
-    ),
-
-    logged_in_users AS (
-        SELECT COUNT(DISTINCT u.id) as logged_in_count
-        FROM public.users u
-        LEFT JOIN public.employments e ON e.user_id = u.id
-        WHERE e.tenant_id = {tenant_id}
-        AND u.current_sign_in_at >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-        AND u.email NOT LIKE '%%@gatekeeperhq.com'
-    ),
-    active_users AS (
-        SELECT COUNT(DISTINCT v.whodunnit::integer) as active_count
-        FROM {schema_name}.versions v
-        JOIN public.users u ON u.id = v.whodunnit::integer
-        WHERE v.created_at >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-        AND u.email NOT LIKE '%%@gatekeeperhq.com'
-    ),
-    inactive_users AS (
-        SELECT (logged_in_count - active_count) as inactive_count
-        FROM logged_in_users, active_users
-    ),
-    settings_rbac_check AS (
-        SELECT CASE WHEN access_groups = true THEN 'Enabled' ELSE 'Disabled' END as "RBAC Status"
-        FROM {schema_name}.settings
-    ),
-    group_counts AS (
-        SELECT COUNT(CASE WHEN kind = 10 THEN 1 END) as "RBAC Groups"
-        FROM {schema_name}.access_groups
-        WHERE predefined = false
-    ),
-
-    saved_custom_views AS (
-        SELECT COUNT(DISTINCT id) AS "Saved Custom Views"
-        FROM {schema_name}.ui_tables_filters ui
-        WHERE ui.title <> 'Default' AND ui.meta_status = '20'
-    ),
-    smart_forms_enabled AS (
-        SELECT COALESCE(
-            (SELECT CASE WHEN tf.meta_status = 10 THEN 'ON' ELSE 'OFF' END
-             FROM public.tenants_features tf
-             JOIN public.tenant_profiles tp ON tf.tenant_profile_id = {tenant_id}
-             WHERE tf.kind = '280' AND tp.tenant_id = {tenant_id}),
-            'OFF'
-        ) AS "Smart Forms Enabled"
-    ),
-
-    signing_stats AS (
-        SELECT
-            CASE
-                WHEN provider = 10 THEN 'GK E-Sign'
-                WHEN provider = 20 THEN 'DocuSign'
-            END as signing_provider,
-            COUNT(DISTINCT esp.id) as signed_count
-        FROM {schema_name}.esign_sign_processes esp
-        WHERE esp.meta_status = 100
-            AND esp.file_host_type = 'Contract'
-            AND esp.updated_at >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-        GROUP BY provider
-    ),
-
-    scored_entities AS (
-        SELECT
-            ct.id AS tab_id,
-            ct.title AS tab_name,
-            cts.scorable_type,
-            cts.scorable_id,
-            COALESCE(
-                c.title,
-                s.name,
-                p.title,
-                'Unknown'
-            ) AS entity_name,
-            MAX(cts.updated_at::Date) AS latest_update
-        FROM {schema_name}.custom_tabs ct
-        LEFT JOIN {schema_name}.custom_tab_scores cts ON ct.id = cts.custom_tab_id
-            AND cts.meta_status = 20
-            AND (cts.value != 0 OR cts.value IS NULL)
-        LEFT JOIN {schema_name}.contracts c ON cts.scorable_type = 'Contract' AND cts.scorable_id = c.id
-        LEFT JOIN {schema_name}.suppliers s ON cts.scorable_type = 'Supplier' AND cts.scorable_id = s.id
-        LEFT JOIN {schema_name}.projects p ON cts.scorable_type = 'Project' AND cts.scorable_id = p.id
-        WHERE ct.scored = true
-        GROUP BY
-            ct.id,
-            ct.title,
-            cts.scorable_type,
-            cts.scorable_id,
-            COALESCE(c.title, s.name, p.title, 'Unknown')
-    ),
-
-    null_scores AS (
-        SELECT COUNT(*) as tabs_with_null_scores
-        FROM {schema_name}.custom_tabs ct
-        WHERE ct.scored = true
-        AND NOT EXISTS (
-            SELECT 1
-            FROM {schema_name}.custom_tab_scores cts
-            WHERE cts.custom_tab_id = ct.id
-            AND cts.value != 0
-            AND cts.meta_status = 20
-        )
-    ),
-    smart_forms_summary AS (
-        SELECT
-            sfe."Smart Forms Enabled" AS "Smart Forms Enabled",
-            COUNT(DISTINCT se.tab_id) AS "Smart Forms Count",
-            STRING_AGG(DISTINCT se.scorable_type, ' | ' ORDER BY se.scorable_type) AS "Smart Form Types",
-            MAX(se.latest_update) AS "Latest Updated Score",
-            COALESCE(ns.tabs_with_null_scores, 0) AS "Smart Forms with No Scores"
-        FROM smart_forms_enabled sfe
-        LEFT JOIN scored_entities se ON true
-        CROSS JOIN null_scores ns
-        GROUP BY sfe."Smart Forms Enabled", ns.tabs_with_null_scores
-    ),
-
-    autobuild_status AS (
-        SELECT CASE WHEN s.supplier_auto_build = True
-                    THEN 'ON'
-                    ELSE 'OFF'
-               END AS "Auto Build Enabled"
-        FROM {schema_name}.settings s
-    ),
-    autobuild_count AS (
-        WITH autobuild_fields AS (
-            SELECT cf.id::text as field_id
-            FROM {schema_name}.custom_fields cf
-            JOIN {schema_name}.custom_groups cg ON cf.custom_group_id = cg.id
-            WHERE cg.predefined_kind = 100
-        )
-        SELECT COUNT(DISTINCT s.id) AS "Autobuild Supplier Count"
-        FROM {schema_name}.suppliers s
-        WHERE EXISTS (
-            SELECT 1
-            FROM autobuild_fields af
-            WHERE s.custom_fields_data ? af.field_id
-            AND s.custom_fields_data->>af.field_id IS NOT NULL
-            AND s.custom_fields_data->>af.field_id != ''
-        )
-    )
-
-    SELECT
-        logged_in_users.logged_in_count as "Total Logged In Users ({months_lookback}m)",
-        active_users.active_count as "Users Who Performed Actions ({months_lookback}m)",
-        inactive_users.inactive_count as "Users Who Only Logged In ({months_lookback}m)",
-
-        settings_rbac_check."RBAC Status",
-        group_counts."RBAC Groups",
-
-        total_contracts_data."Total Contracts (inc Archived)",
-        total_contracts_data."Total Live Contracts",
-        total_contracts_data."NEW Live Contracts ({months_lookback}m)",
-        total_contracts_data."Updated Live Contracts ({months_lookback}m)",
-
-        total_contracts_data."Main Currency",
-        total_contracts_data."Average Contract Value (Live)",
-
-        total_contracts_data."Live Contracts with Internal Owners",
-        total_contracts_data."Live Contracts with NO Internal Owners",
-        total_contracts_data."Percent Contracts with Internal Owners",
-        contract_links_data."Live Contracts Linked to another Contract",
-        supplier_links_data."Live Suppliers Linked to another Supplier",
-
-        master_record_data."Contracts with Master Record",
-        master_record_data."Percent with Master Record",
-        ai_extract_data."AI Extract - Ready for Review ({months_lookback}m)",
-        total_contracts_data."OpenAI Contract Summary",
-
-        activities_data."Total Events (All Time)",
-        activities_data."New Events ({months_lookback}m)",
-        activities_data."Completed Events ({months_lookback}m)",
-        activities_data."Overdue Events",
-        activities_data."Events Avg Completion Time ({months_lookback}m)",
-        activities_data."Event Types",
-
-        smart_forms."Smart Forms Enabled",
-        smart_forms."Smart Forms Count",
-        smart_forms."Smart Form Types",
-        smart_forms."Latest Updated Score",
-        smart_forms."Smart Forms with No Scores",
-        saved_custom_views."Saved Custom Views",
-
-        autobuild_status."Auto Build Enabled",
-        autobuild_count."Autobuild Supplier Count",
-
-        settings_check.gk_esign_enabled as "eSign Enabled",
-        settings_check.docusign_enabled as "DocuSign Enabled",
-        COALESCE(gk_esign.signed_count, 0) as "eSigns ({months_lookback}m)",
-        COALESCE(docusign.signed_count, 0) as "DocuSigns ({months_lookback}m)"
-
-    FROM
-        (SELECT
-            COUNT(DISTINCT c.id) AS "Total Contracts (inc Archived)",
-            COUNT(DISTINCT CASE WHEN c.created_at >= CURRENT_DATE - INTERVAL '{months_lookback} months' THEN c.id END) 
-                AS "NEW Live Contracts ({months_lookback}m)",
-            COUNT(DISTINCT CASE WHEN c.updated_at >= CURRENT_DATE - INTERVAL '{months_lookback} months' THEN c.id END) 
-                AS "Updated Live Contracts ({months_lookback}m)",
-            COUNT(DISTINCT CASE WHEN c.meta_status = 20 THEN c.id END) AS "Total Live Contracts",
-            (SELECT reporting_currency FROM {schema_name}.settings LIMIT 1) AS "Main Currency",
-            (SELECT CASE WHEN open_ai_contract_summary = True THEN 'ON' ELSE 'OFF' END FROM {schema_name}.settings LIMIT 1) AS "OpenAI Contract Summary",
-            COALESCE(ROUND(AVG(cs.annual_value_cents) FILTER (WHERE c.meta_status = 20) / 100), 0) AS "Average Contract Value (Live)",
-            COUNT(DISTINCT CASE WHEN o.id IS NOT NULL AND c.meta_status = 20 THEN c.id END) as "Live Contracts with Internal Owners",
-            COUNT(DISTINCT CASE WHEN o.id IS NULL AND c.meta_status = 20 THEN c.id END) as "Live Contracts with NO Internal Owners",
-            ROUND(
-                (COUNT(DISTINCT CASE WHEN o.id IS NOT NULL AND c.meta_status = 20 THEN c.id END)::decimal /
-                NULLIF(COUNT(DISTINCT CASE WHEN c.meta_status = 20 THEN c.id END), 0) * 100)
-            , 2) as "Percent Contracts with Internal Owners"
-        FROM {schema_name}.contracts c
-        LEFT JOIN {schema_name}.contract_summaries cs ON c.id = cs.contract_id
-        LEFT JOIN {schema_name}.owners o ON c.id = o.host_id
-            AND o.host_type = 'Contract'
-            AND EXISTS (
-                SELECT 1
-                FROM {schema_name}.owner_kinds ok
-                WHERE ok.id = o.owner_kind_id
-                AND ok.predefined = true
-            )
-        ) AS total_contracts_data
-
-    CROSS JOIN LATERAL
-        (SELECT
-            COUNT(CASE WHEN has_master_record THEN 1 END) AS "Contracts with Master Record",
-            ROUND(
-                (COUNT(CASE WHEN has_master_record THEN 1 END)::decimal /
-                NULLIF(COUNT(*), 0) * 100), 2) AS "Percent with Master Record"
-        FROM {schema_name}.contract_reviews
-        ) AS master_record_data
-
-    CROSS JOIN LATERAL
-        (SELECT
-            COUNT(DISTINCT id) AS "AI Extract - Ready for Review ({months_lookback}m)"
-        FROM {schema_name}.attachments_file_analyses_summaries
-        WHERE analyzed_at::Date < CURRENT_DATE - INTERVAL '{months_lookback} months'
-          AND analyzer_job_status = 30
-        ) AS ai_extract_data
-
-    CROSS JOIN LATERAL
-        (SELECT
-            COUNT(DISTINCT a.id) as "Total Events (All Time)",
-            COUNT(DISTINCT CASE
-                WHEN a.created_at >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-                THEN a.id END) as "New Events ({months_lookback}m)",
-            COUNT(DISTINCT CASE
-                WHEN a.date_completed >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-                THEN a.id END) as "Completed Events ({months_lookback}m)",
-            COUNT(DISTINCT CASE
-                WHEN a.due_date < CURRENT_DATE
-                AND a.date_completed IS NULL
-                THEN a.id END) as "Overdue Events",
-            COALESCE(
-                ROUND(AVG(CASE
-                    WHEN a.date_completed >= CURRENT_DATE - INTERVAL '{months_lookback} months'
-                    THEN EXTRACT(EPOCH FROM (a.date_completed - a.created_at))/86400.0
-                    END))::integer, 0) as "Events Avg Completion Time ({months_lookback}m)",
-            string_agg(DISTINCT co.label, ' | ' ORDER BY co.label) as "Event Types"
-        FROM {schema_name}.activities a
-        LEFT JOIN {schema_name}.custom_options co ON a.activity_type = co.id
-        ) AS activities_data
-
-    CROSS JOIN LATERAL
-        (SELECT
-            COUNT(DISTINCT c.id) as "Live Contracts Linked to another Contract"
-        FROM {schema_name}.contracts c
-    INNER JOIN {schema_name}.contract_links cl
-                ON c.id = cl.linked_contract_id OR c.id = cl.related_contract_id
-            WHERE c.meta_status = 20
-            ) AS contract_links_data
-
-        CROSS JOIN LATERAL
-            (SELECT
-                COUNT(DISTINCT s.id) as "Live Suppliers Linked to another Supplier"
-            FROM {schema_name}.suppliers s
-            INNER JOIN {schema_name}.supplier_links sl
-                ON s.id = sl.linked_supplier_id OR s.id = sl.related_supplier_id
-            WHERE s.meta_status = 20
-            ) AS supplier_links_data
-
-        CROSS JOIN smart_forms_summary smart_forms
-        CROSS JOIN saved_custom_views
-        CROSS JOIN autobuild_status
-        CROSS JOIN autobuild_count
-        CROSS JOIN settings_check
-        LEFT JOIN signing_stats gk_esign
-            ON gk_esign.signing_provider = 'GK E-Sign'
-        LEFT JOIN signing_stats docusign
-            ON docusign.signing_provider = 'DocuSign'
-        CROSS JOIN settings_rbac_check
-        CROSS JOIN group_counts
-        CROSS JOIN logged_in_users
-        CROSS JOIN active_users
-        CROSS JOIN inactive_users;
-        """
+        cursor.execute(LIVE_CUSTOMERS_QUERY, (list(schemas_by_tenant),))
+        rows = cursor.fetchall()
+    return list(_customer_rows(rows, schemas_by_tenant))
+
+
+def iter_live_customers(conn, schemas_by_tenant=None, itersize=500):
+    """
+    Yields live customers as they are read from a named server-side cursor.
+
+    Rows are transferred itersize at a time, so the first customer is
+    available right away and memory does not grow with the number of tenants.
+    The cursor lives in the connection's transaction: conn must not be used
+    for anything else (or committed/rolled back) until the generator is done.
+
+    :param conn: Database connection object
+    :param schemas_by_tenant: Dict of tenant_id -> schema names (see db.catalog), or None
+                              to read it from pg_namespace
+    :param itersize: Number of rows fetched per round trip
+    :return: Generator of tuples as returned by fetch_live_customers
+    """
+    if schemas_by_tenant is None:
+        schemas_by_tenant = fetch_tenant_schemas(conn)
+    if not schemas_by_tenant:
+        return
+
+    with conn.cursor(name='live_customers') as cursor:
+        cursor.itersize = itersize
+        cursor.execute(LIVE_CUSTOMERS_QUERY, (list(schemas_by_tenant),))
+        yield from _customer_rows(cursor, schemas_by_tenant)
+
+def build_customer_additional_data_query(tenant_id, schema_name, months_lookback=1, groups=None):
+    """
+    Builds the per-tenant metrics query used by fetch_customer_additional_data.
+
+    :param tenant_id: Tenant ID
+    :param schema_name: Tenant schema name
+    :param months_lookback: Number of months for time-based metrics, or a list of lookback windows
+    :param groups: List of MetricGroup objects to compute, or None for all groups
+    :return: SQL text without a trailing semicolon
+    """
+    return build_metrics_query(tenant_id, schema_name, months_lookback, groups)
+
+
+class QueryStats:
+    """
+    Thread-safe timing counters for the prepared tenant metrics statement.
+
+    prepare covers PREPARE (parse and parse analysis, once per connection and
+    statement), execute covers EXECUTE and fetch.
+    Planning time is sampled with EXPLAIN (SUMMARY) EXECUTE every
+    plan_sample_every executions when enabled.
+    """
+
+    def __init__(self, plan_sample_every=0):
+        self.plan_sample_every = plan_sample_every
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.prepares = 0
+            self.prepare_time = 0.0
+            self.executions = 0
+            self.execute_time = 0.0
+            self.plan_samples = 0
+            self.plan_time_ms = 0.0
+
+    def record_prepare(self, elapsed):
+        with self.lock:
+            self.prepares += 1
+            self.prepare_time += elapsed
+
+    def record_execute(self, elapsed):
+        """Record an execution and return whether its planning time should be sampled."""
+        with self.lock:
+            self.executions += 1
+            self.execute_time += elapsed
+            return bool(self.plan_sample_every) and (self.executions - 1) % self.plan_sample_every == 0
+
+    def record_plan(self, planning_ms):
+        with self.lock:
+            self.plan_samples += 1
+            self.plan_time_ms += planning_ms
+
+    def summary(self):
+        with self.lock:
+            return {
+                'prepares': self.prepares,
+                'avg_prepare_ms': round(self.prepare_time / self.prepares * 1000, 2) if self.prepares else 0.0,
+                'executions': self.executions,
+                'avg_execute_ms': round(self.execute_time / self.executions * 1000, 2) if self.executions else 0.0,
+                'plan_samples': self.plan_samples,
+                'avg_plan_ms': round(self.plan_time_ms / self.plan_samples, 2) if self.plan_samples else None,
+            }
 
+    def log_summary(self):
+        summary = self.summary()
+        if not summary['prepares'] and not summary['executions']:
+            return
+        plan = f"{summary['avg_plan_ms']}ms avg planning over {summary['plan_samples']} sample(s)" \
+            if summary['plan_samples'] else "planning not sampled"
+        logging.info(f"Metrics statement: {summary['prepares']} prepare(s) at {summary['avg_prepare_ms']}ms avg, "
+                     f"{summary['executions']} execution(s) at {summary['avg_execute_ms']}ms avg, {plan}")
+
+
+QUERY_STATS = QueryStats()
+
+# Names of the statements prepared on each connection
+_prepared_statements = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+def prepare_metrics_statement(conn, months_lookback=1, groups=None):
+    """
+    Prepares the tenant-independent metrics statement on conn if not already done.
+
+    Unqualified table names are resolved through the current search_path, so
+    a tenant schema must already be selected.
+
+    :return: Name of the prepared statement
+    """
+    query = build_prepared_metrics_query(months_lookback, groups)
+    name = 'tenant_metrics_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+
+    with _prepared_lock:
+        prepared = _prepared_statements.setdefault(conn, set())
+        if name in prepared:
+            return name
+
+    started = time.monotonic()
+    with conn.cursor() as cursor:
+        cursor.execute(f"PREPARE {name} (bigint) AS {query}")
+    QUERY_STATS.record_prepare(time.monotonic() - started)
+
+    with _prepared_lock:
+        prepared.add(name)
+    return name
+
+
+def fetch_customer_additional_data(conn, tenant_id, schema_name, months_lookback=1, groups=None,
+                                   statement_timeout_ms=None):
+    """
+    Fetches a tenant's metrics with the prepared metrics statement.
+
+    The statement is prepared once per connection; per tenant only the
+    search_path and the bound tenant id change. PostgreSQL
+    re-analyzes and re-plans a prepared statement when search_path changes, so
+    tenants still pay for planning (each schema has its own tables), but not
+    for building, sending and parsing the statement text.
+
+    :param conn: Database connection object
+    :param tenant_id: Tenant ID
+    :param schema_name: Tenant schema name
+    :param months_lookback: Number of months for time-based metrics, or a list of lookback windows
+    :param groups: List of MetricGroup objects to compute, or None for all groups
+    :param statement_timeout_ms: statement_timeout for this tenant's statements, or None for the server default
+    :return: Tuple of (results, columns)
+    """
+    # PREPARE resolves table names through the search_path, so select the schema first
+    with conn.cursor() as cursor:
+        cursor.execute(sql.SQL("SET LOCAL search_path TO {}").format(sql.Identifier(schema_name)))
+        if statement_timeout_ms:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", (str(statement_timeout_ms),))
+    name = prepare_metrics_statement(conn, months_lookback, groups)
+
+    started = time.monotonic()
     with conn.cursor() as cursor:
-        cursor.execute(query)
+        cursor.execute(f"EXECUTE {name} (%s)", (tenant_id,))
         results = cursor.fetchall()
         columns = [desc[0] for desc in cursor.description]
-    return results, columns
\ No newline at end of file
+    sample_plan = QUERY_STATS.record_execute(time.monotonic() - started)
+
+    if sample_plan:
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON, SUMMARY TRUE) EXECUTE {name} (%s)", (tenant_id,))
+            plan = cursor.fetchone()[0]
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            QUERY_STATS.record_plan(plan[0].get('Planning Time', 0.0))
+    return results, columns
+
+
+def fetch_customers_additional_data_batch(conn, tenants, months_lookback=1, chunk_size=25, groups=None):
+    """
+    Fetches the metrics of many tenants with one statement per chunk.
+
+    Each chunk is a UNION ALL of the per-tenant queries, every row tagged with
+    its position in the chunk. If a chunk fails (for example one schema is
+    missing a table) its tenants are fetched one by one so that only the
+    broken tenant reports an error.
+
+    :param conn: Database connection object
+    :param tenants: List of (tenant_id, schema_name) pairs
+    :param months_lookback: Number of months for time-based metrics, or a list of lookback windows
+    :param chunk_size: Number of tenants per statement
+    :param groups: List of MetricGroup objects to compute, or None for all groups
+    :return: Generator of (results, columns, error) tuples in the order of tenants,
+             where results and columns match fetch_customer_additional_data
+    """
+    chunk_size = max(chunk_size, 1)
+    for start in range(0, len(tenants), chunk_size):
+        chunk = tenants[start:start + chunk_size]
+        query = "\nUNION ALL\n".join(
+            f"SELECT {index} AS batch_index, t{index}.* FROM ({build_customer_additional_data_query(tenant_id, schema_name, months_lookback, groups)}) t{index}"
+            for index, (tenant_id, schema_name) in enumerate(chunk)
+        )
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                rows = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description][1:]
+        except Exception as e:
+            logging.warning(f"Batched metrics query failed for {len(chunk)} tenant(s), retrying one by one: {e}")
+            conn.rollback()
+            for tenant_id, schema_name in chunk:
+                try:
+                    results, columns = fetch_customer_additional_data(
+                        conn, tenant_id, schema_name, months_lookback, groups)
+                    yield results, columns, None
+                except Exception as tenant_error:
+                    conn.rollback()
+                    yield [], [], tenant_error
+            continue
+
+        rows_by_index = {}
+        for row in rows:
+            rows_by_index.setdefault(row[0], []).append(tuple(row[1:]))
+        for index in range(len(chunk)):
+            yield rows_by_index.get(index, []), columns, None
+
+
+class ParallelMetricsFetcher:
+    """
+    Computes the metric groups of one tenant concurrently, one group per connection.
+
+    Each group runs on its own connection checked out from a ConnectionPool.
+    fetch returns the same (results, columns) shape as
+    fetch_customer_additional_data for the same groups.
+    """
+
+    def __init__(self, pool, workers):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='metrics')
+
+    def _fetch_group(self, tenant_id, schema_name, months_lookback, group, statement_timeout_ms):
+        with self.pool.connection() as conn:
+            return fetch_customer_additional_data(conn, tenant_id, schema_name, months_lookback, [group],
+                                                  statement_timeout_ms)
+
+    def fetch(self, tenant_id, schema_name, months_lookback=1, groups=None, statement_timeout_ms=None):
+        groups = groups or resolve_metric_groups()
+        futures = [self.executor.submit(self._fetch_group, tenant_id, schema_name, months_lookback, group,
+                                        statement_timeout_ms)
+                   for group in groups]
+
+        row = {}
+        empty = False
+        for future in futures:
+            results, columns = future.result()
+            if not results:
+                # A group without rows empties the cross join of the combined query
+                empty = True
+                continue
+            row.update(zip(columns, results[0]))
+
+        columns = metric_columns(groups, months_lookback)
+        if empty:
+            return [], columns
+        return [tuple(row[column] for column in columns)], columns
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,332 @@
+# db/rollups.py
+"""
+Per-tenant daily rollups of the time-windowed metrics.
+
+The windowed metrics otherwise rescan the raw history on every run (active
+users count DISTINCT whodunnit over the whole versions window). The rollup
+store keeps, per tenant schema, day buckets of:
+
+  active_users        the ids of the users who created versions that day
+  contracts_created   contracts by created_at day
+  contracts_updated   contracts by the day of their latest updated_at
+  events_created      activities by created_at day
+  events_completed    activities by date_completed day, with the completion time in days
+  esigns              signed Contract e-sign processes by updated_at day, per provider
+
+Each run ingests only the rows since the day of the previous ingest (that day
+is read again, it may have been partial), so with indexes on the timestamp
+columns a run reads days, not months. Any lookback window is then answered by
+merging the buckets from the window's first day: users are counted distinctly
+across days, and the other rollups keep one entry per item under the day of
+its latest change, so an item moves between buckets instead of being counted
+twice.
+
+The first ingest of a rollup backfills the widest window requested; a wider
+window later rebuilds it from the new start. Deleted rows, reopened events and
+back-dated completions are not seen by the incremental ingest; every rollup is
+rebuilt once it is rebuild_days old to bound that drift (0 never rebuilds).
+Days are bucketed and window starts computed by the database, with the same
+CURRENT_DATE arithmetic as the metrics query.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+
+from db.metrics import lookback_windows, metric_columns, quote_schema
+
+DEFAULT_ROLLUP_PATH = 'cache/metric_rollups.sqlite'
+
+# Distinct user ids per day, as (day, user_id) rows
+ACTIVE_USERS_QUERY = """
+    SELECT DISTINCT v.created_at::date, v.whodunnit::integer
+    FROM {schema}versions v
+    JOIN public.users u ON u.id = v.whodunnit::integer
+    WHERE v.created_at >= %(since)s
+    AND u.email NOT LIKE '%%@gatekeeperhq.com'
+"""
+
+# Item rollups: name -> (query, metrics). The query yields (item_id, day, metric, value) rows; an item is
+# removed from all the rollup's metrics before it is stored again, and a NULL metric only removes it.
+ITEM_ROLLUPS = {
+    'contracts_created': ("""
+        SELECT id, created_at::date, 'contracts_created', NULL
+        FROM {schema}contracts
+        WHERE created_at >= %(since)s
+    """, ('contracts_created',)),
+    'contracts_updated': ("""
+        SELECT id, updated_at::date, 'contracts_updated', NULL
+        FROM {schema}contracts
+        WHERE updated_at >= %(since)s
+    """, ('contracts_updated',)),
+    'events_created': ("""
+        SELECT id, created_at::date, 'events_created', NULL
+        FROM {schema}activities
+        WHERE created_at >= %(since)s
+    """, ('events_created',)),
+    'events_completed': ("""
+        SELECT id, date_completed::date, 'events_completed',
+               EXTRACT(EPOCH FROM (date_completed - created_at))/86400.0
+        FROM {schema}activities
+        WHERE date_completed >= %(since)s
+    """, ('events_completed',)),
+    'esigns': ("""
+        SELECT id, updated_at::date,
+               CASE WHEN meta_status = 100 AND file_host_type = 'Contract' THEN
+                   CASE provider WHEN 10 THEN 'gk_esigns' WHEN 20 THEN 'docusigns' END
+               END,
+               NULL
+        FROM {schema}esign_sign_processes
+        WHERE updated_at >= %(since)s
+    """, ('gk_esigns', 'docusigns')),
+}
+
+# Windowed column template -> (rollup, metric, aggregate) answering it
+ROLLUP_COLUMNS = {
+    'Users Who Performed Actions ({months_lookback}m)': ('active_users', 'active_users', 'count'),
+    'NEW Live Contracts ({months_lookback}m)': ('contracts_created', 'contracts_created', 'count'),
+    'Updated Live Contracts ({months_lookback}m)': ('contracts_updated', 'contracts_updated', 'count'),
+    'New Events ({months_lookback}m)': ('events_created', 'events_created', 'count'),
+    'Completed Events ({months_lookback}m)': ('events_completed', 'events_completed', 'count'),
+    'Events Avg Completion Time ({months_lookback}m)': ('events_completed', 'events_completed', 'avg'),
+    'eSigns ({months_lookback}m)': ('esigns', 'gk_esigns', 'count'),
+    'DocuSigns ({months_lookback}m)': ('esigns', 'docusigns', 'count'),
+}
+
+# Columns derived from a logged-in count in the metrics row and the active users rollup
+INACTIVE_USERS_COLUMN = 'Users Who Only Logged In ({months_lookback}m)'
+LOGGED_IN_USERS_COLUMN = 'Total Logged In Users ({months_lookback}m)'
+ACTIVE_USERS_COLUMN = 'Users Who Performed Actions ({months_lookback}m)'
+
+
+def fetch_window_starts(conn, months_lookback):
+    """
+    The database CURRENT_DATE and the first day of each lookback window.
+
+    :return: Tuple of (current date, dict of months -> first day of the window)
+    """
+    windows = lookback_windows(months_lookback)
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT CURRENT_DATE, m, (CURRENT_DATE - make_interval(months => m))::date
+            FROM unnest(%s::int[]) AS m
+        """, (list(windows),))
+        rows = cursor.fetchall()
+    return rows[0][0], {months: start for _, months, start in rows}
+
+
+def _round_half_up(value):
+    """Round like PostgreSQL ROUND(numeric): halves away from zero."""
+    return int(Decimal(str(value)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class MetricRollupStore:
+    """SQLite store of per-tenant daily buckets answering the windowed metrics."""
+
+    def __init__(self, path=DEFAULT_ROLLUP_PATH, rebuild_days=7):
+        """
+        :param path: SQLite file holding the rollups of all regions
+        :param rebuild_days: Days after which a rollup is rebuilt from the raw rows; 0 never rebuilds
+        """
+        self.path = path
+        self.rebuild_days = rebuild_days
+        self.built = 0
+        self.updated = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                region TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                rollup TEXT NOT NULL,
+                covered_from TEXT NOT NULL,
+                ingested_through TEXT NOT NULL,
+                built_on TEXT NOT NULL,
+                PRIMARY KEY (region, tenant_id, schema_name, rollup)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_users (
+                region TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (region, tenant_id, schema_name, day, user_id)
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_items (
+                region TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                item_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                value REAL,
+                PRIMARY KEY (region, tenant_id, schema_name, metric, item_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS rollup_items_day "
+                          "ON rollup_items (region, tenant_id, schema_name, metric, day)")
+        self.conn.commit()
+
+    @staticmethod
+    def rollups_for(groups):
+        """Names of the rollups answering the rollup_columns of the given groups."""
+        return sorted({ROLLUP_COLUMNS[column][0] for group in groups for column in group.rollup_columns
+                       if column in ROLLUP_COLUMNS})
+
+    def refresh(self, conn, region, tenant_id, schema_name, rollups, today, start):
+        """
+        Bring a tenant's rollups up to date, backfilling or rebuilding them from start when needed.
+
+        :param conn: Database connection used to read the tenant's rows
+        :param rollups: Rollup names, see rollups_for
+        :param today: Database CURRENT_DATE
+        :param start: First day of the widest lookback window
+        """
+        key = (region, tenant_id, schema_name)
+        for rollup in rollups:
+            with self.lock:
+                state = self.conn.execute(
+                    "SELECT covered_from, ingested_through, built_on FROM rollup_state "
+                    "WHERE region = ? AND tenant_id = ? AND schema_name = ? AND rollup = ?", (*key, rollup)
+                ).fetchone()
+            rebuild = (state is None
+                       or start.isoformat() < state[0]
+                       or (self.rebuild_days and (today - date.fromisoformat(state[2])).days >= self.rebuild_days))
+            since = start if rebuild else date.fromisoformat(state[1])
+
+            with conn.cursor() as cursor:
+                query = ACTIVE_USERS_QUERY if rollup == 'active_users' else ITEM_ROLLUPS[rollup][0]
+                cursor.execute(query.format(schema=quote_schema(schema_name) + '.'), {'since': since})
+                rows = cursor.fetchall()
+
+            with self.lock:
+                if rollup == 'active_users':
+                    if rebuild:
+                        self.conn.execute("DELETE FROM rollup_users WHERE region = ? AND tenant_id = ? "
+                                          "AND schema_name = ?", key)
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO rollup_users (region, tenant_id, schema_name, day, user_id) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(*key, day.isoformat(), user_id) for day, user_id in rows]
+                    )
+                else:
+                    metrics = ITEM_ROLLUPS[rollup][1]
+                    placeholders = ', '.join('?' * len(metrics))
+                    if rebuild:
+                        self.conn.execute(f"DELETE FROM rollup_items WHERE region = ? AND tenant_id = ? "
+                                          f"AND schema_name = ? AND metric IN ({placeholders})", (*key, *metrics))
+                    else:
+                        self.conn.executemany(
+                            f"DELETE FROM rollup_items WHERE region = ? AND tenant_id = ? AND schema_name = ? "
+                            f"AND item_id = ? AND metric IN ({placeholders})",
+                            [(*key, item_id, *metrics) for item_id, _, _, _ in rows]
+                        )
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO rollup_items (region, tenant_id, schema_name, metric, item_id, day, "
+                        "value) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(*key, metric, item_id, day.isoformat(), float(value) if value is not None else None)
+                         for item_id, day, metric, value in rows if metric is not None]
+                    )
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rollup_state (region, tenant_id, schema_name, rollup, covered_from, "
+                    "ingested_through, built_on) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (*key, rollup, start.isoformat() if rebuild else state[0], today.isoformat(),
+                     today.isoformat() if rebuild else state[2])
+                )
+                self.conn.commit()
+                self.rows += len(rows)
+                if rebuild:
+                    self.built += 1
+                else:
+                    self.updated += 1
+            logging.debug(f"Rollup {rollup} of tenant {tenant_id} ({schema_name}): "
+                          f"{'rebuilt' if rebuild else 'updated'} from {since}, {len(rows)} row(s)")
+
+    def window_values(self, region, tenant_id, schema_name, start):
+        """
+        Merge a tenant's buckets from start on.
+
+        :return: Dict of (metric, aggregate) -> value, aggregates 'count' and 'avg'
+        """
+        key = (region, tenant_id, schema_name)
+        with self.lock:
+            active = self.conn.execute(
+                "SELECT COUNT(DISTINCT user_id) FROM rollup_users "
+                "WHERE region = ? AND tenant_id = ? AND schema_name = ? AND day >= ?", (*key, start.isoformat())
+            ).fetchone()[0]
+            rows = self.conn.execute(
+                "SELECT metric, COUNT(*), AVG(value) FROM rollup_items "
+                "WHERE region = ? AND tenant_id = ? AND schema_name = ? AND day >= ? GROUP BY metric",
+                (*key, start.isoformat())
+            ).fetchall()
+        values = {('active_users', 'count'): active}
+        for metric, count, average in rows:
+            values[(metric, 'count')] = count
+            values[(metric, 'avg')] = average
+        return values
+
+    def log_stats(self):
+        logging.info(f"Metric rollups: {self.built} rebuilt, {self.updated} updated incrementally, "
+                     f"{self.rows} row(s) ingested")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def add_rollup_columns(store, conn, region, tenant_id, schema_name, months_lookback, groups, results, columns):
+    """
+    Completes a tenant's metrics with the rollup_columns answered from the rollup store.
+
+    conn's transaction is rolled back first, so the ingest does not run under
+    the transaction-local settings (such as the statement_timeout) of the
+    metrics statement that preceded it.
+
+    :param store: MetricRollupStore
+    :param conn: Connection used to ingest the tenant's new rows
+    :param groups: List of MetricGroup objects being computed
+    :param results: Metrics rows of the groups without their rollup_columns (see without_rollup_columns)
+    :param columns: Column names of results
+    :return: Tuple of (results, columns) as computed for groups by the metrics statement
+    """
+    rollups = store.rollups_for(groups)
+    if not rollups:
+        return results, columns
+    full_columns = metric_columns(groups, months_lookback)
+    if not results:
+        return [], full_columns
+
+    conn.rollback()
+    today, starts = fetch_window_starts(conn, months_lookback)
+    store.refresh(conn, region, tenant_id, schema_name, rollups, today, starts[max(starts)])
+
+    row = dict(zip(columns, results[0]))
+    rollup_columns = {column for group in groups for column in group.rollup_columns}
+    for months, start in starts.items():
+        values = store.window_values(region, tenant_id, schema_name, start)
+        for column in rollup_columns:
+            if column not in ROLLUP_COLUMNS:
+                continue
+            _, metric, aggregate = ROLLUP_COLUMNS[column]
+            value = values.get((metric, aggregate))
+            if aggregate == 'avg':
+                value = _round_half_up(value) if value is not None else 0
+            row[column.format(months_lookback=months)] = value or 0
+        if INACTIVE_USERS_COLUMN in rollup_columns:
+            row[INACTIVE_USERS_COLUMN.format(months_lookback=months)] = (
+                row[LOGGED_IN_USERS_COLUMN.format(months_lookback=months)]
+                - row[ACTIVE_USERS_COLUMN.format(months_lookback=months)])
+    return [tuple(row[column] for column in full_columns)], full_columns
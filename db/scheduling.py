@@ -0,0 +1,153 @@
+# db/scheduling.py
+"""
+Size-aware tenant scheduling.
+
+A tenant's cost is estimated before the run from planner statistics: the sum
+of pg_class.reltuples of the tenant schema tables each metric group reads (a
+table read by several groups counts once per group), taken with one catalog
+query for all tenants. Shared public tables cost about the same for every
+tenant and are left out.
+
+Customers are dispatched largest first. With several fetch workers pulling
+from one queue this is longest-processing-time-first scheduling: the big
+tenants start early and the small ones fill the gaps at the end, instead of a
+huge tenant starting last and holding up the run. Each tenant's metrics
+statement gets a statement_timeout scaled with its estimate, so a runaway
+query fails that tenant only.
+
+The actual metrics query time is recorded per tenant. The report fits one
+seconds-per-million-rows rate over all tenants and lists predicted against
+actual seconds, with the tenants furthest from the prediction first.
+"""
+
+import logging
+import threading
+
+# Error code of a statement cancelled by statement_timeout
+QUERY_CANCELED = '57014'
+
+
+def fetch_tenant_sizes(conn, tenants, groups):
+    """
+    Estimates the rows the metrics query reads for each tenant.
+
+    Tables never analyzed (reltuples -1) are estimated at 100 bytes per row.
+
+    :param conn: Database connection object
+    :param tenants: List of (tenant_id, schema_name) pairs
+    :param groups: List of MetricGroup objects the metrics will be computed for
+    :return: Dict of (tenant_id, schema_name) -> estimated rows
+    """
+    tables = sorted({table for group in groups for table in group.tables})
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT n.nspname, c.relname,
+                   CASE WHEN c.reltuples >= 0 THEN c.reltuples ELSE pg_relation_size(c.oid) / 100.0 END
+            FROM pg_catalog.pg_class c
+            JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = ANY(%(schemas)s)
+              AND c.relname = ANY(%(tables)s)
+              AND c.relkind IN ('r', 'p')
+        """, {'schemas': sorted({schema_name for _, schema_name in tenants}), 'tables': tables})
+        rows = {}
+        for schema_name, table, estimate in cursor.fetchall():
+            rows[(schema_name, table)] = float(estimate)
+
+    return {
+        (tenant_id, schema_name): sum(rows.get((schema_name, table), 0.0)
+                                      for group in groups for table in group.tables)
+        for tenant_id, schema_name in tenants
+    }
+
+
+class TenantSchedule:
+    """Dispatch order, statement timeouts and predicted vs. actual cost of a region's tenants."""
+
+    def __init__(self, sizes, timeout_base_seconds=60, timeout_seconds_per_million_rows=120,
+                 timeout_max_seconds=1800):
+        """
+        :param sizes: Dict of (tenant_id, schema_name) -> estimated rows, see fetch_tenant_sizes
+        :param timeout_base_seconds: statement_timeout of an empty tenant; 0 disables the timeouts
+        :param timeout_seconds_per_million_rows: Timeout added per million estimated rows
+        :param timeout_max_seconds: Upper bound of the timeout
+        """
+        self.sizes = sizes
+        self.timeout_base_seconds = timeout_base_seconds
+        self.timeout_seconds_per_million_rows = timeout_seconds_per_million_rows
+        self.timeout_max_seconds = timeout_max_seconds
+        self.actual = {}  # (tenant_id, schema_name) -> seconds
+        self.timed_out = set()
+        self.lock = threading.Lock()
+
+    def order(self, customers):
+        """fetch_live_customers rows sorted by estimated size, largest first."""
+        return sorted(customers, key=lambda customer: -self.sizes.get((customer[1], customer[3]), 0.0))
+
+    def timeout_ms(self, tenant_id, schema_name):
+        """statement_timeout in milliseconds for a tenant's metrics statement, or None when disabled."""
+        if not self.timeout_base_seconds:
+            return None
+        seconds = (self.timeout_base_seconds
+                   + self.sizes.get((tenant_id, schema_name), 0.0) / 1e6 * self.timeout_seconds_per_million_rows)
+        if self.timeout_max_seconds:
+            seconds = min(seconds, self.timeout_max_seconds)
+        return int(seconds * 1000)
+
+    def record(self, tenant_id, schema_name, seconds, error=None):
+        """Record the actual metrics query time of a tenant and whether it hit the statement timeout."""
+        with self.lock:
+            self.actual[(tenant_id, schema_name)] = seconds
+            if getattr(error, 'pgcode', None) == QUERY_CANCELED:
+                self.timed_out.add((tenant_id, schema_name))
+
+    def report(self):
+        """
+        Predicted vs. actual cost of the tenants that ran.
+
+        :return: Dict with the fitted rate, the timeouts hit and per-tenant rows, largest misprediction first
+        """
+        with self.lock:
+            actual = dict(self.actual)
+            timed_out = set(self.timed_out)
+        measured = {tenant: seconds for tenant, seconds in actual.items() if tenant not in timed_out}
+        total_rows = sum(self.sizes.get(tenant, 0.0) for tenant in measured)
+        rate = sum(measured.values()) / total_rows * 1e6 if total_rows else None
+
+        tenants = []
+        for (tenant_id, schema_name), seconds in actual.items():
+            rows = self.sizes.get((tenant_id, schema_name), 0.0)
+            predicted = rows / 1e6 * rate if rate is not None else None
+            tenants.append({
+                'tenant_id': tenant_id,
+                'schema_name': schema_name,
+                'estimated_rows': int(rows),
+                'predicted_seconds': round(predicted, 3) if predicted is not None else None,
+                'actual_seconds': round(seconds, 3),
+                'timeout_ms': self.timeout_ms(tenant_id, schema_name),
+                'timed_out': (tenant_id, schema_name) in timed_out,
+            })
+        tenants.sort(key=lambda entry: -abs(entry['actual_seconds'] - (entry['predicted_seconds'] or 0.0)))
+        return {
+            'tenants_estimated': len(self.sizes),
+            'tenants_measured': len(actual),
+            'seconds_per_million_rows': round(rate, 3) if rate is not None else None,
+            'timeouts': len(timed_out),
+            'tenants': tenants,
+        }
+
+    def log_report(self, region, top=5):
+        report = self.report()
+        if not report['tenants_measured']:
+            return report
+        rate = report['seconds_per_million_rows']
+        logging.info(f"Tenant schedule {region}: {report['tenants_measured']} of {report['tenants_estimated']} "
+                     f"tenant(s) measured, "
+                     + (f"{rate}s per million estimated rows, " if rate is not None else "no cost rate fitted, ")
+                     + f"{report['timeouts']} statement timeout(s)")
+        for number, entry in enumerate(report['tenants']):
+            predicted = f"{entry['predicted_seconds']}s" if entry['predicted_seconds'] is not None else 'n/a'
+            (logging.info if number < top else logging.debug)(
+                f"  tenant {entry['tenant_id']} ({entry['schema_name']}): {entry['estimated_rows']} rows, "
+                f"predicted {predicted}, actual {entry['actual_seconds']}s"
+                + (" (timed out)" if entry['timed_out'] else ''))
+        return report
@@ -0,0 +1,199 @@
+# db/snapshots.py
+"""
+Change detection for incremental metric refreshes.
+
+A tenant's watermark is a cheap fingerprint of the tables its metrics read:
+the pg_stat_user_tables insert/update/delete counters of the tenant schema
+tables (and of shared public tables), plus the latest sign-in and employment
+count of the tenant's users. When the watermark matches the one stored with the
+previous metrics snapshot, the tables have not been written since and the
+snapshot can be reused instead of running the metrics query.
+
+Time-windowed and due-date metrics are relative to CURRENT_DATE, so a snapshot
+is only reused while it is at most max_age_days old (0 means same day).
+"""
+
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import date
+
+from db.metrics import lookback_windows
+
+DEFAULT_SNAPSHOT_PATH = 'cache/metrics_snapshots.sqlite'
+
+# Shared tables covered by the per-tenant user query instead of global counters
+TENANT_USER_TABLES = ('users', 'employments')
+
+
+def fetch_tenant_watermarks(conn, tenants, groups):
+    """
+    Fetches the change watermark of each tenant for the given metric groups.
+
+    :param conn: Database connection object
+    :param tenants: List of (tenant_id, schema_name) pairs
+    :param groups: List of MetricGroup objects the metrics will be computed for
+    :return: Tuple of (database CURRENT_DATE, dict of (tenant_id, schema_name) -> watermark).
+             A watermark is None when the statistics cannot be trusted (for example
+             on a standby, where the counters are not maintained).
+    """
+    tables = sorted({table for group in groups for table in group.tables})
+    public_tables = sorted({table for group in groups for table in group.public_tables
+                            if table not in TENANT_USER_TABLES})
+    track_users = any(table in TENANT_USER_TABLES for group in groups for table in group.public_tables)
+    schemas = sorted({schema_name for _, schema_name in tenants})
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT CURRENT_DATE, pg_is_in_recovery()
+        """)
+        current_date, in_recovery = cursor.fetchone()
+
+        cursor.execute("""
+            SELECT schemaname, relname, n_tup_ins, n_tup_upd, n_tup_del
+            FROM pg_stat_user_tables
+            WHERE (schemaname = ANY(%(schemas)s) AND relname = ANY(%(tables)s))
+               OR (schemaname = 'public' AND relname = ANY(%(public_tables)s))
+        """, {'schemas': schemas, 'tables': tables, 'public_tables': public_tables})
+        counters = {}
+        for schema_name, table, inserts, updates, deletes in cursor.fetchall():
+            counters.setdefault(schema_name, {})[table] = [inserts, updates, deletes]
+
+        users = {}
+        if track_users:
+            cursor.execute("""
+                SELECT e.tenant_id, MAX(u.current_sign_in_at), COUNT(*)
+                FROM public.employments e
+                JOIN public.users u ON u.id = e.user_id
+                WHERE e.tenant_id = ANY(%(tenant_ids)s)
+                GROUP BY e.tenant_id
+            """, {'tenant_ids': sorted({tenant_id for tenant_id, _ in tenants})})
+            for tenant_id, last_sign_in, employments in cursor.fetchall():
+                users[tenant_id] = [last_sign_in.isoformat() if last_sign_in else None, employments]
+
+    if in_recovery:
+        logging.warning("Connected to a standby; table statistics are not maintained, skipping change detection")
+        return current_date, {tenant: None for tenant in tenants}
+
+    watermarks = {}
+    for tenant_id, schema_name in tenants:
+        schema_counters = counters.get(schema_name, {})
+        if not schema_counters:
+            watermarks[(tenant_id, schema_name)] = None
+            continue
+        watermarks[(tenant_id, schema_name)] = json.dumps({
+            'tables': schema_counters,
+            'public': counters.get('public', {}),
+            'users': users.get(tenant_id),
+        }, sort_keys=True, default=str)
+    return current_date, watermarks
+
+
+class MetricsSnapshotStore:
+    """SQLite store of the last metrics result and watermark per tenant."""
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, max_age_days=0):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.reused = 0
+        self.refreshed = 0
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                region TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                watermark TEXT NOT NULL,
+                taken_on TEXT NOT NULL,
+                result BLOB NOT NULL,
+                PRIMARY KEY (region, tenant_id, schema_name, signature)
+            )
+        """)
+        self.conn.commit()
+
+    @staticmethod
+    def signature(months_lookback, groups):
+        """Identifies the shape of a metrics result: lookback windows and metric groups."""
+        windows = ','.join(str(months) for months in lookback_windows(months_lookback))
+        return f"{windows}:{','.join(group.name for group in groups)}"
+
+    def get(self, region, tenant_id, schema_name, signature, watermark, current_date):
+        """Return the stored (results, columns) if still valid for watermark, else None."""
+        if watermark is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT watermark, taken_on, result FROM snapshots "
+                "WHERE region = ? AND tenant_id = ? AND schema_name = ? AND signature = ?",
+                (region, tenant_id, schema_name, signature)
+            ).fetchone()
+        if row is None or row[0] != watermark:
+            return None
+        if (current_date - date.fromisoformat(row[1])).days > self.max_age_days:
+            return None
+        return pickle.loads(row[2])
+
+    def put(self, region, tenant_id, schema_name, signature, watermark, current_date, results, columns):
+        if watermark is None:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots "
+                "(region, tenant_id, schema_name, signature, watermark, taken_on, result) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (region, tenant_id, schema_name, signature, watermark, current_date.isoformat(),
+                 pickle.dumps((results, columns)))
+            )
+            self.conn.commit()
+
+    def record(self, reused):
+        with self.lock:
+            if reused:
+                self.reused += 1
+            else:
+                self.refreshed += 1
+
+    def log_stats(self):
+        logging.info(f"Incremental refresh: {self.reused} tenant(s) reused from snapshot, "
+                     f"{self.refreshed} refreshed")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def fetch_with_snapshot(store, conn, region, tenant_id, schema_name, months_lookback, groups, fetch):
+    """
+    Returns a tenant's (results, columns), reusing the stored snapshot when unchanged.
+
+    The watermark is read before fetch() runs, so writes made while the
+    metrics are computed are picked up by the next run.
+
+    :param store: MetricsSnapshotStore
+    :param conn: Connection used for the watermark query
+    :param groups: List of MetricGroup objects being computed
+    :param fetch: Zero-argument callable running the metrics query
+    """
+    current_date, watermarks = fetch_tenant_watermarks(conn, [(tenant_id, schema_name)], groups)
+    watermark = watermarks[(tenant_id, schema_name)]
+    signature = store.signature(months_lookback, groups)
+
+    snapshot = store.get(region, tenant_id, schema_name, signature, watermark, current_date)
+    if snapshot is not None:
+        logging.debug(f"Reusing metrics snapshot for tenant {tenant_id} ({schema_name})")
+        store.record(True)
+        return snapshot
+
+    results, columns = fetch()
+    store.put(region, tenant_id, schema_name, signature, watermark, current_date, results, columns)
+    store.record(False)
+    return results, columns
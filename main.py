@@ -1,12 +1,31 @@
 import argparse
-import csv
+import asyncio
+import itertools
 import logging
+import json
+import multiprocessing
 import os
-from datetime import datetime
-from ai.analyzer import CustomerAnalyzer
-from db.connection import get_db_connection
-from db.queries import fetch_live_customers, fetch_customer_additional_data
-from report.generator import ReportGenerator
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ai.batch import DEFAULT_BATCH_DIR
+from ai.cache import AnalysisCache, DEFAULT_CACHE_PATH
+from db.catalog import DEFAULT_CATALOG_PATH, TenantCatalog
+from db.metrics import METRIC_GROUPS, lookback_windows, resolve_metric_groups, without_rollup_columns
+from db.rollups import DEFAULT_ROLLUP_PATH, MetricRollupStore, add_rollup_columns
+from db.snapshots import (DEFAULT_SNAPSHOT_PATH, MetricsSnapshotStore, fetch_tenant_watermarks,
+                          fetch_with_snapshot)
+from utils.job_queue import DEFAULT_QUEUE_PATH, JobQueue
+from utils.pipeline import Stage, run_pipeline
+from utils.run_manifest import DEFAULT_MANIFEST_PATH, RunManifest
+from utils.telemetry import TELEMETRY
+
+# The database driver, OpenAI client, matplotlib, fpdf and pyarrow are imported
+# by the functions that use them, so a run only loads what its --stage needs.
+STAGES = ('fetch', 'analyze', 'render')
 
 
 def setup_custom_logging(log_level):
@@ -21,9 +40,9 @@ def setup_custom_logging(log_level):
     )
 
 
-def process_customer(conn, customer, region, months):
-    """Process a single customer's data."""
-    customer_dict = {
+def customer_base_dict(customer, region):
+    """Build the customer dict from a fetch_live_customers row."""
+    return {
         'customer': customer[0],
         'tenant_id': customer[1],
         'plan': customer[2],
@@ -32,18 +51,80 @@ def process_customer(conn, customer, region, months):
         'region': region
     }
 
+
+def customer_row(customer_data):
+    """The fetch_live_customers row a customer dict was built from (see customer_base_dict)."""
+    return (customer_data['customer'], customer_data['tenant_id'], customer_data['plan'],
+            customer_data['schema_name'], customer_data['hubspot_id'])
+
+
+def add_customer_metrics(customer_dict, additional_data, additional_columns):
+    """Merge the metrics row returned for a customer into its dict."""
+    if additional_data:
+        row_data = additional_data[0]
+        additional_dict = dict(zip(additional_columns, row_data))
+        customer_dict.update(additional_dict)
+        logging.info(f"Successfully processed customer: {customer_dict['customer']}")
+    else:
+        logging.warning(f"No additional data found for customer: {customer_dict['customer']}")
+    return customer_dict
+
+
+def process_customer(conn, customer, region, months, metric_groups=None, fetcher=None, snapshots=None,
+                     schedule=None, rollups=None):
+    """
+    Process a single customer's data.
+
+    metric_groups limits the metric groups computed; a ParallelMetricsFetcher
+    computes the groups concurrently instead of in one statement on conn. With
+    a MetricsSnapshotStore, tenants whose tables are unchanged since the last
+    run reuse the stored metrics. A TenantSchedule sets the tenant's statement
+    timeout and records how long its metrics query took. With a
+    MetricRollupStore, the windowed metrics it covers are answered from the
+    tenant's daily rollups instead of the metrics statement.
+    """
+    from db.queries import fetch_customer_additional_data
+
+    customer_dict = customer_base_dict(customer, region)
+
+    def query(groups):
+        timeout_ms = schedule.timeout_ms(customer[1], customer[3]) if schedule else None
+        if fetcher:
+            return fetcher.fetch(customer[1], customer[3], months, groups, timeout_ms)
+        return fetch_customer_additional_data(conn, customer[1], customer[3], months, groups, timeout_ms)
+
+    def query_groups(groups):
+        with TELEMETRY.span('fetch_customer_additional_data', region=region, tenant_id=customer[1],
+                            schema=customer[3]):
+            if not schedule:
+                return query(groups)
+            started = time.perf_counter()
+            try:
+                result = query(groups)
+            except Exception as e:
+                schedule.record(customer[1], customer[3], time.perf_counter() - started, e)
+                raise
+            schedule.record(customer[1], customer[3], time.perf_counter() - started)
+            return result
+
+    def fetch():
+        if not rollups:
+            return query_groups(metric_groups)
+        groups = metric_groups or resolve_metric_groups()
+        results, columns = query_groups([without_rollup_columns(group) for group in groups])
+        with TELEMETRY.span('refresh_rollups', region=region, tenant_id=customer[1], schema=customer[3]):
+            return add_rollup_columns(rollups, conn, region, customer[1], customer[3], months, groups,
+                                      results, columns)
+
     try:
-        additional_data, additional_columns = fetch_customer_additional_data(
-            conn, customer[1], customer[3], months
-        )
-
-        if additional_data:
-            row_data = additional_data[0]
-            additional_dict = dict(zip(additional_columns, row_data))
-            customer_dict.update(additional_dict)
-            logging.info(f"Successfully processed customer: {customer[0]}")
+        if snapshots:
+            additional_data, additional_columns = fetch_with_snapshot(
+                snapshots, conn, region, customer[1], customer[3], months,
+                metric_groups or resolve_metric_groups(), fetch
+            )
         else:
-            logging.warning(f"No additional data found for customer: {customer[0]}")
+            additional_data, additional_columns = fetch()
+        add_customer_metrics(customer_dict, additional_data, additional_columns)
 
     except Exception as e:
         logging.error(f"Error processing customer {customer[0]}: {e}")
@@ -52,49 +133,754 @@ def process_customer(conn, customer, region, months):
     return customer_dict
 
 
-def process_region(region, test_mode=False, temperature=None, months=1):
-    """Process customers for a specific region."""
-    logging.info(f"Starting process for region: {region}")
-    conn = None
-    analyzer = CustomerAnalyzer(temperature)
-    report_gen = ReportGenerator(months)
+def iter_prefetched_customers(conn, customers, region, months, batch_size, prefetched, metric_groups=None,
+                              snapshots=None, skip=None, rollups=None):
+    """
+    Yield customers while fetching their metrics batch_size tenants per query.
+
+    Before a customer is yielded, its customer dict (or the error raised while
+    fetching it) is stored in prefetched under the customer row. customers may
+    be a streaming iterator; it is consumed batch_size customers at a time.
+    With a MetricsSnapshotStore, the watermarks of each batch are read first
+    and the batch's unchanged tenants are yielded from their snapshots.
+    Customers for which skip(customer) is true are yielded without fetching.
+    With a MetricRollupStore, the batched statements leave out the windowed
+    metrics it covers and each tenant's are answered from its rollups.
+    """
+    from db.queries import fetch_customers_additional_data_batch
+
+    groups = metric_groups or resolve_metric_groups()
+    customers = iter(customers)
+    while True:
+        chunk = list(itertools.islice(customers, max(batch_size, 1)))
+        if not chunk:
+            return
+        if skip:
+            for customer in [customer for customer in chunk if skip(customer)]:
+                chunk.remove(customer)
+                yield customer
+
+        watermarks = {}
+        if snapshots:
+            current_date, watermarks = fetch_tenant_watermarks(conn, [(c[1], c[3]) for c in chunk], groups)
+            signature = snapshots.signature(months, groups)
+            remaining = []
+            for customer in chunk:
+                snapshot = snapshots.get(region, customer[1], customer[3], signature,
+                                         watermarks[(customer[1], customer[3])], current_date)
+                if snapshot is None:
+                    remaining.append(customer)
+                    continue
+                snapshots.record(True)
+                prefetched[customer] = add_customer_metrics(customer_base_dict(customer, region), *snapshot)
+                yield customer
+            chunk = remaining
+
+        tenants = [(customer[1], customer[3]) for customer in chunk]
+        # The batch fetch is a generator: consume it inside the span so the span times the queries
+        with TELEMETRY.span('fetch_customers_additional_data_batch', region=region, tenants=len(tenants)):
+            batches = list(fetch_customers_additional_data_batch(
+                conn, tenants, months, batch_size,
+                [without_rollup_columns(group) for group in groups] if rollups else metric_groups))
+        for customer, (additional_data, additional_columns, error) in zip(chunk, batches):
+            if error is None and rollups:
+                try:
+                    with TELEMETRY.span('refresh_rollups', region=region, tenant_id=customer[1],
+                                        schema=customer[3]):
+                        additional_data, additional_columns = add_rollup_columns(
+                            rollups, conn, region, customer[1], customer[3], months, groups,
+                            additional_data, additional_columns)
+                except Exception as e:
+                    conn.rollback()
+                    error = e
+            if error is not None:
+                logging.error(f"Error processing customer {customer[0]}: {error}")
+                prefetched[customer] = error
+            else:
+                if snapshots:
+                    snapshots.put(region, customer[1], customer[3], signature,
+                                  watermarks[(customer[1], customer[3])], current_date,
+                                  additional_data, additional_columns)
+                    snapshots.record(False)
+                prefetched[customer] = add_customer_metrics(
+                    customer_base_dict(customer, region), additional_data, additional_columns)
+            yield customer
+
+
+def stream_live_customers(pool, schemas_by_tenant, itersize, summary):
+    """
+    Yield live customers from a server-side cursor on a connection held for the whole stream.
+
+    summary['customers'] counts the customers yielded so far. The
+    fetch_live_customers span covers the whole stream.
+    """
+    from db.queries import iter_live_customers
+
+    with pool.connection() as conn, TELEMETRY.span('fetch_live_customers', region=summary['region'], streamed=True):
+        for customer in iter_live_customers(conn, schemas_by_tenant, itersize):
+            summary['customers'] += 1
+            yield customer
+
+
+def init_render_process(log_level):
+    """Initializer of render pool workers: logging plus the logo and font metrics, decoded once."""
+    from report.generator import warm_static_assets
+
+    setup_custom_logging(log_level)
+    warm_static_assets()
+
+
+def log_render_times(render_times, render_mode):
+    """Log the count, average, p95 and maximum of per-report render times."""
+    if not render_times:
+        return
+    ordered = sorted(render_times)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    logging.info(f"Rendered {len(ordered)} report(s) ({render_mode} mode): "
+                 f"avg {sum(ordered) / len(ordered):.3f}s, p95 {p95:.3f}s, max {ordered[-1]:.3f}s")
+
+
+def start_event_loop():
+    """Start an asyncio event loop on a daemon thread and return (loop, thread)."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name='analysis-loop', daemon=True)
+    thread.start()
+    return loop, thread
+
+
+def process_region(region, test_mode=False, temperature=None, months=1,
+                   fetch_workers=1, analyze_workers=1, render_workers=1, queue_size=8,
+                   analysis_mode='sync', llm_concurrency=8, llm_rpm=None, llm_tpm=None, llm_max_retries=5,
+                   llm_cache=None, llm_cache_ttl_hours=168, llm_cache_max_entries=10000,
+                   llm_prompt_format='compact', llm_token_budget=None, llm_batch_dir=DEFAULT_BATCH_DIR,
+                   llm_batch_poll_seconds=30, llm_batch_timeout_minutes=None, batch_size=0,
+                   metrics=None, metric_workers=1, incremental=False, snapshot_max_age_days=0,
+                   snapshot_db=None, plan_sample_every=0, catalog_db=None, catalog_refresh_minutes=60,
+                   history_dir=None, stream_customers=False, itersize=500, render_mode='thread',
+                   chart_dpi=None, run_manifest=None, resume=False, stage='all', schedule='fifo',
+                   statement_timeout_base=60, statement_timeout_per_million_rows=120, statement_timeout_max=1800,
+                   rollups=False, rollup_db=None, rollup_rebuild_days=7):
+    """
+    Process customers for a specific region and return a summary of the run.
+
+    months is a lookback in months or a list of lookback windows; all windows
+    are computed by the same metrics query and shown in the same report.
+
+    Customers flow through a fetch -> analyze -> render pipeline so database,
+    LLM and PDF work overlap. Each fetch worker has its own connection and each
+    render worker its own ReportGenerator; the analyzer is shared. In async
+    analysis mode the analyze stage hands customers to the analyzer's
+    rate-limited async client running on a background event loop. In batch
+    analysis mode all customers are fetched first, their requests go to the
+    OpenAI Batch API as one submission (files kept in llm_batch_dir, polled
+    every llm_batch_poll_seconds, cancelled after llm_batch_timeout_minutes)
+    and the returned analyses are rendered as usual. With llm_cache set,
+    analyses of unchanged customer data are served from that SQLite cache
+    instead of the API. llm_prompt_format selects the compact or
+    the JSON prompt encoding, and llm_token_budget caps the estimated prompt
+    plus completion tokens of each request. With batch_size set, metrics are
+    fetched for batch_size tenants per query ahead of the fetch stage. metrics limits
+    the metric groups computed, and metric_workers > 1 gives each fetch worker
+    that many extra connections to compute one tenant's groups concurrently.
+    Connections come from the region's pool and are checked out per customer.
+    With incremental set, tenants whose tables have not changed since the last
+    snapshot (at most snapshot_max_age_days old) reuse it. Metrics statement
+    timings are logged at the end, with planning time sampled every
+    plan_sample_every tenants when set. The tenant-to-schema map comes from the
+    catalog cached in catalog_db, rechecked after catalog_refresh_minutes.
+    The fetched metrics of the run are appended to the history store in
+    history_dir. With stream_customers set, customers are read from a
+    server-side cursor itersize rows at a time and enter the pipeline as they
+    arrive instead of after the whole list has been fetched. With render_mode
+    'process', reports are rendered by a pool of render_workers processes, each
+    decoding the static report assets once; per-report render times are logged.
+    Charts are rendered in memory at chart_dpi (default: the report's
+    default resolution). Every stage records telemetry
+    spans tagged with the region and tenant in TELEMETRY. Each customer's
+    finished stages and their artifacts are checkpointed in the run_manifest
+    SQLite file; with resume set, the region's latest run is continued:
+    customers with a report are skipped and stored metrics and analyses are
+    reused. Metrics restored this way are not appended to the history again.
+
+    stage 'fetch', 'analyze' or 'render' runs a single stage: fetch saves the
+    metrics in a new manifest run, analyze analyzes the metrics saved by the
+    latest run and render renders its saved analyses, without touching the
+    database (or the LLM). Only the modules the stages need are imported.
+
+    With schedule 'size', each tenant's cost is estimated from the planner row
+    counts of the tables its metrics read and customers are fetched largest
+    first, so the fetch workers finish together. Each tenant's metrics
+    statements then run with a statement_timeout of statement_timeout_base
+    seconds plus statement_timeout_per_million_rows per million estimated rows,
+    capped at statement_timeout_max (0 disables the timeouts). The predicted
+    and actual cost of each tenant is logged and returned in
+    summary['schedule']. Batched fetches with batch_size keep the order but
+    neither the timeouts nor the actual costs, so the report covers no tenants.
+    Streamed customers cannot be reordered and keep the fifo order.
+
+    With rollups set, the windowed user, contract, event and e-sign metrics
+    are answered from per-tenant daily rollups kept in rollup_db: each run
+    ingests only the days since the previous one and every window is merged
+    from the day buckets, instead of the metrics statement scanning the
+    window's raw rows. Rollups are rebuilt from the raw rows every
+    rollup_rebuild_days days.
+    """
+    logging.info(f"Starting process for region: {region}" + (f" ({stage} stage)" if stage != 'all' else ''))
+    region_started = time.perf_counter()
+    summary = {'region': region, 'customers': 0, 'reports': [], 'errors': []}
+    fetching = stage in ('all', 'fetch')
+    analyzing = stage in ('all', 'analyze')
+    rendering = stage in ('all', 'render')
+    if fetching:
+        from db.connection import get_pool
+        from db.queries import fetch_live_customers, ParallelMetricsFetcher, QUERY_STATS
+        QUERY_STATS.reset()
+        QUERY_STATS.plan_sample_every = plan_sample_every
+    pool = None
+    batch_conn = None
+    fetcher = None
+    tenant_schedule = None
+    customer_stream = None
+    render_pool = None
+    render_times = []
+    metric_groups = resolve_metric_groups(metrics) if metrics else None
+    snapshots = MetricsSnapshotStore(snapshot_db or DEFAULT_SNAPSHOT_PATH, snapshot_max_age_days) \
+        if incremental and fetching else None
+    rollup_store = MetricRollupStore(rollup_db or DEFAULT_ROLLUP_PATH, rollup_rebuild_days) \
+        if rollups and fetching else None
+    loop = loop_thread = None
+    cache = analyzer = None
+    if analyzing:
+        from ai.analyzer import CustomerAnalyzer
+        cache = AnalysisCache(llm_cache, llm_cache_ttl_hours * 3600, llm_cache_max_entries) if llm_cache else None
+        analyzer = CustomerAnalyzer(temperature, concurrency=llm_concurrency, requests_per_minute=llm_rpm,
+                                    tokens_per_minute=llm_tpm, max_retries=llm_max_retries, cache=cache,
+                                    prompt_format=llm_prompt_format, token_budget=llm_token_budget)
+
+    # Later stages on their own continue the latest run, reading its saved metrics or analyses
+    manifest = RunManifest(run_manifest or DEFAULT_MANIFEST_PATH, region, resume, new_run=fetching)
+    finished_reports = []
+    prefetched = {}
+    history_rows = []
+
+    def checkpointed(stage, handler, tenant):
+        """Wrap a stage handler to reuse the stage's artifact from the manifest and record new ones."""
+        def run(payload):
+            tenant_id, schema_name = tenant(payload)
+            artifact = manifest.get(tenant_id, schema_name, stage)
+            if artifact is None:
+                artifact = handler(payload)
+                manifest.put(tenant_id, schema_name, stage, artifact)
+            return artifact
+        return run
+
+    def customer_tenant(customer):
+        return customer[1], customer[3]
+
+    def data_tenant(customer_data):
+        return customer_data['tenant_id'], customer_data['schema_name']
+
+    def analysis_tenant(analysis):
+        return data_tenant(analysis['raw_data'])
+
+    def skip_finished(customers):
+        for customer in customers:
+            report_file = manifest.get(customer[1], customer[3], 'render')
+            if report_file:
+                logging.info(f"Report of {customer[0]} already generated in this run: {report_file}")
+                finished_reports.append(report_file)
+                continue
+            yield customer
+
+    def fetch(customer):
+        if batch_size:
+            customer_data = prefetched.pop(customer)
+            if isinstance(customer_data, Exception):
+                raise customer_data
+        else:
+            with pool.connection() as conn:
+                customer_data = process_customer(conn, customer, region, months, metric_groups, fetcher, snapshots,
+                                                 tenant_schedule, rollup_store)
+        logging.debug(f"Processed customer data keys: {customer_data.keys()}")
+        history_rows.append(customer_data)
+        return customer_data
+
+    def count_analysis(analysis):
+        TELEMETRY.count('llm_tokens', analysis['usage_tokens'], region=region)
+        TELEMETRY.count('llm_prompt_tokens', analysis['prompt_tokens'], region=region)
+        TELEMETRY.count('llm_completion_tokens', analysis['completion_tokens'], region=region)
+        TELEMETRY.count('llm_cache_hits' if analysis.get('cached') else 'llm_requests', region=region)
+        logging.debug(f"Analysis result keys: {analysis.keys() if analysis else 'No analysis generated'}")
+
+    def analyze(customer_data):
+        with TELEMETRY.span('analyze_customer', region=region, tenant_id=customer_data.get('tenant_id')) as span:
+            if loop:
+                analysis = asyncio.run_coroutine_threadsafe(
+                    analyzer.analyze_customer_async(customer_data), loop).result()
+            else:
+                analysis = analyzer.analyze_customer(customer_data)
+            span['usage_tokens'] = analysis['usage_tokens']
+            span['cached'] = bool(analysis.get('cached'))
+        count_analysis(analysis)
+        return analysis
+
+    batch_analyses = {}
+
+    def analyze_batch(fetched):
+        """Analyze the (customer, customer_data) pairs in one Batch API submission."""
+        with TELEMETRY.span('analyze_batch', region=region, customers=len(fetched)):
+            analyses = analyzer.analyze_customers_batch(
+                [customer_data for _, customer_data in fetched], llm_batch_dir, llm_batch_poll_seconds,
+                llm_batch_timeout_minutes * 60 if llm_batch_timeout_minutes else None, label=region)
+        batch_analyses.update(zip((customer for customer, _ in fetched), analyses))
+
+    def pending_batch_analyses(fetched):
+        """The fetched pairs without an analysis in the manifest."""
+        return [(customer, customer_data) for customer, customer_data in fetched
+                if not manifest.finished(customer[1], customer[3], 'analyze')]
+
+    def collect_batch_analysis(customer):
+        analysis = batch_analyses.pop(customer)
+        if isinstance(analysis, Exception):
+            raise analysis
+        count_analysis(analysis)
+        return analysis
+
+    def render(report_gen):
+        def handler(analysis):
+            started = time.perf_counter()
+            with TELEMETRY.span('generate_report', region=region, tenant_id=analysis['raw_data'].get('tenant_id')):
+                report_file = report_gen.generate_report(analysis)
+            render_times.append(time.perf_counter() - started)
+            logging.info(f"Generated report: {report_file} in {render_times[-1]:.2f}s")
+            return report_file
+        return handler
+
+    def render_in_process(analysis):
+        try:
+            report_file, elapsed = render_pool.submit(render_report, analysis, months, chart_dpi).result()
+        except Exception:
+            TELEMETRY.record('generate_report', 0.0, True, region=region,
+                             tenant_id=analysis['raw_data'].get('tenant_id'))
+            raise
+        # Time spent rendering in the worker process, without the queueing and pickling around it
+        TELEMETRY.record('generate_report', elapsed, region=region, tenant_id=analysis['raw_data'].get('tenant_id'))
+        render_times.append(elapsed)
+        logging.info(f"Generated report: {report_file} in {elapsed:.2f}s")
+        return report_file
 
     try:
-        conn = get_db_connection(region)
-        customers = fetch_live_customers(conn)
+        if fetching:
+            fetch_workers = 1 if batch_size else max(fetch_workers, 1)
+            metric_workers = metric_workers if metric_workers > 1 and not batch_size else 0
+            # One connection per fetch worker and metric worker, plus the batch and stream connections
+            pool = get_pool(region, max_size=fetch_workers * (1 + metric_workers) + 2)
+            catalog = TenantCatalog(catalog_db or DEFAULT_CATALOG_PATH, catalog_refresh_minutes * 60)
+            try:
+                with pool.connection() as conn:
+                    with TELEMETRY.span('tenant_catalog', region=region):
+                        schemas_by_tenant = catalog.schemas_by_tenant(conn, region)
+                    if not stream_customers:
+                        with TELEMETRY.span('fetch_live_customers', region=region):
+                            customers = fetch_live_customers(conn, schemas_by_tenant)
+            finally:
+                catalog.close()
+            if stream_customers:
+                customer_stream = customers = stream_live_customers(pool, schemas_by_tenant, itersize, summary)
+
+            if metric_workers:
+                fetcher = ParallelMetricsFetcher(pool, fetch_workers * metric_workers)
+        else:
+            # The customer dicts saved by the fetch stage, or the analyses saved by the analyze stage
+            saved = {}
+            for artifact in manifest.artifacts('fetch' if stage == 'analyze' else 'analyze'):
+                saved[customer_row(artifact if stage == 'analyze' else artifact['raw_data'])] = artifact
+            if not saved:
+                raise ValueError(f"No saved {'metrics' if stage == 'analyze' else 'analyses'} for region {region} "
+                                 f"in {manifest.path}; run the {'fetch' if stage == 'analyze' else 'analyze'} "
+                                 f"stage first")
+            customers = list(saved)
 
         if test_mode:
             logging.info("Test mode - processing first customer only")
-            customers = customers[:1]
+            customers = list(itertools.islice(customers, 1))
 
-        for customer in customers:
+        if fetching and schedule == 'size':
+            if stream_customers:
+                logging.warning("Streamed customers cannot be ordered by size; keeping the fifo order")
+            else:
+                from db.scheduling import fetch_tenant_sizes, TenantSchedule
+                with pool.connection() as conn, TELEMETRY.span('fetch_tenant_sizes', region=region):
+                    sizes = fetch_tenant_sizes(conn, [customer_tenant(customer) for customer in customers],
+                                               metric_groups or resolve_metric_groups())
+                tenant_schedule = TenantSchedule(sizes, statement_timeout_base, statement_timeout_per_million_rows,
+                                                 statement_timeout_max)
+                customers = tenant_schedule.order(customers)
+                if batch_size:
+                    logging.warning("Batched fetches are neither timed out nor measured per tenant; "
+                                    "the schedule report will not cover them")
+
+        if isinstance(customers, list):
+            summary['customers'] = len(customers)
+        if resume and rendering:
+            customers = skip_finished(customers)
+        if analyzing and analysis_mode == 'async':
+            # Enough waiting threads to keep llm_concurrency requests in flight
+            loop, loop_thread = start_event_loop()
+            analyze_workers = max(analyze_workers, llm_concurrency)
+        TELEMETRY.set_workers('fetch_customers_additional_data_batch' if batch_size
+                              else 'fetch_customer_additional_data', fetch_workers)
+        TELEMETRY.set_workers('analyze_customer', max(analyze_workers, 1))
+        TELEMETRY.set_workers('generate_report', max(render_workers, 1))
+
+        render_stages = []
+        if rendering:
+            from report.generator import ReportGenerator, render_report
+            from report.charts import DEFAULT_CHART_DPI
+            chart_dpi = chart_dpi or DEFAULT_CHART_DPI
+            if render_mode == 'process':
+                # Spawned rather than forked: the pipeline and event loop threads are already running
+                render_pool = ProcessPoolExecutor(max_workers=max(render_workers, 1),
+                                                  mp_context=multiprocessing.get_context('spawn'),
+                                                  initializer=init_render_process,
+                                                  initargs=(logging.getLevelName(logging.getLogger().level),))
+                render_stages.append(Stage('render', [checkpointed('render', render_in_process, analysis_tenant)]
+                                           * max(render_workers, 1)))
+            else:
+                render_stages.append(Stage('render', [
+                    checkpointed('render', render(ReportGenerator(months, chart_dpi)), analysis_tenant)
+                    for _ in range(max(render_workers, 1))]))
+
+        if fetching:
+            if batch_size:
+                batch_conn = pool.getconn()
+                skip = (lambda customer: manifest.finished(customer[1], customer[3], 'fetch')) if resume else None
+                customers = iter_prefetched_customers(batch_conn, customers, region, months, batch_size, prefetched,
+                                                      metric_groups, snapshots, skip, rollup_store)
+            first_stage = Stage('fetch', [checkpointed('fetch', fetch, customer_tenant)] * fetch_workers)
+        else:
+            first_stage = Stage('load', [lambda customer: saved[customer]])
+
+        if stage == 'render':
+            results, errors = run_pipeline(customers, [first_stage] + render_stages, queue_size,
+                                           describe=lambda c: c[0])
+        elif analyzing and analysis_mode == 'batch':
+            # Every customer is fetched before the single batch submission; rendering starts once it returns
+            fetched, errors = run_pipeline(customers, [first_stage], queue_size, describe=lambda c: c[0])
+            pending = pending_batch_analyses(fetched) if resume else fetched
+            if pending:
+                analyze_batch(pending)
+            results, render_errors = run_pipeline(
+                [customer for customer, _ in fetched],
+                [Stage('analyze', [checkpointed('analyze', collect_batch_analysis, customer_tenant)])] + render_stages,
+                queue_size, describe=lambda c: c[0])
+            errors += render_errors
+        else:
+            stages = [first_stage]
+            if analyzing:
+                stages.append(Stage('analyze', [checkpointed('analyze', analyze, data_tenant)]
+                                    * max(analyze_workers, 1)))
+            results, errors = run_pipeline(customers, stages + render_stages, queue_size,
+                                           describe=lambda c: c[0])
+
+        if rendering:
+            summary['reports'] = finished_reports + [report_file for _, report_file in results]
+        else:
+            logging.info(f"{stage.capitalize()} stage finished for {len(results)} customer(s) of {region}; "
+                         f"saved in the {manifest.run_date} run of {manifest.path}")
+        summary['errors'] = [{'customer': customer[0] if customer else None,
+                              'tenant_id': customer[1] if customer else None,
+                              'error': str(e)}
+                             for customer, _, e in errors]
+
+    finally:
+        if customer_stream:
+            customer_stream.close()
+        if tenant_schedule:
+            summary['schedule'] = tenant_schedule.log_report(region)
+        if fetcher:
+            fetcher.close()
+        if batch_conn:
+            pool.putconn(batch_conn)
+        if render_pool:
+            render_pool.shutdown()
+        log_render_times(render_times, render_mode)
+        if pool:
+            pool.log_stats()
+        if fetching:
+            QUERY_STATS.log_summary()
+        if loop:
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+        if cache:
+            cache.log_stats()
+            cache.close()
+        if snapshots:
+            snapshots.log_stats()
+            snapshots.close()
+        if rollup_store:
+            rollup_store.log_stats()
+            rollup_store.close()
+        manifest.log_stats()
+        manifest.close()
+        if history_rows:
+            from utils.history_store import DEFAULT_HISTORY_PATH, HistoryStore
+            with TELEMETRY.span('write_history', region=region, rows=len(history_rows)):
+                history_file = HistoryStore(history_dir or DEFAULT_HISTORY_PATH).append(region, history_rows)
+            logging.info(f"Metrics of {len(history_rows)} customer(s) saved to: {history_file}")
+        TELEMETRY.record('process_region', time.perf_counter() - region_started, region=region)
+
+    return summary
+
+
+def list_region_customers(region, catalog_db=None, catalog_refresh_minutes=60):
+    """Live customers of a region, with the tenant-to-schema map from the cached catalog."""
+    from db.connection import get_pool
+    from db.queries import fetch_live_customers
+
+    catalog = TenantCatalog(catalog_db or DEFAULT_CATALOG_PATH, catalog_refresh_minutes * 60)
+    try:
+        with get_pool(region).connection() as conn:
+            return fetch_live_customers(conn, catalog.schemas_by_tenant(conn, region))
+    finally:
+        catalog.close()
+
+
+def profile_region(region, profile, sample=25, seed=None, catalog_db=None, catalog_refresh_minutes=60):
+    """
+    Profile the metrics statement with EXPLAIN (ANALYZE, BUFFERS) for a random sample of a region's tenants.
+
+    The statement runs in full for every sampled tenant, but nothing is
+    analyzed or rendered. The plans are added to profile, a QueryProfile
+    shared by all regions of the run.
+    """
+    from db.connection import get_pool
+    from db.profiler import profile_tenants
+
+    logging.info(f"Profiling metrics query for region: {region}")
+    customers = list_region_customers(region, catalog_db, catalog_refresh_minutes)
+    sampled = random.Random(seed).sample(customers, min(sample, len(customers)))
+    profile_tenants(get_pool(region), sampled, region, profile)
+
+
+def process_region_with_telemetry(*args, **kwargs):
+    """Run process_region in a worker process and return its summary with the telemetry it recorded."""
+    TELEMETRY.reset()  # Workers are reused across regions
+    summary = process_region(*args, **kwargs)
+    summary['telemetry'] = TELEMETRY.snapshot()
+    return summary
+
+
+def run_regions_parallel(regions, workers, log_level, test_mode=False, temperature=None, months=1,
+                         **region_options):
+    """
+    Processes regions in separate worker processes.
+
+    Each worker builds its own connection, analyzer and report generator inside
+    process_region, so nothing is shared between regions. The telemetry each
+    worker records is merged into this process's TELEMETRY.
+
+    :param regions: Region names to process
+    :param workers: Maximum number of worker processes
+    :param log_level: Log level to configure in each worker
+    :return: List of region summaries in the order the regions were given
+    """
+    summaries = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_custom_logging,
+                             initargs=(log_level,)) as executor:
+        futures = {
+            executor.submit(process_region_with_telemetry, region, test_mode, temperature, months,
+                            **region_options): region
+            for region in regions
+        }
+        for future in as_completed(futures):
+            region = futures[future]
             try:
-                customer_data = process_customer(conn, customer, region, months)
-                logging.debug(f"Processed customer data keys: {customer_data.keys()}")
+                summaries[region] = future.result()
+                TELEMETRY.merge(summaries[region].pop('telemetry'))
+            except Exception as e:
+                logging.error(f"Error processing region {region}: {e}")
+                summaries[region] = {'region': region, 'customers': 0, 'reports': [],
+                                     'errors': [{'customer': None, 'tenant_id': None, 'error': str(e)}]}
+    return [summaries[region] for region in regions]
 
-                # Write raw data to CSV
-                raw_filename = f"raw_data/{customer_data['customer'].replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv"
-                os.makedirs('raw_data', exist_ok=True)
 
-                with open(raw_filename, 'w', newline='') as f:
-                    writer = csv.DictWriter(f, fieldnames=customer_data.keys())
-                    writer.writeheader()
-                    writer.writerow(customer_data)
+def run_coordinator(regions, queue, run_id, months=1, max_attempts=3, test_mode=False, poll_seconds=10,
+                    catalog_db=None, catalog_refresh_minutes=60, schedule='fifo'):
+    """
+    Queue one job per live customer of each region, then wait for the workers to finish the run.
 
-                analysis = analyzer.analyze_customer(customer_data)
-                logging.debug(f"Analysis result keys: {analysis.keys() if analysis else 'No analysis generated'}")
+    Jobs of a run are added once: rerunning the coordinator with the same
+    run_id only waits for the jobs still pending. Workers lease jobs in the
+    order they were queued; with schedule 'size' each region's customers are
+    queued largest first by their estimated metrics cost.
 
-                report_file = report_gen.generate_report(analysis)
-                logging.info(f"Generated report: {report_file}")
-                logging.info(f"Raw data saved to: {raw_filename}")
+    :param queue: JobQueue shared with the workers
+    :param run_id: Identifier of the run the jobs belong to
+    :param poll_seconds: Seconds between progress checks
+    :return: List of region summaries built from the job outcomes
+    """
+    for region in regions:
+        customers = list_region_customers(region, catalog_db, catalog_refresh_minutes)
+        if test_mode:
+            customers = customers[:1]
+        if schedule == 'size':
+            from db.connection import get_pool
+            from db.scheduling import fetch_tenant_sizes, TenantSchedule
+            with get_pool(region).connection() as conn:
+                sizes = fetch_tenant_sizes(conn, [(customer[1], customer[3]) for customer in customers],
+                                           resolve_metric_groups())
+            customers = TenantSchedule(sizes).order(customers)
+        added = queue.enqueue(run_id, region, customers, months, max_attempts)
+        logging.info(f"Queued {added} job(s) for the {len(customers)} customer(s) of {region} in run {run_id}")
+
+    while queue.pending(run_id):
+        counts = queue.counts(run_id)
+        logging.info(f"Run {run_id}: {counts.get('queued', 0)} queued, {counts.get('leased', 0)} leased, "
+                     f"{counts.get('done', 0)} done, {counts.get('failed', 0)} failed")
+        time.sleep(poll_seconds)
+
+    summaries = {region: {'region': region, 'customers': 0, 'reports': [], 'errors': []} for region in regions}
+    for region, customer, status, result, error in queue.outcomes(run_id):
+        summary = summaries.setdefault(region, {'region': region, 'customers': 0, 'reports': [], 'errors': []})
+        summary['customers'] += 1
+        if status == 'done':
+            summary['reports'].append(result)
+        else:
+            summary['errors'].append({'customer': customer[0], 'tenant_id': customer[1], 'error': error})
+    return list(summaries.values())
+
+
+def run_worker(queue, worker_id=None, lease_seconds=900, poll_seconds=10, temperature=None, fetch_workers=1,
+               analyze_workers=1, render_workers=1, queue_size=8, llm_cache=None, llm_cache_ttl_hours=168,
+               llm_cache_max_entries=10000, llm_prompt_format='compact', llm_token_budget=None, metrics=None,
+               chart_dpi=None, history_dir=None):
+    """
+    Lease tenant jobs from a JobQueue and run them through fetch -> analyze -> render.
 
+    Leased jobs flow through the same kind of pipeline as process_region, on
+    connections from each job's region pool. Every stage extends the job's
+    lease first and stops if the lease was lost to another worker; the render
+    stage completes the job with its report path and a failing stage records a
+    failed attempt, so the job is retried until it runs out of attempts. The
+    worker exits once no job of any run is queued or leased; while jobs
+    leased by other workers are pending it polls every poll_seconds, since
+    their leases may expire.
+
+    :param queue: JobQueue to lease from
+    :param worker_id: Name of this worker in the queue (default: host:pid)
+    :param lease_seconds: Visibility timeout of a leased job
+    :return: List of region summaries of the jobs this worker finished
+    """
+    from ai.analyzer import CustomerAnalyzer
+    from db.connection import get_pool
+    from report.charts import DEFAULT_CHART_DPI
+    from report.generator import ReportGenerator
+    from utils.history_store import DEFAULT_HISTORY_PATH, HistoryStore
+
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    chart_dpi = chart_dpi or DEFAULT_CHART_DPI
+    metric_groups = resolve_metric_groups(metrics) if metrics else None
+    cache = AnalysisCache(llm_cache, llm_cache_ttl_hours * 3600, llm_cache_max_entries) if llm_cache else None
+    analyzer = CustomerAnalyzer(temperature, cache=cache, prompt_format=llm_prompt_format,
+                                token_budget=llm_token_budget)
+    history_rows = {}
+    logging.info(f"Worker {worker_id} leasing jobs from {queue.path}")
+
+    def leased_jobs():
+        while True:
+            job = queue.lease(worker_id, lease_seconds)
+            if job is not None:
+                yield job
+            elif queue.pending():
+                time.sleep(poll_seconds)
+            else:
+                return
+
+    def job_step(handler):
+        """Extend the job's lease before the stage and record a failed attempt when it raises."""
+        def run(payload):
+            job = payload if isinstance(payload, dict) else payload[0]
+            if not queue.extend(job, worker_id, lease_seconds):
+                raise RuntimeError(f"Lease of job {job['id']} lost to another worker")
+            try:
+                return handler(job, payload)
             except Exception as e:
-                logging.error(f"Error processing customer {customer[0]}: {str(e)}")
-                continue
+                queue.fail(job, worker_id, e)
+                raise
+        return run
+
+    def fetch(job, _):
+        with get_pool(job['region'], max_size=fetch_workers + 1).connection() as conn:
+            customer_data = process_customer(conn, job['customer'], job['region'], job['months'], metric_groups)
+        history_rows.setdefault(job['region'], []).append(customer_data)
+        return job, customer_data
 
+    def analyze(job, payload):
+        with TELEMETRY.span('analyze_customer', region=job['region'], tenant_id=job['tenant_id']) as span:
+            analysis = analyzer.analyze_customer(payload[1])
+            span['usage_tokens'] = analysis['usage_tokens']
+        TELEMETRY.count('llm_tokens', analysis['usage_tokens'], region=job['region'])
+        return job, analysis
+
+    def render(generators):
+        def handler(job, payload):
+            key = json.dumps(job['months'])
+            if key not in generators:
+                generators[key] = ReportGenerator(job['months'], chart_dpi)
+            with TELEMETRY.span('generate_report', region=job['region'], tenant_id=job['tenant_id']):
+                report_file = generators[key].generate_report(payload[1])
+            queue.complete(job, worker_id, report_file)
+            logging.info(f"Generated report: {report_file} (job {job['id']}, attempt {job['attempt']})")
+            return report_file
+        return handler
+
+    stages = [
+        Stage('fetch', [job_step(fetch)] * max(fetch_workers, 1)),
+        Stage('analyze', [job_step(analyze)] * max(analyze_workers, 1)),
+        Stage('render', [job_step(render({})) for _ in range(max(render_workers, 1))]),
+    ]
+    try:
+        results, errors = run_pipeline(leased_jobs(), stages, queue_size,
+                                       describe=lambda job: f"{job['customer'][0]} ({job['region']})")
     finally:
-        if conn:
-            conn.close()
+        if cache:
+            cache.log_stats()
+            cache.close()
+        for region, rows in history_rows.items():
+            history_file = HistoryStore(history_dir or DEFAULT_HISTORY_PATH).append(region, rows)
+            logging.info(f"Metrics of {len(rows)} customer(s) saved to: {history_file}")
+
+    summaries = {}
+    for job, report_file in results:
+        summary = summaries.setdefault(job['region'], {'region': job['region'], 'customers': 0, 'reports': [],
+                                                       'errors': []})
+        summary['customers'] += 1
+        summary['reports'].append(report_file)
+    for job, _, e in errors:
+        if job is None:
+            continue
+        summary = summaries.setdefault(job['region'], {'region': job['region'], 'customers': 0, 'reports': [],
+                                                       'errors': []})
+        summary['customers'] += 1
+        summary['errors'].append({'customer': job['customer'][0], 'tenant_id': job['tenant_id'], 'error': str(e)})
+    return list(summaries.values())
+
+
+def log_run_summary(summaries):
+    """Log a single merged summary for all processed regions."""
+    total_customers = sum(s['customers'] for s in summaries)
+    total_reports = sum(len(s['reports']) for s in summaries)
+    total_errors = sum(len(s['errors']) for s in summaries)
+
+    logging.info(f"Run summary: {len(summaries)} region(s), {total_customers} customer(s), "
+                 f"{total_reports} report(s), {total_errors} error(s)")
+    for s in summaries:
+        logging.info(f"  {s['region']}: {s['customers']} customer(s), "
+                     f"{len(s['reports'])} report(s), {len(s['errors'])} error(s)")
+        for error in s['errors']:
+            logging.info(f"    {error['customer'] or s['region']}: {error['error']}")
 
 
 def main():
@@ -103,25 +889,253 @@ def main():
     parser.add_argument('--region', choices=['Staging', 'APAC', 'EU', 'US', 'CA'],
                         help='Process specific region only')
     parser.add_argument('--temperature', type=float, help='OpenAI temperature (0-1)')
-    parser.add_argument('--months', type=int, default=1,
-                        help='Number of months to look back for time-based metrics')
+    parser.add_argument('--months', type=lambda value: list(lookback_windows(value.split(','))), default=1,
+                        help='Number of months to look back for time-based metrics, or a comma-separated '
+                             'list of windows (e.g. 1,3,6) computed in the same pass')
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         default='INFO', help='Set the logging level')
+    parser.add_argument('--parallel-regions', type=int, default=1, metavar='N',
+                        help='Process up to N regions at once in separate worker processes')
+    parser.add_argument('--fetch-workers', type=int, default=1,
+                        help='Worker threads (each with its own connection) fetching customer metrics')
+    parser.add_argument('--analyze-workers', type=int, default=1,
+                        help='Worker threads running the LLM analysis')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='Worker threads rendering PDF reports (worker processes with --render-mode process)')
+    parser.add_argument('--render-mode', choices=['thread', 'process'], default='thread',
+                        help='Render PDFs on threads in this process or in a pool of --render-workers processes')
+    parser.add_argument('--chart-dpi', type=int,
+                        help='Resolution of the charts embedded in the reports (default: 150)')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='Maximum customers waiting in front of each pipeline stage')
+    parser.add_argument('--batch-size', type=int, default=0, metavar='N',
+                        help='Fetch metrics for N tenants per query instead of one query per tenant')
+    parser.add_argument('--metrics', type=lambda value: [name.strip() for name in value.split(',') if name.strip()],
+                        help=f'Comma-separated metric groups to compute (default: all). '
+                             f'Available: {", ".join(METRIC_GROUPS)}')
+    parser.add_argument('--metric-workers', type=int, default=1, metavar='N',
+                        help='Compute the metric groups of a tenant concurrently on N connections')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse the previous metrics of tenants whose tables have not changed')
+    parser.add_argument('--snapshot-max-age-days', type=int, default=0,
+                        help='Oldest metrics snapshot (in days) that --incremental may reuse; time-windowed '
+                             'metrics can lag by up to this many days')
+    parser.add_argument('--snapshot-db', default=DEFAULT_SNAPSHOT_PATH,
+                        help='SQLite file holding the metrics snapshots for --incremental')
+    parser.add_argument('--rollups', action='store_true',
+                        help='Answer the windowed user, contract, event and e-sign metrics from per-tenant daily '
+                             'rollups that each run extends with the days since the last run')
+    parser.add_argument('--rollup-db', default=DEFAULT_ROLLUP_PATH,
+                        help='SQLite file holding the daily metric rollups for --rollups')
+    parser.add_argument('--rollup-rebuild-days', type=int, default=7,
+                        help='Days after which a tenant\'s rollups are rebuilt from the raw rows, picking up deleted '
+                             'rows and back-dated changes (0 never rebuilds)')
+    parser.add_argument('--plan-sample-every', type=int, default=0, metavar='N',
+                        help='Measure the metrics statement planning time for every Nth tenant')
+    parser.add_argument('--catalog-db', default=DEFAULT_CATALOG_PATH,
+                        help='SQLite file caching each region\'s tenant-to-schema catalog')
+    parser.add_argument('--catalog-refresh-minutes', type=float, default=60,
+                        help='Minutes the cached tenant catalog is trusted before it is checked for new '
+                             'schemas or tenants (0 checks every run)')
+    parser.add_argument('--stream-customers', action='store_true',
+                        help='Stream live customers from a server-side cursor so processing starts on the first '
+                             'tenant instead of after the whole list is fetched')
+    parser.add_argument('--itersize', type=int, default=500, metavar='N',
+                        help='Rows fetched per round trip with --stream-customers')
+    parser.add_argument('--history-dir',
+                        help='Directory of the columnar metrics history store (default: history)')
+    parser.add_argument('--analysis-mode', choices=['sync', 'async', 'batch'], default='sync',
+                        help='Use blocking OpenAI calls, the rate-limited, retrying async client, or one '
+                             'OpenAI Batch API submission per region (for unattended nightly runs)')
+    parser.add_argument('--llm-concurrency', type=int, default=8,
+                        help='Maximum OpenAI requests in flight in async mode')
+    parser.add_argument('--llm-rpm', type=int, help='OpenAI requests per minute limit (async mode)')
+    parser.add_argument('--llm-tpm', type=int, help='OpenAI tokens per minute limit (async mode)')
+    parser.add_argument('--llm-max-retries', type=int, default=5,
+                        help='Retries for rate-limited, timed out or failed OpenAI requests (async mode)')
+    parser.add_argument('--llm-cache', nargs='?', const=DEFAULT_CACHE_PATH, metavar='PATH',
+                        help=f'Reuse analyses of unchanged customer data from a SQLite cache '
+                             f'(default path: {DEFAULT_CACHE_PATH})')
+    parser.add_argument('--llm-cache-ttl-hours', type=float, default=168,
+                        help='Hours before a cached analysis expires')
+    parser.add_argument('--llm-cache-max-entries', type=int, default=10000,
+                        help='Maximum cached analyses; least recently used entries are evicted')
+    parser.add_argument('--llm-prompt-format', choices=['compact', 'json'], default='compact',
+                        help='Send customer metrics as compact "Name: value" lines or as indented JSON')
+    parser.add_argument('--llm-token-budget', type=int, metavar='N',
+                        help='Maximum estimated prompt plus completion tokens per OpenAI request; max_tokens is '
+                             'lowered to fit and customers whose prompt leaves too little room fail')
+    parser.add_argument('--llm-batch-dir', default=DEFAULT_BATCH_DIR,
+                        help='Directory the batch input and result JSONL files are kept in (batch mode)')
+    parser.add_argument('--llm-batch-poll-seconds', type=float, default=30,
+                        help='Seconds between batch status checks (batch mode)')
+    parser.add_argument('--llm-batch-timeout-minutes', type=float,
+                        help='Cancel a batch still running after this many minutes (batch mode; default: wait '
+                             'for its 24h completion window)')
+    parser.add_argument('--run-manifest', default=DEFAULT_MANIFEST_PATH,
+                        help='SQLite file recording each customer\'s finished stages and their artifacts')
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue each region\'s latest run from the run manifest: customers with a report are '
+                             'skipped, stored metrics and analyses are reused')
+    parser.add_argument('--stage', choices=('all',) + STAGES, default='all',
+                        help='Run one stage: fetch saves the metrics to the run manifest, analyze analyzes the '
+                             'latest run\'s saved metrics and render re-renders its saved analyses without the '
+                             'database or the LLM')
+    parser.add_argument('--schedule', choices=['fifo', 'size'], default='fifo',
+                        help='Fetch customers in catalog order, or largest first by the planner row estimates of '
+                             'the tables their metrics read, with size-scaled statement timeouts')
+    parser.add_argument('--statement-timeout-base', type=float, default=60,
+                        help='Seconds of statement_timeout for an empty tenant with --schedule size (0 disables '
+                             'the timeouts)')
+    parser.add_argument('--statement-timeout-per-million-rows', type=float, default=120,
+                        help='Seconds of statement_timeout added per million estimated rows with --schedule size')
+    parser.add_argument('--statement-timeout-max', type=float, default=1800,
+                        help='Upper bound in seconds of the statement_timeout with --schedule size')
+    parser.add_argument('--schedule-out', metavar='PATH',
+                        help='Write the predicted vs. actual cost per tenant of --schedule size as JSON to PATH '
+                             '(not measured with --batch-size)')
+    parser.add_argument('--coordinator', action='store_true',
+                        help='Queue one job per live customer of the selected regions in --queue-db and wait for '
+                             'workers to process them')
+    parser.add_argument('--worker', action='store_true',
+                        help='Lease customer jobs from --queue-db and process them until none is pending; run any '
+                             'number of workers on any number of hosts')
+    parser.add_argument('--queue-db', default=DEFAULT_QUEUE_PATH,
+                        help='SQLite job queue shared by the coordinator and workers (on a filesystem with working '
+                             'locks when workers run on several hosts)')
+    parser.add_argument('--run-id', help='Run the coordinator queues jobs under (default: the current UTC time); '
+                                         'reuse it to wait on an earlier run')
+    parser.add_argument('--lease-seconds', type=float, default=900,
+                        help='Seconds a leased job stays invisible to other workers; extended at every stage')
+    parser.add_argument('--max-attempts', type=int, default=3,
+                        help='Leases a job gets before it is marked failed')
+    parser.add_argument('--queue-poll-seconds', type=float, default=10,
+                        help='Seconds between checks of the job queue by an idle worker or the coordinator')
+    parser.add_argument('--worker-id', help='Name of this worker in the job queue (default: host:pid)')
+    parser.add_argument('--profile-queries', action='store_true',
+                        help='Instead of a normal run, profile the metrics query with EXPLAIN (ANALYZE, BUFFERS) for '
+                             'a sample of tenants and report time and buffers per CTE')
+    parser.add_argument('--profile-sample', type=int, default=25, metavar='N',
+                        help='Tenants per region profiled by --profile-queries')
+    parser.add_argument('--profile-seed', type=int, help='Random seed of the --profile-queries tenant sample')
+    parser.add_argument('--profile-out', metavar='PATH', help='Write the --profile-queries report as JSON to PATH')
+    parser.add_argument('--telemetry-out', metavar='PATH',
+                        help='Write a JSON summary of per-stage timings, LLM tokens and peak memory to PATH')
+    parser.add_argument('--prometheus-textfile', metavar='PATH',
+                        help='Write the run\'s stage histograms, counters and peak RSS as a Prometheus textfile '
+                             '(e.g. into the node_exporter textfile collector directory, ending in .prom)')
     args = parser.parse_args()
 
     setup_custom_logging(args.log_level)
+    if args.coordinator and args.worker:
+        parser.error('--coordinator and --worker are separate processes; pass only one')
+    if args.metrics:
+        resolve_metric_groups(args.metrics)  # Fail fast on unknown group names
 
     try:
         regions = [args.region] if args.region else ['Staging', 'APAC', 'EU', 'US', 'CA']
+        if args.test:
+            regions = regions[:1]
 
-        for region in regions:
-            process_region(region, args.test, args.temperature, args.months)
-            if args.test:
-                break
+        region_options = {
+            'fetch_workers': args.fetch_workers,
+            'analyze_workers': args.analyze_workers,
+            'render_workers': args.render_workers,
+            'render_mode': args.render_mode,
+            'chart_dpi': args.chart_dpi,
+            'queue_size': args.queue_size,
+            'analysis_mode': args.analysis_mode,
+            'llm_concurrency': args.llm_concurrency,
+            'llm_rpm': args.llm_rpm,
+            'llm_tpm': args.llm_tpm,
+            'llm_max_retries': args.llm_max_retries,
+            'llm_cache': args.llm_cache,
+            'llm_cache_ttl_hours': args.llm_cache_ttl_hours,
+            'llm_cache_max_entries': args.llm_cache_max_entries,
+            'llm_prompt_format': args.llm_prompt_format,
+            'llm_token_budget': args.llm_token_budget,
+            'llm_batch_dir': args.llm_batch_dir,
+            'llm_batch_poll_seconds': args.llm_batch_poll_seconds,
+            'llm_batch_timeout_minutes': args.llm_batch_timeout_minutes,
+            'batch_size': args.batch_size,
+            'metrics': args.metrics,
+            'metric_workers': args.metric_workers,
+            'incremental': args.incremental,
+            'snapshot_max_age_days': args.snapshot_max_age_days,
+            'snapshot_db': args.snapshot_db,
+            'plan_sample_every': args.plan_sample_every,
+            'catalog_db': args.catalog_db,
+            'catalog_refresh_minutes': args.catalog_refresh_minutes,
+            'history_dir': args.history_dir,
+            'stream_customers': args.stream_customers,
+            'itersize': args.itersize,
+            'run_manifest': args.run_manifest,
+            'resume': args.resume,
+            'stage': args.stage,
+            'schedule': args.schedule,
+            'statement_timeout_base': args.statement_timeout_base,
+            'statement_timeout_per_million_rows': args.statement_timeout_per_million_rows,
+            'statement_timeout_max': args.statement_timeout_max,
+            'rollups': args.rollups,
+            'rollup_db': args.rollup_db,
+            'rollup_rebuild_days': args.rollup_rebuild_days,
+        }
+
+        if args.profile_queries:
+            from db.profiler import QueryProfile
+            profile = QueryProfile(args.months, resolve_metric_groups(args.metrics) if args.metrics else None)
+            for region in regions:
+                profile_region(region, profile, args.profile_sample, args.profile_seed, args.catalog_db,
+                               args.catalog_refresh_minutes)
+            report = profile.log_report()
+            if args.profile_out:
+                with open(args.profile_out, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, indent=2, default=str)
+                logging.info(f"Query profile saved to: {args.profile_out}")
+            return
+
+        if args.coordinator or args.worker:
+            queue = JobQueue(args.queue_db)
+            try:
+                if args.coordinator:
+                    run_id = args.run_id or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+                    summaries = run_coordinator(regions, queue, run_id, args.months, args.max_attempts, args.test,
+                                                args.queue_poll_seconds, args.catalog_db,
+                                                args.catalog_refresh_minutes, args.schedule)
+                else:
+                    summaries = run_worker(queue, args.worker_id, args.lease_seconds, args.queue_poll_seconds,
+                                           args.temperature, args.fetch_workers, args.analyze_workers,
+                                           args.render_workers, args.queue_size, args.llm_cache,
+                                           args.llm_cache_ttl_hours, args.llm_cache_max_entries,
+                                           args.llm_prompt_format, args.llm_token_budget, args.metrics,
+                                           args.chart_dpi, args.history_dir)
+            finally:
+                queue.close()
+            log_run_summary(summaries)
+            return
+
+        if args.parallel_regions > 1 and len(regions) > 1:
+            summaries = run_regions_parallel(regions, args.parallel_regions, args.log_level,
+                                             args.test, args.temperature, args.months, **region_options)
+        else:
+            summaries = [process_region(region, args.test, args.temperature, args.months, **region_options)
+                         for region in regions]
+
+        log_run_summary(summaries)
+        if args.schedule_out:
+            with open(args.schedule_out, 'w', encoding='utf-8') as f:
+                json.dump({s['region']: s['schedule'] for s in summaries if 'schedule' in s}, f, indent=2)
+            logging.info(f"Tenant schedule report saved to: {args.schedule_out}")
 
     except Exception as e:
         logging.error(f"Error in main process: {e}")
         raise
+    finally:
+        if 'db.connection' in sys.modules:
+            from db.connection import close_pools
+            close_pools()
+        TELEMETRY.log_summary()
+        TELEMETRY.write(args.telemetry_out, args.prometheus_textfile)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,94 @@
+# report/charts.py
+
+import hashlib
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+DEFAULT_CHART_DPI = 150
+
+# Rendered charts by content hash, shared by every ReportGenerator in the process
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+CHART_CACHE_SIZE = 256
+
+
+class ChartRenderer:
+    """
+    Renders report charts into in-memory fpdf images.
+
+    Charts are drawn on their own Figure with the Agg canvas (no pyplot state,
+    safe to use from several threads) and the raw RGB pixels are deflated
+    straight into an fpdf image, so nothing is written to disk. Results are
+    memoized on a hash of everything plotted, so identical charts are only
+    rendered once per process.
+    """
+
+    def __init__(self, dpi=DEFAULT_CHART_DPI, figsize=(10, 5)):
+        self.dpi = dpi
+        self.figsize = figsize
+        self.rendered = 0
+        self.reused = 0
+
+    def bar_chart(self, title, labels, values, colors):
+        """
+        Returns (image name, fpdf image info) for a labelled bar chart.
+
+        The info is a fresh copy that can be added to one document's images.
+        """
+        key = hashlib.sha256(json.dumps(
+            ['bar', title, labels, values, colors, self.dpi, self.figsize], default=str
+        ).encode('utf-8')).hexdigest()
+
+        with _chart_cache_lock:
+            info = _chart_cache.get(key)
+            if info is not None:
+                _chart_cache.move_to_end(key)
+        if info is not None:
+            self.reused += 1
+        else:
+            info = self._render_bar_chart(title, labels, values, colors)
+            self.rendered += 1
+            with _chart_cache_lock:
+                _chart_cache[key] = info
+                while len(_chart_cache) > CHART_CACHE_SIZE:
+                    _chart_cache.popitem(last=False)
+        return f"chart_{key[:16]}", dict(info)
+
+    def _render_bar_chart(self, title, labels, values, colors):
+        fig = Figure(figsize=self.figsize, dpi=self.dpi)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+
+        bars = ax.bar(labels, values, color=colors)
+        ax.set_title(title)
+
+        # Add value labels on top of bars
+        for bar in bars:
+            height = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width() / 2., height,
+                    f'{int(height):,}',
+                    ha='center', va='bottom')
+
+        ax.tick_params(axis='x', labelrotation=45)
+        fig.tight_layout(pad=1.5)
+        canvas.draw()
+        return self._to_image_info(canvas)
+
+    @staticmethod
+    def _to_image_info(canvas):
+        width, height = canvas.get_width_height()
+        rgb = np.asarray(canvas.buffer_rgba())[:, :, :3].tobytes()
+        return {
+            'w': width,
+            'h': height,
+            'cs': 'DeviceRGB',
+            'bpc': 8,
+            'f': 'FlateDecode',
+            'data': zlib.compress(rgb, 6),
+        }
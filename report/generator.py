@@ -1,15 +1,68 @@
 from fpdf import FPDF
 import logging
 from datetime import datetime
-import matplotlib.pyplot as plt
-import tempfile
 import os
+import time
+
+from report.charts import DEFAULT_CHART_DPI, ChartRenderer
+
+LOGO_PATH = 'assets/logo.png'
+
+# Decoded fpdf image info per path, shared by every report rendered in this process
+_image_cache = {}
+# ReportGenerator per lookback, reused by render_report in pool workers
+_worker_generators = {}
+
+
+def load_image_info(path):
+    """
+    Return fpdf image info for path, decoding the file only once per process.
+
+    Each call returns a fresh copy: FPDF drops the image data from its info
+    when the document is written, so documents must not share the dict.
+    """
+    info = _image_cache.get(path)
+    if info is None:
+        extension = os.path.splitext(path)[1].lower().lstrip('.')
+        parser = getattr(FPDF(), '_parse' + ('jpg' if extension == 'jpeg' else extension))
+        info = _image_cache[path] = parser(path)
+    return dict(info)
+
+
+def warm_static_assets():
+    """Decode the logo and load the core font metrics used by the reports."""
+    if os.path.exists(LOGO_PATH):
+        load_image_info(LOGO_PATH)
+    pdf = FPDF()
+    pdf.add_page()
+    for style in ('', 'B', 'BU'):
+        pdf.set_font('Arial', style, 10)
+        pdf.get_string_width('Customer Health Analysis')
+
+
+def render_report(analysis_data, months=1, chart_dpi=DEFAULT_CHART_DPI):
+    """
+    Render one report with this process's ReportGenerator.
+
+    Used as the task of the process-pool rendering mode.
+
+    :return: Tuple of (report filename, render time in seconds)
+    """
+    key = (tuple(months) if isinstance(months, (list, tuple)) else months, chart_dpi)
+    if key not in _worker_generators:
+        _worker_generators[key] = ReportGenerator(months, chart_dpi)
+    started = time.perf_counter()
+    filename = _worker_generators[key].generate_report(analysis_data)
+    return filename, time.perf_counter() - started
 
 
 class ReportGenerator:
-    def __init__(self, months=1):
+    def __init__(self, months=1, chart_dpi=DEFAULT_CHART_DPI):
         self.pdf = None  # Initialize in generate_report to ensure fresh instance for each report
         self.months = months
+        self.charts = ChartRenderer(chart_dpi)
+        # Lookback windows in months; several windows come from one multi-window fetch
+        self.windows = sorted(months) if isinstance(months, (list, tuple)) else [months]
 
     def generate_report(self, analysis_data):
         """Generate a new report with fresh PDF instance."""
@@ -23,7 +76,6 @@ class ReportGenerator:
         logging.debug(f"Generating report for customer: {analysis_data.get('customer_name')}")
         logging.debug(f"Analysis data keys: {analysis_data.keys()}")
 
-        temp_dir = tempfile.mkdtemp()
         try:
             os.makedirs('reports', exist_ok=True)
 
@@ -33,6 +85,7 @@ class ReportGenerator:
             if 'raw_data' in analysis_data:
                 logging.debug("Adding charts and metrics")
                 self._add_metrics_tables(analysis_data['raw_data'])
+                self._add_charts(analysis_data['raw_data'])
             else:
                 logging.warning("No raw_data found in analysis_data")
 
@@ -46,21 +99,14 @@ class ReportGenerator:
         except Exception as e:
             logging.error(f"PDF generation error for {analysis_data.get('customer_name')}: {str(e)}", exc_info=True)
             raise
-        finally:
-            try:
-                for file in os.listdir(temp_dir):
-                    os.remove(os.path.join(temp_dir, file))
-                os.rmdir(temp_dir)
-            except Exception as e:
-                logging.warning(f"Failed to cleanup temp files: {e}")
 
     def _add_cover_page(self, customer_name):
         try:
             self.pdf.add_page()
 
             # Logo placement
-            if os.path.exists('assets/logo.png'):
-                self.pdf.image('assets/logo.png', x=5, y=5, w=60)  # Adjust size as needed
+            if os.path.exists(LOGO_PATH):
+                self._add_image(LOGO_PATH, x=5, y=5, w=60)  # Adjust size as needed
 
             # Professional header with gradient
             self.pdf.set_fill_color(51, 122, 183)  # Blue color
@@ -82,13 +128,31 @@ class ReportGenerator:
             self.pdf.ln(5)
             self.pdf.set_font('Arial', '', 12)
             self.pdf.cell(0, 10, f'Generated on: {datetime.now().strftime("%B %d, %Y")}', ln=True, align='C')
-            self.pdf.cell(0, 5, f'Report covers last {self.months} month{"s" if self.months != 1 else ""}', ln=True,
-                          align='C')
+            self.pdf.cell(0, 5, f'Report covers last {self._describe_windows()}', ln=True, align='C')
 
 
         except Exception as e:
             logging.error(f"Error adding cover page: {e}")
 
+    def _add_image(self, name, info=None, **position):
+        """
+        Place an image using already decoded info instead of letting FPDF parse the file.
+
+        :param name: Image file path, or the name of an in-memory image
+        :param info: fpdf image info for an in-memory image; None loads the file via load_image_info
+        """
+        if name not in self.pdf.images:
+            info = info if info is not None else load_image_info(name)
+            info['i'] = len(self.pdf.images) + 1
+            self.pdf.images[name] = info
+        self.pdf.image(name, **position)
+
+    def _describe_windows(self):
+        windows = [str(months) for months in self.windows]
+        if len(windows) > 1:
+            windows = [', '.join(windows[:-1]) + ' and ' + windows[-1]]
+        return f'{windows[0]} month{"s" if self.windows != [1] else ""}'
+
 
     def _add_overview_page(self, analysis_data):
         try:
@@ -159,8 +223,8 @@ class ReportGenerator:
 
                 self.pdf.set_font('Arial', '', 10)
                 for metric in metrics:
-                    found_metric = next((k for k in raw_data.keys() if k.startswith(metric)), None)
-                    if found_metric:
+                    # Windowed metrics have one column per lookback window, e.g. "(1m)", "(3m)"
+                    for found_metric in [k for k in raw_data.keys() if k.startswith(metric)]:
                         value = str(raw_data[found_metric])
                         self.pdf.cell(100, 8, found_metric, border=1)
                         self.pdf.cell(90, 8, value, border=1, ln=True)
@@ -168,6 +232,20 @@ class ReportGenerator:
         except Exception as e:
             logging.error(f"Error adding metrics tables: {e}")
 
+    def _add_charts(self, raw_data):
+        try:
+            charts = [chart for chart in (self._create_user_engagement_chart(raw_data),
+                                          self._create_contract_metrics_chart(raw_data)) if chart]
+            for name, info in charts:
+                # Full content width, keeping the chart's aspect ratio
+                height = 190 * info['h'] / info['w']
+                if self.pdf.get_y() + height > self.pdf.h - self.pdf.b_margin:
+                    self.pdf.add_page()
+                self._add_image(name, info, x=10, y=self.pdf.get_y(), w=190)
+                self.pdf.set_y(self.pdf.get_y() + height + 5)
+        except Exception as e:
+            logging.error(f"Error adding charts: {e}")
+
     def _add_detailed_analysis(self, analysis):
         try:
             self.pdf.add_page()
@@ -189,12 +267,18 @@ class ReportGenerator:
         except Exception as e:
             logging.error(f"Error adding detailed analysis: {e}")
 
-    def _create_user_engagement_chart(self, data, temp_dir):
+    @staticmethod
+    def _safe_int(value):
+        # Convert values to integers, handling various formats
         try:
-            plt.close('all')
-            fig = plt.figure(figsize=(10, 5))
-            ax = fig.add_subplot(111)
+            if isinstance(value, (int, float)):
+                return int(value)
+            return int(str(value).replace(',', ''))
+        except (ValueError, TypeError):
+            return 0
 
+    def _create_user_engagement_chart(self, data):
+        try:
             # Find the correct metric names based on the months value
             total_users_key = next((k for k in data.keys() if k.startswith('Total Logged In Users')), None)
             active_users_key = next((k for k in data.keys() if k.startswith('Users Who Performed Actions')), None)
@@ -204,19 +288,10 @@ class ReportGenerator:
                 logging.warning("Missing user engagement metrics")
                 return None
 
-            # Convert values to integers, handling various formats
-            def safe_convert(value):
-                try:
-                    if isinstance(value, (int, float)):
-                        return int(value)
-                    return int(str(value).replace(',', ''))
-                except (ValueError, TypeError):
-                    return 0
-
             users = [
-                safe_convert(data.get(total_users_key, 0)),
-                safe_convert(data.get(active_users_key, 0)),
-                safe_convert(data.get(passive_users_key, 0))
+                self._safe_int(data.get(total_users_key, 0)),
+                self._safe_int(data.get(active_users_key, 0)),
+                self._safe_int(data.get(passive_users_key, 0))
             ]
 
             # Only create chart if we have non-zero data
@@ -224,35 +299,16 @@ class ReportGenerator:
                 logging.warning("No user engagement data available")
                 return None
 
-            labels = ['Total Users', 'Active Users', 'Passive Users']
-
-            bars = ax.bar(labels, users, color=['#3498db', '#2ecc71', '#e74c3c'])
-            ax.set_title('User Engagement Overview')
-
-            # Add value labels on top of bars
-            for bar in bars:
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width() / 2., height,
-                        f'{int(height):,}',
-                        ha='center', va='bottom')
-
-            plt.xticks(rotation=45)
-            plt.tight_layout(pad=1.5)
-
-            path = self._save_plt_as_temp_file(fig, temp_dir)
-            plt.close(fig)
-            return path
+            return self.charts.bar_chart('User Engagement Overview',
+                                         ['Total Users', 'Active Users', 'Passive Users'], users,
+                                         ['#3498db', '#2ecc71', '#e74c3c'])
 
         except Exception as e:
             logging.error(f"Error creating user engagement chart: {e}")
             return None
 
-    def _create_contract_metrics_chart(self, data, temp_dir):
+    def _create_contract_metrics_chart(self, data):
         try:
-            plt.close('all')
-            fig = plt.figure(figsize=(10, 5))
-            ax = fig.add_subplot(111)
-
             # Find the correct metric names based on the months value
             total_contracts_key = 'Total Live Contracts'
             new_contracts_key = next((k for k in data.keys() if k.startswith('NEW Live Contracts')), None)
@@ -262,18 +318,10 @@ class ReportGenerator:
                 logging.warning("Missing contract metrics")
                 return None
 
-            def safe_convert(value):
-                try:
-                    if isinstance(value, (int, float)):
-                        return int(value)
-                    return int(str(value).replace(',', ''))
-                except (ValueError, TypeError):
-                    return 0
-
             values = [
-                safe_convert(data.get(total_contracts_key, 0)),
-                safe_convert(data.get(new_contracts_key, 0)),
-                safe_convert(data.get(updated_contracts_key, 0))
+                self._safe_int(data.get(total_contracts_key, 0)),
+                self._safe_int(data.get(new_contracts_key, 0)),
+                self._safe_int(data.get(updated_contracts_key, 0))
             ]
 
             # Only create chart if we have non-zero data
@@ -281,35 +329,9 @@ class ReportGenerator:
                 logging.warning("No contract metrics data available")
                 return None
 
-            labels = ['Total Live', 'New', 'Updated']
-
-            bars = ax.bar(labels, values, color=['#3498db', '#2ecc71', '#f1c40f'])
-            ax.set_title('Contract Activity')
-
-            # Add value labels on top of bars
-            for bar in bars:
-                height = bar.get_height()
-                ax.text(bar.get_x() + bar.get_width() / 2., height,
-                        f'{int(height):,}',
-                        ha='center', va='bottom')
-
-            plt.xticks(rotation=45)
-            plt.tight_layout(pad=1.5)
-
-            path = self._save_plt_as_temp_file(fig, temp_dir)
-            plt.close(fig)
-            return path
+            return self.charts.bar_chart('Contract Activity', ['Total Live', 'New', 'Updated'], values,
+                                         ['#3498db', '#2ecc71', '#f1c40f'])
 
         except Exception as e:
             logging.error(f"Error creating contract metrics chart: {e}")
             return None
-
-    def _save_plt_as_temp_file(self, fig, temp_dir):
-        try:
-            temp_path = os.path.join(temp_dir, f'chart_{datetime.now().strftime("%H%M%S%f")}.png')
-            fig.savefig(temp_path, format='png', bbox_inches='tight', dpi=300)
-            plt.close(fig)
-            return temp_path
-        except Exception as e:
-            logging.error(f"Error saving plot: {e}")
-            return None
\ No newline at end of file
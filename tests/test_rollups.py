@@ -0,0 +1,151 @@
+# tests/test_rollups.py
+"""
+Tests of MetricRollupStore's ingest and merge against a fake database connection.
+
+The fake returns the preset (item_id, day, metric, value) rows of each rollup
+whose day is on or after the query's since, as the timestamp filters would.
+"""
+
+from datetime import date
+
+from db.metrics import METRIC_GROUPS, metric_columns, quote_schema, without_rollup_columns
+from db.rollups import ACTIVE_USERS_QUERY, ITEM_ROLLUPS, MetricRollupStore, _round_half_up, add_rollup_columns
+
+REGION = 'Staging'
+TENANT = (1, 'acme_1')
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params):
+        if 'unnest' in query:
+            self.rows = [(self.connection.today, months, self.connection.starts[months]) for months in params[0]]
+            return
+        templates = {name: template for name, (template, _) in ITEM_ROLLUPS.items()}
+        templates['active_users'] = ACTIVE_USERS_QUERY
+        rollup = next(name for name, template in templates.items()
+                      if query == template.format(schema=quote_schema(TENANT[1]) + '.'))
+        self.connection.scans.append((rollup, params['since']))
+        self.rows = [row for row in self.connection.rows.get(rollup, []) if row[1] >= params['since']]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, rows, today=None, starts=None):
+        """
+        :param rows: Dict of rollup name -> rows its query returns, before the since filter
+        :param today: CURRENT_DATE returned with the window starts
+        :param starts: Dict of months -> first day of the window
+        """
+        self.rows = rows
+        self.today = today
+        self.starts = starts or {}
+        self.scans = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def refresh(store, conn, rollups, today, start):
+    store.refresh(conn, REGION, *TENANT, rollups, today, start)
+
+
+def count(store, metric, start):
+    return store.window_values(REGION, *TENANT, start).get((metric, 'count'), 0)
+
+
+def test_updated_contract_counted_once_in_latest_bucket(tmp_path):
+    store = MetricRollupStore(str(tmp_path / 'rollups.sqlite'))
+    conn = FakeConnection({'contracts_updated': [
+        (7, date(2026, 10, 1), 'contracts_updated', None),
+        (8, date(2026, 10, 2), 'contracts_updated', None),
+    ]})
+    refresh(store, conn, ['contracts_updated'], date(2026, 10, 2), date(2026, 9, 2))
+
+    conn.rows['contracts_updated'] = [
+        (7, date(2026, 10, 5), 'contracts_updated', None),
+        (8, date(2026, 10, 2), 'contracts_updated', None),
+    ]
+    refresh(store, conn, ['contracts_updated'], date(2026, 10, 5), date(2026, 9, 5))
+
+    assert conn.scans == [('contracts_updated', date(2026, 9, 2)), ('contracts_updated', date(2026, 10, 2))]
+    assert (store.built, store.updated) == (1, 1)
+    assert count(store, 'contracts_updated', date(2026, 9, 5)) == 2
+    assert count(store, 'contracts_updated', date(2026, 10, 3)) == 1
+    assert count(store, 'contracts_updated', date(2026, 10, 6)) == 0
+
+
+def test_esign_leaving_signed_status_drops_out(tmp_path):
+    store = MetricRollupStore(str(tmp_path / 'rollups.sqlite'))
+    conn = FakeConnection({'esigns': [
+        (1, date(2026, 10, 1), 'gk_esigns', None),
+        (2, date(2026, 10, 1), 'docusigns', None),
+    ]})
+    refresh(store, conn, ['esigns'], date(2026, 10, 1), date(2026, 9, 1))
+    assert count(store, 'gk_esigns', date(2026, 9, 1)) == 1
+
+    conn.rows['esigns'] = [
+        (1, date(2026, 10, 3), None, None),
+        (2, date(2026, 10, 1), 'docusigns', None),
+    ]
+    refresh(store, conn, ['esigns'], date(2026, 10, 3), date(2026, 9, 3))
+
+    assert count(store, 'gk_esigns', date(2026, 9, 3)) == 0
+    assert count(store, 'docusigns', date(2026, 9, 3)) == 1
+
+
+def test_wider_window_rebuilds_from_new_start(tmp_path):
+    store = MetricRollupStore(str(tmp_path / 'rollups.sqlite'))
+    conn = FakeConnection({'contracts_created': [
+        (3, date(2026, 5, 1), 'contracts_created', None),
+        (4, date(2026, 10, 1), 'contracts_created', None),
+    ]})
+    refresh(store, conn, ['contracts_created'], date(2026, 10, 2), date(2026, 9, 2))
+    assert count(store, 'contracts_created', date(2026, 4, 2)) == 1
+
+    refresh(store, conn, ['contracts_created'], date(2026, 10, 2), date(2026, 4, 2))
+
+    assert conn.scans[-1] == ('contracts_created', date(2026, 4, 2))
+    assert (store.built, store.updated) == (2, 0)
+    assert count(store, 'contracts_created', date(2026, 4, 2)) == 2
+
+    refresh(store, conn, ['contracts_created'], date(2026, 10, 3), date(2026, 9, 3))
+
+    assert conn.scans[-1] == ('contracts_created', date(2026, 10, 2))
+    assert store.updated == 1
+
+
+def test_avg_completion_time_rounds_like_postgres(tmp_path):
+    store = MetricRollupStore(str(tmp_path / 'rollups.sqlite'))
+    conn = FakeConnection({'events_completed': [
+        (1, date(2026, 10, 1), 'events_completed', 2.0),
+        (2, date(2026, 10, 1), 'events_completed', 3.0),
+    ]}, today=date(2026, 10, 2), starts={1: date(2026, 9, 2)})
+    group = METRIC_GROUPS['activities']
+    columns = metric_columns([without_rollup_columns(group)], 1)
+
+    results, columns = add_rollup_columns(store, conn, REGION, *TENANT, 1, [group],
+                                          [tuple(range(len(columns)))], columns)
+
+    row = dict(zip(columns, results[0]))
+    assert columns == metric_columns([group], 1)
+    assert conn.rollbacks == 1
+    assert row['Completed Events (1m)'] == 2
+    assert row['Events Avg Completion Time (1m)'] == 3
+    assert row['New Events (1m)'] == 0
+    assert [_round_half_up(value) for value in (0.5, 1.5, 2.5, -2.5, 2.4999)] == [1, 2, 3, -3, 2]
@@ -0,0 +1,289 @@
+# utils/history_store.py
+"""
+Columnar history of customer metrics.
+
+Every region run appends one Arrow IPC file with a row per customer to
+<root>/region=<region>/run_date=<YYYY-MM-DD>/. Files are uncompressed so reads
+can memory-map them, and a read only touches the requested columns and the
+partitions matching the region/date filter.
+
+Columns keep the types of the metrics query output (counts as int64, rounded
+numerics as float64, dates as date32, labels as strings). Files written before
+a metric or lookback window existed simply lack that column and read as null.
+
+Importing the old per-customer CSVs:
+
+    python -m utils.history_store import --raw-dir raw_data --store history
+"""
+
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+DEFAULT_HISTORY_PATH = 'history'
+
+PARTITIONING = ds.partitioning(pa.schema([('region', pa.string()), ('run_date', pa.date32())]), flavor='hive')
+
+# Query output columns that are not integer counts; windowed columns are matched without "(Nm)"
+COLUMN_TYPES = {
+    'customer': pa.string(),
+    'tenant_id': pa.int64(),
+    'plan': pa.string(),
+    'schema_name': pa.string(),
+    'hubspot_id': pa.string(),
+    'RBAC Status': pa.string(),
+    'Main Currency': pa.string(),
+    'Average Contract Value (Live)': pa.float64(),
+    'Percent Contracts with Internal Owners': pa.float64(),
+    'Percent with Master Record': pa.float64(),
+    'OpenAI Contract Summary': pa.string(),
+    'Event Types': pa.string(),
+    'Smart Forms Enabled': pa.string(),
+    'Smart Form Types': pa.string(),
+    'Latest Updated Score': pa.date32(),
+    'Auto Build Enabled': pa.string(),
+    'eSign Enabled': pa.string(),
+    'DocuSign Enabled': pa.string(),
+}
+
+WINDOW_SUFFIX = re.compile(r' \(\d+m\)$')
+
+
+def _infer_type(values):
+    """Arrow type for a column that is not in COLUMN_TYPES."""
+    present = [value for value in values if value is not None]
+    if not present:
+        return pa.null()
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return pa.int64()
+    if all(isinstance(value, (int, float, Decimal)) and not isinstance(value, bool) for value in present):
+        return pa.float64()
+    if all(isinstance(value, date) for value in present):
+        return pa.date32()
+    return pa.string()
+
+
+def column_type(column, values):
+    """Arrow type of a customer column, declared or inferred from its values."""
+    declared = COLUMN_TYPES.get(column) or COLUMN_TYPES.get(WINDOW_SUFFIX.sub('', column))
+    if declared is not None:
+        return declared
+    if WINDOW_SUFFIX.search(column):
+        return pa.int64()  # Every windowed metric is a count or a whole number of days
+    return _infer_type(values)
+
+
+def _convert(value, arrow_type):
+    if value is None:
+        return None
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_integer(arrow_type):
+        return int(value)
+    if pa.types.is_string(arrow_type):
+        return str(value)
+    return value
+
+
+def build_table(rows, run_at):
+    """
+    Builds a typed Arrow table from customer dicts.
+
+    The region is stored as a partition and not repeated in the file.
+
+    :param rows: List of customer dicts (customer_base_dict plus metrics)
+    :param run_at: Datetime of the run, stored as the run_at column
+    :return: pyarrow.Table
+    """
+    columns = []
+    for row in rows:
+        for column in row:
+            if column != 'region' and column not in columns:
+                columns.append(column)
+
+    arrays = {'run_at': pa.array([run_at] * len(rows), pa.timestamp('us', tz='UTC'))}
+    for column in columns:
+        values = [row.get(column) for row in rows]
+        arrow_type = column_type(column, values)
+        arrays[column] = pa.array([_convert(value, arrow_type) for value in values], arrow_type)
+    return pa.table(arrays)
+
+
+class HistoryStore:
+    """Partitioned Arrow IPC store of customer metrics, one file per region run."""
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+
+    def append(self, region, rows, run_at=None):
+        """
+        Writes one region run to its region/run_date partition.
+
+        :param region: Region name
+        :param rows: List of customer dicts
+        :param run_at: Datetime of the run (defaults to now, UTC)
+        :return: Path of the written file, or None when rows is empty
+        """
+        if not rows:
+            return None
+        run_at = run_at or datetime.now(timezone.utc)
+        table = build_table(rows, run_at)
+
+        partition = os.path.join(self.path, f"region={region}", f"run_date={run_at.date().isoformat()}")
+        os.makedirs(partition, exist_ok=True)
+        filename = os.path.join(partition, f"{run_at.strftime('%H%M%S')}-{uuid.uuid4().hex[:8]}.arrow")
+        # Write under a temporary name so readers never see a partial file
+        with pa.OSFile(filename + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(filename + '.tmp', filename)
+        return filename
+
+    def dataset(self):
+        """
+        Opens the store as a memory-mapped pyarrow dataset.
+
+        The schema is the union of the file schemas, so columns added by later
+        runs are present (null for older files) and an all-null column in one
+        run does not decide the column's type.
+        """
+        filesystem = pafs.LocalFileSystem(use_mmap=True)
+        files = sorted(glob.glob(os.path.join(self.path, 'region=*', 'run_date=*', '*.arrow')))
+        if not files:
+            return None
+        dataset = ds.dataset(files, format='ipc', partitioning=PARTITIONING, partition_base_dir=self.path,
+                             filesystem=filesystem)
+        schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()],
+                                  promote_options='permissive')
+        for field in PARTITIONING.schema:
+            schema = schema.append(field)
+        return ds.dataset(files, schema=schema, format='ipc', partitioning=PARTITIONING,
+                          partition_base_dir=self.path, filesystem=filesystem)
+
+    def read(self, columns=None, regions=None, since=None, until=None):
+        """
+        Reads customer history, projecting only the requested columns.
+
+        :param columns: Column names to read (None reads all), e.g. ['customer', 'run_date', 'Total Live Contracts']
+        :param regions: Region names to read, or None for all regions
+        :param since: First run date (datetime.date) to include
+        :param until: Last run date (datetime.date) to include
+        :return: pyarrow.Table
+        """
+        dataset = self.dataset()
+        if dataset is None:
+            return pa.table({column: [] for column in columns or []})
+
+        condition = None
+        for clause in (
+            ds.field('region').isin(regions) if regions else None,
+            ds.field('run_date') >= since if since else None,
+            ds.field('run_date') <= until if until else None,
+        ):
+            if clause is not None:
+                condition = clause if condition is None else condition & clause
+        return dataset.to_table(columns=columns, filter=condition)
+
+
+def _parse_csv_value(value, arrow_type):
+    if value == '':
+        return None
+    if pa.types.is_integer(arrow_type):
+        return int(float(value))
+    if pa.types.is_floating(arrow_type):
+        return float(value)
+    if pa.types.is_date(arrow_type):
+        return date.fromisoformat(value)
+    return value
+
+
+def _guess_csv_type(column, values):
+    declared = column_type(column, [])
+    if declared != pa.null():
+        return declared
+    present = [value for value in values if value != '']
+    for arrow_type, parse in ((pa.int64(), int), (pa.float64(), float), (pa.date32(), date.fromisoformat)):
+        try:
+            for value in present:
+                parse(value)
+            return arrow_type if present else pa.null()
+        except ValueError:
+            continue
+    return pa.string()
+
+
+def import_raw_csvs(store, raw_dir='raw_data'):
+    """
+    Imports per-customer raw_data/<name>_<YYYYMMDD>.csv files into the store.
+
+    Files are grouped into one store file per region and date.
+
+    :param store: HistoryStore
+    :param raw_dir: Directory holding the CSV files
+    :return: Number of customer rows imported
+    """
+    runs = {}
+    for path in sorted(glob.glob(os.path.join(raw_dir, '*.csv'))):
+        match = re.search(r'_(\d{8})\.csv$', os.path.basename(path))
+        if not match:
+            logging.warning(f"Skipping {path}: no _YYYYMMDD date suffix")
+            continue
+        run_date = datetime.strptime(match.group(1), '%Y%m%d').replace(tzinfo=timezone.utc)
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                runs.setdefault((row.get('region') or 'Unknown', run_date), []).append(row)
+
+    imported = 0
+    for (region, run_date), rows in sorted(runs.items()):
+        columns = {column for row in rows for column in row}
+        types = {column: _guess_csv_type(column, [row.get(column, '') for row in rows]) for column in columns}
+        typed_rows = [{column: _parse_csv_value(value, types[column]) for column, value in row.items()}
+                      for row in rows]
+        filename = store.append(region, typed_rows, run_date)
+        logging.info(f"Imported {len(rows)} customer(s) for {region} on {run_date.date()} into {filename}")
+        imported += len(rows)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Customer metrics history store')
+    parser.add_argument('--store', default=DEFAULT_HISTORY_PATH, help='History store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import', help='Import raw_data/*.csv files written by earlier runs')
+    import_parser.add_argument('--raw-dir', default='raw_data', help='Directory holding the raw CSV files')
+    info_parser = commands.add_parser('info', help='Summarize the stored history')
+    info_parser.add_argument('--columns', help='Comma-separated columns to read (default: customer)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    store = HistoryStore(args.store)
+    if args.command == 'import':
+        imported = import_raw_csvs(store, args.raw_dir)
+        logging.info(f"Imported {imported} customer row(s) into {args.store}")
+    else:
+        columns = args.columns.split(',') if args.columns else ['customer']
+        started = time.monotonic()
+        table = store.read(columns + ['region', 'run_date'])
+        elapsed = time.monotonic() - started
+        if not table.num_rows:
+            logging.info(f"No history in {args.store}")
+            return
+        regions = sorted(set(table.column('region').to_pylist()))
+        run_dates = table.column('run_date').to_pylist()
+        logging.info(f"{table.num_rows} customer row(s) across {', '.join(regions)} from {min(run_dates)} "
+                     f"to {max(run_dates)}, {len(columns)} column(s) read in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# utils/job_queue.py
+"""
+Durable SQLite queue of per-tenant jobs for the coordinator/worker mode.
+
+The coordinator enqueues one job per live customer (region, tenant, schema,
+lookback months) under a run id. Workers lease jobs: a leased job is
+invisible to other workers until its lease expires, and a worker extends the
+lease as the job moves through its stages. A job whose worker dies becomes
+visible again when the lease runs out and is retried by another worker, up to
+max_attempts leases in total; a job that raised is requeued the same way.
+
+Every lease increments the job's attempt number, and completing, failing or
+extending a job requires the worker id and attempt number of the current
+lease, so a worker whose lease expired cannot overwrite the outcome of the
+worker that took the job over.
+
+Workers on several hosts can share the queue file when it is on a filesystem
+with working POSIX locks; SQLite serializes the lease transactions.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_QUEUE_PATH = 'cache/job_queue.sqlite'
+
+
+class JobQueue:
+    """Leases, retries and outcomes of tenant jobs in a SQLite file."""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                region TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                months TEXT NOT NULL,
+                customer TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                worker TEXT,
+                lease_expires_at REAL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (run_id, region, tenant_id, schema_name)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires_at)")
+
+    def enqueue(self, run_id, region, customers, months, max_attempts=3):
+        """
+        Add one job per customer row; rows already queued for this run and region are left alone.
+
+        :param customers: fetch_live_customers rows (customer, tenant_id, plan, schema_name, hubspot_id)
+        :return: Number of jobs added
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = self.conn.executemany(
+                    "INSERT OR IGNORE INTO jobs (run_id, region, tenant_id, schema_name, months, customer, status, "
+                    "max_attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                    [(run_id, region, customer[1], customer[3], json.dumps(months), json.dumps(list(customer)),
+                      max_attempts, now, now) for customer in customers]
+                ).rowcount
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self, worker, lease_seconds):
+        """
+        Lease the oldest visible job: queued, or leased with an expired lease and attempts left.
+
+        Expired jobs without attempts left are marked failed on the way.
+
+        :return: Job dict (id, run_id, region, tenant_id, schema_name, months, customer, attempt) or None
+        """
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', worker = NULL, updated_at = ?, "
+                    "error = COALESCE(error, 'Lease expired') "
+                    "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= max_attempts",
+                    (now, now)
+                )
+                row = self.conn.execute(
+                    "SELECT id, run_id, region, tenant_id, schema_name, months, customer, attempts FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'leased' AND lease_expires_at < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, "
+                        "lease_expires_at = ?, updated_at = ? WHERE id = ?",
+                        (worker, now + lease_seconds, now, row[0])
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        if row[7]:
+            logging.info(f"Retrying job {row[0]} ({row[2]} tenant {row[3]}), attempt {row[7] + 1}")
+        return {
+            'id': row[0],
+            'run_id': row[1],
+            'region': row[2],
+            'tenant_id': row[3],
+            'schema_name': row[4],
+            'months': json.loads(row[5]),
+            'customer': tuple(json.loads(row[6])),
+            'attempt': row[7] + 1,
+        }
+
+    def _update_lease(self, job, worker, sql, params):
+        with self.lock:
+            updated = self.conn.execute(
+                f"UPDATE jobs SET {sql}, updated_at = ? "
+                "WHERE id = ? AND worker = ? AND attempts = ? AND status = 'leased'",
+                (*params, time.time(), job['id'], worker, job['attempt'])
+            ).rowcount
+        if not updated:
+            logging.warning(f"Lease of job {job['id']} (attempt {job['attempt']}) was lost to another worker")
+        return bool(updated)
+
+    def extend(self, job, worker, lease_seconds):
+        """Push the lease of a job out by lease_seconds from now. Returns False when the lease was lost."""
+        return self._update_lease(job, worker, "lease_expires_at = ?", (time.time() + lease_seconds,))
+
+    def complete(self, job, worker, result=None):
+        """Mark a leased job done with its result (the report path). Returns False when the lease was lost."""
+        return self._update_lease(job, worker, "status = 'done', lease_expires_at = NULL, result = ?, error = NULL",
+                                  (result,))
+
+    def fail(self, job, worker, error):
+        """
+        Record a failed attempt: the job is queued again while attempts are left, otherwise marked failed.
+
+        :return: False when the lease was lost
+        """
+        return self._update_lease(
+            job, worker,
+            "status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END, "
+            "worker = NULL, lease_expires_at = NULL, error = ?",
+            (str(error),)
+        )
+
+    def pending(self, run_id=None):
+        """Number of queued or leased jobs, of one run or of all runs."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')"
+                + (" AND run_id = ?" if run_id else ""),
+                (run_id,) if run_id else ()
+            ).fetchone()[0]
+
+    def counts(self, run_id):
+        """Jobs of a run per status."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status", (run_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def outcomes(self, run_id):
+        """(region, customer row, status, result, error) of every job of a run, ordered by job id."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT region, customer, status, result, error FROM jobs WHERE run_id = ? ORDER BY id", (run_id,)
+            ).fetchall()
+        return [(region, tuple(json.loads(customer)), status, result, error)
+                for region, customer, status, result, error in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
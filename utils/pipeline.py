@@ -0,0 +1,94 @@
+# utils/pipeline.py
+
+import logging
+import queue
+import threading
+
+_DONE = object()
+
+
+class Stage:
+    """A named pipeline stage with one handler per worker thread."""
+
+    def __init__(self, name, handlers):
+        if not handlers:
+            raise ValueError(f"Stage {name} needs at least one handler")
+        self.name = name
+        self.handlers = list(handlers)
+
+
+def run_pipeline(items, stages, queue_size=8, describe=str):
+    """
+    Runs items through stages connected by bounded queues.
+
+    Every stage runs one worker thread per handler, so different stages work on
+    different items at the same time. A handler receives the output of the
+    previous stage (the item itself for the first stage). An item whose handler
+    raises is logged and dropped; the remaining items carry on.
+
+    :param items: Iterable of input items
+    :param stages: List of Stage objects, in processing order
+    :param queue_size: Maximum number of items waiting in front of each stage
+    :param describe: Callable returning a label for an item, used in error logs
+    :return: Tuple of (results, errors) where results is a list of (item, output)
+             and errors is a list of (item, stage name, exception)
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    results = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [len(stage.handlers) for stage in stages]
+
+    def feed():
+        try:
+            for item in items:
+                queues[0].put((item, item))
+        except Exception as e:
+            logging.error(f"Error reading pipeline input: {e}")
+            with lock:
+                errors.append((None, 'input', e))
+        finally:
+            for _ in stages[0].handlers:
+                queues[0].put(_DONE)
+
+    def work(index, handler):
+        stage = stages[index]
+        inbox = queues[index]
+        outbox = queues[index + 1] if index + 1 < len(stages) else None
+        while True:
+            entry = inbox.get()
+            if entry is _DONE:
+                break
+            item, payload = entry
+            try:
+                output = handler(payload)
+            except Exception as e:
+                logging.error(f"Error processing customer {describe(item)} in {stage.name} stage: {str(e)}")
+                with lock:
+                    errors.append((item, stage.name, e))
+                continue
+            if outbox is not None:
+                outbox.put((item, output))
+            else:
+                with lock:
+                    results.append((item, output))
+
+        with lock:
+            remaining[index] -= 1
+            last_worker = remaining[index] == 0
+        if last_worker and outbox is not None:
+            for _ in stages[index + 1].handlers:
+                outbox.put(_DONE)
+
+    threads = [threading.Thread(target=feed, name='pipeline-input', daemon=True)]
+    for index, stage in enumerate(stages):
+        for n, handler in enumerate(stage.handlers):
+            threads.append(threading.Thread(target=work, args=(index, handler),
+                                            name=f"pipeline-{stage.name}-{n}", daemon=True))
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, errors
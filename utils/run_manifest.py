@@ -0,0 +1,141 @@
+# utils/run_manifest.py
+"""
+Per-customer stage checkpoints of a run, used to resume a failed run.
+
+Every stage a customer finishes is recorded under (region, run_date,
+tenant_id, schema_name, stage) together with its artifact: the fetched
+customer dict, the analysis result or the path of the rendered PDF. A run
+started with resume picks up the region's latest run date: customers whose
+report still exists are skipped, and the stored metrics and analyses of the
+others are reused, so only the remaining stages run. A run started without
+resume begins a new manifest for today, unless it only runs a later stage
+(new_run=False), which reads the artifacts of the latest run's earlier stage.
+
+Manifests older than retention_days are removed.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+DEFAULT_MANIFEST_PATH = 'cache/run_manifest.sqlite'
+STAGES = ('fetch', 'analyze', 'render')
+
+
+class RunManifest:
+    """SQLite record of the finished stages of one region's run."""
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH, region=None, resume=False, retention_days=14, new_run=True):
+        """
+        :param path: SQLite file holding the manifests of all regions
+        :param region: Region of the run
+        :param resume: Continue the region's latest run and reuse its finished stages
+        :param retention_days: Days manifests are kept
+        :param new_run: Start a new run for today unless resuming; False continues the latest run
+                        without reusing its finished stages
+        """
+        self.path = path
+        self.region = region
+        self.resume = resume
+        self.reused = {stage: 0 for stage in STAGES}
+        self.recorded = {stage: 0 for stage in STAGES}
+        self.lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                region TEXT NOT NULL,
+                run_date TEXT NOT NULL,
+                tenant_id INTEGER NOT NULL,
+                schema_name TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                artifact BLOB NOT NULL,
+                finished_at REAL NOT NULL,
+                PRIMARY KEY (region, run_date, tenant_id, schema_name, stage)
+            )
+        """)
+        self.conn.execute("DELETE FROM stages WHERE run_date < ?",
+                          ((date.today() - timedelta(days=retention_days)).isoformat(),))
+
+        latest = self.conn.execute("SELECT MAX(run_date) FROM stages WHERE region = ?", (region,)).fetchone()[0]
+        if (resume or not new_run) and latest:
+            self.run_date = latest
+            logging.info(f"{'Resuming' if resume else 'Continuing'} the {region} run of {latest} from {path}")
+        else:
+            if resume or not new_run:
+                logging.info(f"No earlier {region} run in {path} to resume; starting a new run")
+            self.run_date = date.today().isoformat()
+            self.conn.execute("DELETE FROM stages WHERE region = ? AND run_date = ?", (region, self.run_date))
+        self.conn.commit()
+
+    def finished(self, tenant_id, schema_name, stage):
+        """Whether a stage is recorded as finished when resuming; does not check a report's file."""
+        if not self.resume:
+            return False
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM stages "
+                "WHERE region = ? AND run_date = ? AND tenant_id = ? AND schema_name = ? AND stage = ?",
+                (self.region, self.run_date, tenant_id, schema_name, stage)
+            ).fetchone() is not None
+
+    def get(self, tenant_id, schema_name, stage):
+        """
+        Artifact of a finished stage when resuming, else None.
+
+        A render is only considered finished while its PDF still exists.
+        """
+        if not self.resume:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT artifact FROM stages "
+                "WHERE region = ? AND run_date = ? AND tenant_id = ? AND schema_name = ? AND stage = ?",
+                (self.region, self.run_date, tenant_id, schema_name, stage)
+            ).fetchone()
+        if row is None:
+            return None
+        artifact = pickle.loads(row[0])
+        if stage == 'render' and not os.path.exists(artifact):
+            return None
+        with self.lock:
+            self.reused[stage] += 1
+        return artifact
+
+    def artifacts(self, stage):
+        """Artifacts of every customer that finished stage in this run, ordered by tenant."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT artifact FROM stages WHERE region = ? AND run_date = ? AND stage = ? "
+                "ORDER BY tenant_id, schema_name",
+                (self.region, self.run_date, stage)
+            ).fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+
+    def put(self, tenant_id, schema_name, stage, artifact):
+        """Record a finished stage and its artifact."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO stages (region, run_date, tenant_id, schema_name, stage, artifact, "
+                "finished_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.region, self.run_date, tenant_id, schema_name, stage,
+                 pickle.dumps(artifact, protocol=pickle.HIGHEST_PROTOCOL), time.time())
+            )
+            self.conn.commit()
+            self.recorded[stage] += 1
+
+    def log_stats(self):
+        reused = ', '.join(f"{count} {stage}" for stage, count in self.reused.items())
+        recorded = ', '.join(f"{count} {stage}" for stage, count in self.recorded.items())
+        logging.info(f"Run manifest {self.region} {self.run_date}: reused {reused}; recorded {recorded}")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,282 @@
+# utils/telemetry.py
+"""
+Per-stage timing and resource telemetry of a run.
+
+Spans time one unit of work (fetching one tenant's metrics, one LLM analysis,
+one report) and are tagged with the region and tenant. Durations are kept per
+span name and region, together with error counts, counters such as LLM tokens
+and the slowest spans with their tags. At the end of a run the data is written
+as a JSON summary and as a Prometheus textfile (for node_exporter's textfile
+collector) with one histogram per span name and region.
+
+Region worker processes return TELEMETRY.snapshot() with their summary and
+the parent merges it, so the output covers every region.
+"""
+
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds in seconds of the Prometheus histogram buckets
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SLOWEST_SPANS = 10
+METRIC_PREFIX = 'tenant_health'
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process and of its finished child processes, in bytes."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Telemetry:
+    """Thread-safe collector of spans and counters."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}  # (span name, region) -> list of seconds
+            self.errors = {}  # (span name, region) -> count
+            self.counters = {}  # (counter name, region) -> value
+            self.slowest = {}  # span name -> min-heap of (seconds, sequence, tags)
+            self.workers = {}  # span name -> concurrent workers running it
+            self.sequence = 0
+            self.peak_rss = None
+
+    def record(self, name, seconds, error=False, **tags):
+        """
+        Record a span measured elsewhere, e.g. a report rendered in another process.
+
+        :param name: Span name, e.g. 'generate_report'
+        :param seconds: Duration in seconds
+        :param error: Whether the work failed
+        :param tags: Tags such as region and tenant_id; extra attributes are kept for the slowest spans
+        """
+        key = (name, tags.get('region'))
+        with self.lock:
+            self.durations.setdefault(key, []).append(seconds)
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self.sequence += 1
+            slowest = self.slowest.setdefault(name, [])
+            entry = (seconds, self.sequence, tags)
+            if len(slowest) < SLOWEST_SPANS:
+                heapq.heappush(slowest, entry)
+            elif seconds > slowest[0][0]:
+                heapq.heapreplace(slowest, entry)
+
+    @contextmanager
+    def span(self, name, **tags):
+        """
+        Time the enclosed block as one span.
+
+        Yields the span's tags dict; attributes added to it (such as
+        usage_tokens) are recorded with the span.
+        """
+        started = time.perf_counter()
+        error = False
+        try:
+            yield tags
+        except GeneratorExit:
+            raise  # A generator closed early, e.g. a customer stream, did not fail
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started, error, **tags)
+
+    def count(self, name, value=1, region=None):
+        """Add value to a counter, e.g. count('llm_tokens', 1200, region='EU')."""
+        with self.lock:
+            self.counters[(name, region)] = self.counters.get((name, region), 0) + value
+
+    def set_workers(self, name, workers):
+        """Declare how many workers run a span concurrently, used to compute stage utilization."""
+        with self.lock:
+            self.workers[name] = workers
+
+    def snapshot(self):
+        """Picklable copy of the collected data, merged into another collector with merge()."""
+        with self.lock:
+            return {
+                'durations': {key: list(values) for key, values in self.durations.items()},
+                'errors': dict(self.errors),
+                'counters': dict(self.counters),
+                'slowest': {name: list(entries) for name, entries in self.slowest.items()},
+                'workers': dict(self.workers),
+                'peak_rss': max(filter(None, [self.peak_rss, peak_rss_bytes()]), default=None),
+            }
+
+    def merge(self, snapshot):
+        """Add the data of a snapshot taken in another process."""
+        with self.lock:
+            for key, values in snapshot['durations'].items():
+                self.durations.setdefault(key, []).extend(values)
+            for key, value in snapshot['errors'].items():
+                self.errors[key] = self.errors.get(key, 0) + value
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, entries in snapshot['slowest'].items():
+                for seconds, _, tags in entries:
+                    # Sequence numbers of other processes are not unique here
+                    self.sequence += 1
+                    slowest = self.slowest.setdefault(name, [])
+                    if len(slowest) < SLOWEST_SPANS:
+                        heapq.heappush(slowest, (seconds, self.sequence, tags))
+                    elif seconds > slowest[0][0]:
+                        heapq.heapreplace(slowest, (seconds, self.sequence, tags))
+            self.workers.update(snapshot['workers'])
+            self.peak_rss = max(filter(None, [self.peak_rss, snapshot['peak_rss']]), default=None)
+
+    def summary(self):
+        """
+        JSON-serializable summary: per span and region count, errors, total and
+        p50/p95/max seconds, plus utilization of the declared stage workers
+        over the region's process_region span.
+
+        :return: Dict with spans, counters, slowest spans, bottleneck and peak_rss_bytes
+        """
+        snapshot = self.snapshot()
+        wall = {region: sum(values) for (name, region), values in snapshot['durations'].items()
+                if name == 'process_region'}
+        spans = []
+        for (name, region), values in sorted(snapshot['durations'].items(), key=lambda item: str(item[0])):
+            ordered = sorted(values)
+            entry = {
+                'span': name,
+                'region': region,
+                'count': len(ordered),
+                'errors': snapshot['errors'].get((name, region), 0),
+                'total_seconds': round(sum(ordered), 3),
+                'p50_seconds': round(percentile(ordered, 50), 4),
+                'p95_seconds': round(percentile(ordered, 95), 4),
+                'max_seconds': round(ordered[-1], 4),
+            }
+            workers = snapshot['workers'].get(name)
+            if workers and wall.get(region):
+                entry['utilization'] = round(sum(ordered) / (wall[region] * workers), 3)
+            spans.append(entry)
+
+        busiest = max((entry for entry in spans if 'utilization' in entry),
+                      key=lambda entry: entry['utilization'], default=None)
+        return {
+            'spans': spans,
+            'counters': [{'counter': name, 'region': region, 'value': value}
+                         for (name, region), value in sorted(snapshot['counters'].items(), key=str)],
+            'slowest': {name: [dict(tags, seconds=round(seconds, 4))
+                               for seconds, _, tags in sorted(entries, key=lambda entry: -entry[0])]
+                        for name, entries in snapshot['slowest'].items()},
+            'bottleneck': {'span': busiest['span'], 'region': busiest['region'],
+                           'utilization': busiest['utilization']} if busiest else None,
+            'peak_rss_bytes': snapshot['peak_rss'],
+        }
+
+    def prometheus_text(self):
+        """Render the collected data in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_span_duration_seconds Duration of pipeline spans.",
+            f"# TYPE {METRIC_PREFIX}_span_duration_seconds histogram",
+        ]
+        for (name, region), values in sorted(snapshot['durations'].items(), key=str):
+            labels = _labels(span=name, region=region)
+            for bound in HISTOGRAM_BUCKETS:
+                lines.append(f"{METRIC_PREFIX}_span_duration_seconds_bucket{{{labels},le=\"{bound}\"}} "
+                             f"{sum(1 for value in values if value <= bound)}")
+            lines.append(f"{METRIC_PREFIX}_span_duration_seconds_bucket{{{labels},le=\"+Inf\"}} {len(values)}")
+            lines.append(f"{_series(f'{METRIC_PREFIX}_span_duration_seconds_sum', span=name, region=region)} "
+                         f"{sum(values):.6f}")
+            lines.append(f"{_series(f'{METRIC_PREFIX}_span_duration_seconds_count', span=name, region=region)} "
+                         f"{len(values)}")
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_span_errors_total Spans that raised an error.",
+            f"# TYPE {METRIC_PREFIX}_span_errors_total counter",
+        ]
+        for (name, region) in sorted(snapshot['durations'], key=str):
+            lines.append(f"{_series(f'{METRIC_PREFIX}_span_errors_total', span=name, region=region)} "
+                         f"{snapshot['errors'].get((name, region), 0)}")
+
+        for name in sorted({name for name, _ in snapshot['counters']}):
+            lines += [f"# TYPE {METRIC_PREFIX}_{name}_total counter"]
+            for (counter, region), value in sorted(snapshot['counters'].items(), key=str):
+                if counter == name:
+                    lines.append(f"{_series(f'{METRIC_PREFIX}_{name}_total', region=region)} {value}")
+
+        if snapshot['peak_rss'] is not None:
+            lines += [
+                f"# HELP {METRIC_PREFIX}_peak_rss_bytes Peak resident set size of the run.",
+                f"# TYPE {METRIC_PREFIX}_peak_rss_bytes gauge",
+                f"{METRIC_PREFIX}_peak_rss_bytes {snapshot['peak_rss']}",
+            ]
+        lines += [
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Time the run finished.",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds {time.time():.0f}",
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_path=None, prometheus_path=None):
+        """Write the JSON summary and/or the Prometheus textfile, each replaced atomically."""
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.summary(), indent=2, default=str))
+            logging.info(f"Telemetry summary saved to: {json_path}")
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.prometheus_text())
+            logging.info(f"Prometheus metrics saved to: {prometheus_path}")
+
+    def log_summary(self):
+        summary = self.summary()
+        for entry in summary['spans']:
+            utilization = f", {entry['utilization']:.0%} of workers busy" if 'utilization' in entry else ''
+            logging.info(f"Span {entry['span']} ({entry['region'] or 'all regions'}): {entry['count']} call(s), "
+                         f"{entry['errors']} error(s), p50 {entry['p50_seconds']}s, p95 {entry['p95_seconds']}s, "
+                         f"max {entry['max_seconds']}s{utilization}")
+        if summary['bottleneck']:
+            logging.info(f"Busiest stage: {summary['bottleneck']['span']} in {summary['bottleneck']['region']}")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items() if value is not None)
+
+
+def _series(name, **labels):
+    labels = _labels(**labels)
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def _write_atomic(path, text):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
+
+
+TELEMETRY = Telemetry()